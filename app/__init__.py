@@ -1,55 +1,69 @@
-from flask import Flask
 import logging
 import os
-from logging.handlers import RotatingFileHandler
-
-def setup_logging():
-    """配置日志系统"""
-    # 确保logs目录存在
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    # 配置应用日志
-    app_logger = logging.getLogger('app')
-    app_logger.setLevel(logging.DEBUG)
-    app_handler = RotatingFileHandler(
-        'logs/app.log',
-        maxBytes=1024 * 1024,  # 1MB
-        backupCount=10
-    )
-    app_handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    ))
-    app_logger.addHandler(app_handler)
-    
-    # 配置API日志
-    api_logger = logging.getLogger('api')
-    api_logger.setLevel(logging.DEBUG)
-    api_handler = RotatingFileHandler(
-        'logs/api.log',
-        maxBytes=1024 * 1024,  # 1MB
-        backupCount=10
-    )
-    api_handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    ))
-    api_logger.addHandler(api_handler)
+import threading
+from app.config import load_environment
+
+# 在任何子模块读取 os.getenv 之前加载 .env
+load_environment()
+
+def create_app(warm_up=None):
+    # Flask 和日志管道只在创建应用时导入，只使用模型的脚本和测试不需要付出这部分导入开销
+    from flask import Flask
+    from app.utils.log_pipeline import setup_logging
+    from app.resources import create_resources
+    from app.utils.assets import init_assets
+    from app.utils.compression import init_compression
 
-def create_app():
     # 设置日志
     setup_logging()
     logger = logging.getLogger('app')
-    
+
     logger.info("Creating Flask application...")
     app = Flask(__name__,
         template_folder='templates',
         static_folder='static'
     )
-    
+
+    # 开发者设置
+    app.config['USE_AI_TALENTS'] = os.getenv('USE_AI_TALENTS', 'false').lower() == 'true'
+
+    # Coze 客户端、会话存储等资源在首次使用时创建（或在 preload_resources 中提前创建）
+    app.extensions['resources'] = create_resources()
+
+    # 静态资源：压缩、按内容哈希命名并预压缩，较大的 JSON 响应用 gzip 发送
+    init_assets(app)
+    init_compression(app)
+
     logger.info("Registering blueprints...")
     # 注册蓝图
     from app.routes import main_bp
     app.register_blueprint(main_bp)
-    
+
+    # 后台预热到 Coze 的连接，不阻塞启动
+    # 多进程部署时由 worker 在 fork 之后自己预热（见 gunicorn.conf.py）
+    if warm_up is None:
+        warm_up = os.getenv('COZE_WARMUP', 'true').lower() == 'true'
+    if warm_up:
+        from app.utils.http_client import get_http_client
+        threading.Thread(target=get_http_client().warm_up, name='coze-warmup', daemon=True).start()
+
     logger.info("Application created successfully!")
-    return app 
\ No newline at end of file
+    return app
+
+
+def preload_resources(app):
+    """
+    在 fork worker 之前创建全部资源并加载只读数据，worker 通过写时复制共享同一份内存：
+    Coze 客户端、会话存储、城市表、天赋池和编译后的模板。
+    """
+    from app.utils.data_loader import load_city_data
+    from app.models.talents import talent_registry
+
+    logger = logging.getLogger('app')
+    app.extensions['resources'].warm_up()
+    cities = load_city_data()
+    for template in ('index.html', 'game.html'):
+        app.jinja_env.get_template(template)
+    logger.info(
+        f"Preloaded {len(cities)} cities, {talent_registry.stats()['local']} talents and templates"
+    )
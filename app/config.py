@@ -1,33 +1,33 @@
 """
-这个文件是项目的配置文件,主要负责:
+这个文件负责加载项目配置，主要负责:
 
 1. 环境变量管理:
-   - 使用python-dotenv加载.env文件中的环境变量
-   - 提供默认值作为fallback选项
+   - 使用python-dotenv加载.env文件中的环境变量，整个进程只加载一次
+   - 已经存在的环境变量优先于.env文件中的值
 
-2. 应用配置:
-   - 设置Flask应用的调试模式(DEBUG)
-   - 配置数据文件的路径(CSV文件位置)
-   - 其他全局配置项
-
-3. 配置分离:
-   - 将配置从代码中分离出来,便于管理和修改
-   - 支持不同环境(开发、测试、生产)使用不同配置
+2. 加载时机:
+   - 导入 app 包时自动调用 load_environment()，
+     因此各模块在导入时通过 os.getenv 读取的配置都能看到.env中的值
+   - gunicorn.conf.py 等在导入应用之前需要读取配置的入口也可以直接调用
 
 使用方式:
-1. 在.env文件中设置环境变量
-2. 通过Config类访问配置项
-3. 在需要时可以继承Config类创建不同环境的配置类
+1. 在.env文件中设置环境变量（参考.env.example）
+2. 各模块通过 os.getenv 读取配置并提供默认值
 """
 
-import os
+import threading
 from dotenv import load_dotenv
 
-load_dotenv()
+_loaded = False
+_load_lock = threading.Lock()
+
 
-class Config:
-    DEBUG = True
-    
-    # 数据文件路径配置
-    CITY_DATA_PATH = os.getenv('CITY_DATA_PATH', 'app/data/city_data.csv')
-    TALENTS_DATA_PATH = os.getenv('TALENTS_DATA_PATH', 'app/data/talents.csv') 
\ No newline at end of file
+def load_environment():
+    """加载.env文件（重复调用无副作用）"""
+    global _loaded
+    if _loaded:
+        return
+    with _load_lock:
+        if not _loaded:
+            load_dotenv()
+            _loaded = True
@@ -16,13 +16,22 @@
    - 从天赋池中随机选择3个天赋
    - 应用天赋效果来调整基础属性值
 
-主要通过generate_random_attributes_and_city()函数来生成一个完整的角色属性组合。
+5. 批量生成：
+   - 使用 NumPy 一次生成 N 个角色，分布与逐个生成一致
+   - NumPy 只在批量生成时导入，不增加应用的启动时间
+
+主要通过generate_random_attributes_and_city()函数来生成一个完整的角色属性组合，
+批量场景（机器人、压测、多次重随）使用generate_characters_batch()。
 """
 
 
 import random
-from app.models.talents import generate_random_talents
-from app.utils.data_loader import load_city_data
+from app.models.talents import generate_random_talents, get_talent_pool, talent_registry
+from app.utils.data_loader import load_city_data, get_city_table, build_alias_table, CITY_PROBABILITY_FIELDS
+
+# 家境档位对应的家境值，顺序与 CITY_PROBABILITY_FIELDS 一致
+# 土豪、穷鬼、正常、特别穷、特别富贵
+WEALTH_TIER_VALUES = (5, -3, 0, -5, 10)
 
 # 初始属性
 attributes = {
@@ -32,45 +41,146 @@ attributes = {
     "家境": 0
 }
 
-def generate_random_attributes_and_city(city_data):
-    available_points = 15
+ATTRIBUTE_NAMES = tuple(attributes)
+ALLOCATED_ATTRIBUTES = ('颜值', '智力', '体质')  # 随机分配点数的属性
+ATTRIBUTE_POINTS = 15   # 可分配点数
+ATTRIBUTE_CAP = 20      # 分配时单个属性的上限
+TALENT_COUNT = 3        # 每个角色的天赋数量
+
+def generate_random_attributes_and_city(city_data, talents=None):
+    """
+    随机生成一个角色。
+
+    参数：
+    city_data: 城市表
+    talents: 已经选好的天赋（Talent 列表，例如 AI 天赋），为空时从本地天赋池抽取
+
+    返回值：
+    tuple: (属性字典, 天赋名称列表, 城市名称)
+    """
+    available_points = ATTRIBUTE_POINTS
     attributes_copy = attributes.copy()
 
     # 随机分配属性点
     while available_points > 0:
-        random_attr = random.choice(['颜值', '智力', '体质'])
-        if attributes_copy[random_attr] < 20:
+        random_attr = random.choice(ALLOCATED_ATTRIBUTES)
+        if attributes_copy[random_attr] < ATTRIBUTE_CAP:
             attributes_copy[random_attr] += 1
             available_points -= 1
 
     # 选择天赋
-    selected_talents, selected_talent_objects = generate_random_talents()
+    if talents is None:
+        selected_talents, selected_talent_objects = generate_random_talents()
+        talents = [talent_registry.get(name) for name in selected_talents]
+    else:
+        selected_talents = [talent.label for talent in talents]
     
     # 选择城市和计算家境
     city = random.choice(city_data)
     attributes_copy['家境'] = calculate_wealth(city)
 
     # 应用天赋效果
-    for talent in selected_talent_objects:
-        talent_effect = talent["effect"]
-        for key, value in talent_effect.items():
-            attributes_copy[key] += value
+    for talent in talents:
+        talent.apply(attributes_copy)
 
     return attributes_copy, selected_talents, city['city']
 
 def calculate_wealth(city):
-    rand_value = random.random()
-    wealth = 0
+    table = get_city_table()
+    index = table.index_of(city)
+    if index is not None:
+        return WEALTH_TIER_VALUES[table.sample_tier(index)]
     
-    if rand_value < city['wealthy_chance']:
-        wealth = 5
-    elif rand_value < city['wealthy_chance'] + city['poor_chance']:
-        wealth = -3
-    elif rand_value < city['wealthy_chance'] + city['poor_chance'] + city['normal_chance']:
-        wealth = 0
-    elif rand_value < city['wealthy_chance'] + city['poor_chance'] + city['normal_chance'] + city['very_poor_chance']:
-        wealth = -5
+    # 不是城市表中的记录（例如调用方自己构造的字典），临时构建别名表
+    prob, alias = build_alias_table([city[field] for field in CITY_PROBABILITY_FIELDS])
+    column = random.randrange(len(prob))
+    tier = column if random.random() < prob[column] else alias[column]
+    return WEALTH_TIER_VALUES[tier]
+
+
+def _allocate_points(rng, count):
+    """
+    批量分配属性点。
+
+    逐点分配时每个点均匀落在未满的属性上；这里先做多项分布抽样，
+    再把超出上限的点数在未满的属性之间继续均匀分配，直到没有溢出。
+    """
+    import numpy as np
+
+    n_attrs = len(ALLOCATED_ATTRIBUTES)
+    if ATTRIBUTE_POINTS > n_attrs * ATTRIBUTE_CAP:
+        raise ValueError("Not enough attribute capacity for the available points")
+
+    points = rng.multinomial(ATTRIBUTE_POINTS, [1.0 / n_attrs] * n_attrs, size=count)
+    overflow = np.clip(points - ATTRIBUTE_CAP, 0, None).sum(axis=1)
+    points = np.minimum(points, ATTRIBUTE_CAP)
+    while overflow.any():
+        rows = np.flatnonzero(overflow)
+        open_slots = points[rows] < ATTRIBUTE_CAP
+        pvals = open_slots / open_slots.sum(axis=1, keepdims=True)
+        extra = rng.multinomial(overflow[rows], pvals)
+        points[rows] += extra
+        overflow[:] = 0
+        overflow[rows] = np.clip(points[rows] - ATTRIBUTE_CAP, 0, None).sum(axis=1)
+        points = np.minimum(points, ATTRIBUTE_CAP)
+    return points
+
+
+def generate_characters_batch(city_data, count, rng=None):
+    """
+    一次生成 count 个角色。
+
+    参数：
+    city_data: 城市表（load_city_data() 的返回值）
+    count: 角色数量
+    rng: numpy.random.Generator，为空时新建
+
+    返回值：
+    list: 每个元素为 {"attributes": ..., "talents": ..., "city": ...}
+    """
+    import numpy as np
+
+    rng = rng or np.random.default_rng()
+    if count <= 0:
+        return []
+
+    # 属性点分配，列顺序与 ATTRIBUTE_NAMES 一致
+    stats = np.zeros((count, len(ATTRIBUTE_NAMES)), dtype=np.int64)
+    allocated = [ATTRIBUTE_NAMES.index(name) for name in ALLOCATED_ATTRIBUTES]
+    stats[:, allocated] = _allocate_points(rng, count)
+
+    # 不放回地抽取天赋：每行随机排列后取前 TALENT_COUNT 个
+    talent_pool = get_talent_pool()
+    effect_matrix = np.array(
+        [[talent["effect"].get(name, 0) for name in ATTRIBUTE_NAMES] for talent in talent_pool],
+        dtype=np.int64
+    )
+    talent_idx = np.argsort(rng.random((count, len(talent_pool))), axis=1)[:, :TALENT_COUNT]
+
+    # 城市和家境：按别名表向量化抽取家境档位
+    table = city_data if hasattr(city_data, 'alias_tables') else None
+    if table is not None:
+        alias_tables = table.alias_tables()
     else:
-        wealth = 10
-        
-    return wealth 
\ No newline at end of file
+        alias_tables = [build_alias_table([city[field] for field in CITY_PROBABILITY_FIELDS])
+                        for city in city_data]
+    prob = np.array([t[0] for t in alias_tables])
+    alias = np.array([t[1] for t in alias_tables])
+    city_idx = rng.integers(len(city_data), size=count)
+    column = rng.integers(prob.shape[1], size=count)
+    accept = rng.random(count) < prob[city_idx, column]
+    tier = np.where(accept, column, alias[city_idx, column])
+    stats[:, ATTRIBUTE_NAMES.index('家境')] = np.asarray(WEALTH_TIER_VALUES)[tier]
+
+    # 应用天赋效果
+    stats += effect_matrix[talent_idx].sum(axis=1)
+
+    names = [talent["name"] for talent in talent_pool]
+    characters = []
+    for row, talents, ci in zip(stats.tolist(), talent_idx.tolist(), city_idx.tolist()):
+        characters.append({
+            "attributes": dict(zip(ATTRIBUTE_NAMES, row)),
+            "talents": [names[i] for i in talents],
+            "city": city_data[ci]['city']
+        })
+    return characters
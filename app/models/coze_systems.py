@@ -14,9 +14,16 @@
    - 处理消息链
    - 管理消息效果
    - 处理角色状态
+
+4. 异步版本：
+   - AsyncCozeSystems 提供 async 接口，供异步路由使用
+   - Flask 在 worker 线程中为每个请求运行一个事件循环，异步带来的是请求内的并发，
+     每个进程同时进行的请求数仍然受线程数限制
+   - process_turn 把一年的事件和微信消息合并为一次调用，两个工作流并发执行
 """
 
-from app.utils.coze_api import CozeAPI
+from app.utils.coze_api import CozeAPI, AsyncCozeAPI
+from app.models.talents import talent_registry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,52 +32,70 @@ class CozeSystems:
     def __init__(self):
         self.api = CozeAPI()
         
-    def process_talents(self):
+    def process_talents(self, game_state=None):
         """处理天赋系统返回的数据"""
-        talents = self.api.get_random_talents()
-        # 解析天赋效果，转换为属性变化
-        processed_talents = []
-        for talent in talents:
-            name, effect = self._parse_talent_string(talent)
-            processed_talents.append({
-                "name": name,
-                "effect": effect
-            })
-        return processed_talents
+        talents = self.api.get_random_talents(game_state)
+        return self._build_talents(talents)
     
-    def process_event(self, context=None):
+    def _build_talents(self, talents):
+        """解析天赋字符串，返回 Talent 列表"""
+        return [talent_registry.parse(talent) for talent in talents]
+    
+    def process_event(self, context=None, game_state=None, session_id=None):
         """
         处理事件系统返回的数据
         
         参数：
         context: dict, 包含角色状态和历史信息
+        game_state: GameState, 当前会话的游戏状态（为空时使用默认状态）
+        session_id: str, 会话ID（用于事件预取）
         """
         if not context:
             return []
         
-        # 确保属性值正确转换
-        if 'attributes' in context:
-            attrs = context['attributes']
-            context.update({
-                'appearance': attrs.get('颜值', ''),
-                'intelligence': attrs.get('智力', ''),
-                'physical': attrs.get('体质', ''),
-                'wealth': attrs.get('家境', '')
-            })
+        self._map_attributes(context)
         
-        events = self.api.generate_event(context)
+        events = self.api.generate_event(context, game_state, session_id)
         return events
     
-    def process_messages(self, context=None):
+    def process_messages(self, context=None, game_state=None):
         """
         处理微信系统返回的数据
         
         参数：
         context: dict, 包含角色状态和历史消息
+        game_state: GameState, 当前会话的游戏状态（为空时使用默认状态）
         """
         if not context:
             return []
         
+        self._map_attributes(context)
+        
+        messages = self.api.get_wechat_messages(context, game_state)
+        if messages:
+            logger.info(f"Generated messages: {messages}")
+        return messages
+    
+    def stream_event(self, context=None, game_state=None, session_id=None):
+        """流式处理事件系统的数据，产出 (类型, 数据)"""
+        if not context:
+            raise ValueError("Missing event context")
+        
+        self._map_attributes(context)
+        
+        yield from self.api.stream_event(context, game_state, session_id)
+    
+    def stream_messages(self, context=None, game_state=None):
+        """流式处理微信系统的数据，产出 (类型, 数据)"""
+        if not context:
+            raise ValueError("Missing message context")
+        
+        self._map_attributes(context)
+        
+        yield from self.api.stream_wechat_messages(context, game_state)
+    
+    def _map_attributes(self, context):
+        """把中文属性字典转换为 Coze 使用的参数名"""
         # 确保属性值正确转换
         if 'attributes' in context:
             attrs = context['attributes']
@@ -80,25 +105,60 @@ class CozeSystems:
                 'physical': attrs.get('体质', ''),
                 'wealth': attrs.get('家境', '')
             })
+    
+    def _parse_talent_string(self, talent_str):
+        """解析天赋字符串，提取名称和效果"""
+        # 示例："明眸皓齿（颜值+3，智力-1）" -> ("明眸皓齿", {"颜值": 3, "智力": -1})
+        talent = talent_registry.parse(talent_str)
+        return talent.name, dict(talent.effect)
+
+
+class AsyncCozeSystems(CozeSystems):
+    """CozeSystems 的异步版本"""
+
+    def __init__(self):
+        self.api = AsyncCozeAPI()
+
+    async def process_talents(self, game_state=None):
+        """处理天赋系统返回的数据"""
+        talents = await self.api.get_random_talents(game_state)
+        return self._build_talents(talents)
+
+    async def process_event(self, context=None, game_state=None, session_id=None):
+        """处理事件系统返回的数据"""
+        if not context:
+            return []
         
-        messages = self.api.get_wechat_messages(context)
+        self._map_attributes(context)
+        
+        events = await self.api.generate_event(context, game_state, session_id)
+        return events
+
+    async def process_messages(self, context=None, game_state=None):
+        """处理微信系统返回的数据"""
+        if not context:
+            return []
+        
+        self._map_attributes(context)
+        
+        messages = await self.api.get_wechat_messages(context, game_state)
         if messages:
             logger.info(f"Generated messages: {messages}")
         return messages
-    
-    def _parse_talent_string(self, talent_str):
-        """解析天赋字符串，提取名称和效果"""
-        # 示例："明眸皓齿（颜值+3）" -> ("明眸皓齿", {"颜值": 3})
-        name = talent_str.split('（')[0]
-        effect_str = talent_str.split('（')[1].rstrip('）')
-        
-        # 解析效果
-        effect = {}
-        if '+' in effect_str:
-            attr, value = effect_str.split('+')
-            effect[attr] = int(value)
-        elif '-' in effect_str:
-            attr, value = effect_str.split('-')
-            effect[attr] = -int(value)
-            
-        return name, effect 
\ No newline at end of file
+
+    async def process_turn(self, context, wechat_contexts=(), game_state=None, session_id=None):
+        """
+        处理一回合的事件和微信消息
+
+        参数：
+        context: dict, 事件上下文
+        wechat_contexts: list, 每个联系人的微信上下文
+        """
+        if not context:
+            raise ValueError("Missing event context")
+        
+        self._map_attributes(context)
+        for wechat_context in wechat_contexts:
+            self._map_attributes(wechat_context)
+        
+        return await self.api.play_turn(context, wechat_contexts, game_state, session_id)
@@ -1,12 +1,16 @@
 """
 这个模块负责维护parameters参数
+
+为了让每回合的开销不随人生长度增长，状态采用紧凑的表示：
+- 使用 __slots__，属性值保存为 int
+- 事件和消息历史是定长环形缓冲区，条目为 (年龄, 内容)
+- 发给 Coze 的历史字符串在追加时增量维护，get_parameters() 不再重新拼接
 """
 
 import os
-from dotenv import load_dotenv
-
-# 加载环境变量
-load_dotenv()
+import sys
+from collections import deque
+from app.utils.metrics import timed, PARAMETERS_LATENCY
 
 # 从环境变量获取配置，如果没有则使用默认值
 INITIAL_AGE = int(os.getenv('GAME_INITIAL_AGE', 14))
@@ -15,92 +19,187 @@ DEFAULT_CITY = os.getenv('GAME_DEFAULT_CITY', '北京')
 MAX_HISTORY = int(os.getenv('GAME_MAX_HISTORY', 30))
 MAX_STATS = int(os.getenv('GAME_MAX_STATS', 20))
 
+HISTORY_SEPARATOR = "；"
+STAT_FIELDS = ('appearance', 'intelligence', 'physical', 'wealth')
+
+
+class HistoryBuffer:
+    """定长历史记录，同时增量维护用分隔符拼接好的字符串"""
+
+    __slots__ = ('entries', 'total', 'digest', 'folded', '_lengths', '_text')
+
+    def __init__(self, maxlen):
+        self.entries = deque(maxlen=maxlen)   # (年龄, 内容)
+        self.total = 0                         # 累计追加过的条目数
+        self.digest = deque()                  # 较早条目的摘要（由 HistoryCompactor 维护）
+        self.folded = 0                        # 已经并入摘要的条目数
+        self._lengths = deque(maxlen=maxlen)  # 每个条目序列化后的长度
+        self._text = ""
+
+    def append(self, age, text, serialized):
+        """追加一条记录，serialized 为它在历史字符串中的形式"""
+        if len(self.entries) == self.entries.maxlen:
+            # 去掉最旧的条目及其后的分隔符
+            self._text = self._text[self._lengths[0] + len(HISTORY_SEPARATOR):]
+        self.entries.append((age, text))
+        self._lengths.append(len(serialized))
+        self._text = f"{self._text}{HISTORY_SEPARATOR}{serialized}" if self._text else serialized
+        self.total += 1
+
+    @property
+    def text(self):
+        return self._text
+
+    def tail(self, count):
+        """最近 count 条记录的序列化形式，从旧到新"""
+        count = min(count, len(self.entries))
+        parts = []
+        end = len(self._text)
+        for i in range(1, count + 1):
+            length = self._lengths[-i]
+            parts.append(self._text[end - length:end])
+            end -= length + len(HISTORY_SEPARATOR)
+        parts.reverse()
+        return parts
+
+    def entry(self, seq):
+        """按累计序号取条目，已经被挤出缓冲区时返回 None"""
+        index = seq - (self.total - len(self.entries))
+        if 0 <= index < len(self.entries):
+            return self.entries[index]
+        return None
+
+    def mark(self):
+        """回滚用的快照：条目都是不可变的元组和字符串，只复制容器"""
+        return (tuple(self.entries), tuple(self._lengths), self._text, self.total,
+                tuple(self.digest), self.folded)
+
+    def rollback(self, mark):
+        """原地恢复到 mark() 时的内容（保持缓冲区对象不变）"""
+        entries, lengths, self._text, self.total, digest, self.folded = mark
+        self.entries.clear()
+        self.entries.extend(entries)
+        self._lengths.clear()
+        self._lengths.extend(lengths)
+        self.digest.clear()
+        self.digest.extend(digest)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory_usage(self):
+        size = sys.getsizeof(self.entries) + sys.getsizeof(self._lengths) + sys.getsizeof(self._text)
+        for entry in self.entries:
+            size += sys.getsizeof(entry) + sys.getsizeof(entry[1])
+        size += sys.getsizeof(self.digest) + sum(sys.getsizeof(item) for item in self.digest)
+        return size
+
+
 class GameState:
+    __slots__ = (
+        'name', 'sex', 'age', 'appearance', 'intelligence', 'physical', 'wealth', 'city',
+        'character', 'characters', 'talents', 'events', 'messages',
+        'max_history', 'max_stats', '_characters_text', 'version'
+    )
+
     def __init__(self):
         # 基础属性
         self.name = "新玩家"
         self.sex = "男"
-        self.age = str(INITIAL_AGE)
-        self.appearance = str(INITIAL_STATS)
-        self.intelligence = str(INITIAL_STATS)
-        self.physical = str(INITIAL_STATS)
-        self.wealth = str(INITIAL_STATS)
+        self.age = INITIAL_AGE
+        self.appearance = INITIAL_STATS
+        self.intelligence = INITIAL_STATS
+        self.physical = INITIAL_STATS
+        self.wealth = INITIAL_STATS
         self.city = DEFAULT_CITY
-        
+
         # 游戏进程相关
         self.character = ""  # 当前对话的角色
         self.characters = set()  # 已解锁的角色集合
+        self._characters_text = ""  # 排序拼接后的角色列表，None 表示需要重建
         self.talents = []    # 天赋列表
-        self.events = []     # 事件历史
-        self.messages = []   # 消息历史
-        
+
         self.max_history = MAX_HISTORY  # 历史记录最大保留数量
         self.max_stats = MAX_STATS      # 属性最大值
 
+        self.events = HistoryBuffer(self.max_history)    # 事件历史
+        self.messages = HistoryBuffer(self.max_history)  # 消息历史
+
+        self.version = 0  # 状态版本，每次请求修改状态后加一（见 app/models/state_delta.py）
+
     def update_state(self, **kwargs):
         """更新游戏状态"""
         for key, value in kwargs.items():
-            if hasattr(self, key):
-                if key == 'character':
-                    # 当前对话角色
-                    self.character = str(value) if value else ""
-                elif key == 'characters':
-                    # 处理角色列表
-                    if isinstance(value, str):
-                        # 如果是字符串，按逗号分割并过滤空值
-                        new_chars = {x.strip() for x in value.split(',') if x.strip()}
-                        self.characters.update(new_chars)
-                    elif isinstance(value, (list, set)):
-                        # 如果是列表或集合，直接更新
-                        self.characters.update(value)
-                    elif isinstance(value, dict):
-                        # 如果是字典（来自角色效果），提取角色名称
-                        if 'name' in value:
-                            self.characters.add(value['name'])
-                elif key == 'talents' and isinstance(value, list):
+            if key == 'character':
+                # 当前对话角色
+                self.character = str(value) if value else ""
+            elif key == 'characters':
+                # 处理角色列表
+                if isinstance(value, str):
+                    # 如果是字符串，按逗号分割并过滤空值
+                    self._add_characters(x.strip() for x in value.split(',') if x.strip())
+                elif isinstance(value, (list, set)):
+                    # 如果是列表或集合，直接更新
+                    self._add_characters(value)
+                elif isinstance(value, dict):
+                    # 如果是字典（来自角色效果），提取角色名称
+                    if 'name' in value:
+                        self.add_character(value['name'])
+            elif key == 'talents':
+                if isinstance(value, list):
                     self.talents = value
-                elif key == 'events' and isinstance(value, str):
-                    self.events.append(value)
-                    if len(self.events) > self.max_history:
-                        self.events = self.events[-self.max_history:]
-                elif key == 'messages' and isinstance(value, str):
-                    self.messages.append(value)
-                    if len(self.messages) > self.max_history:
-                        self.messages = self.messages[-self.max_history:]
-                elif key in ['appearance', 'intelligence', 'physical', 'wealth']:
-                    # 确保属性值在合理范围内
-                    try:
-                        value = max(0, min(self.max_stats, int(value)))
-                        setattr(self, key, str(value))
-                    except ValueError:
-                        pass  # 如果转换失败，保持原值不变
-                else:
-                    setattr(self, key, value)
+            elif key == 'events':
+                if isinstance(value, str):
+                    self._append_event(value)
+            elif key == 'messages':
+                if isinstance(value, str):
+                    self._append_message(value)
+            elif key in STAT_FIELDS:
+                # 确保属性值在合理范围内
+                try:
+                    setattr(self, key, max(0, min(self.max_stats, int(value))))
+                except (TypeError, ValueError):
+                    pass  # 如果转换失败，保持原值不变
+            elif key == 'age':
+                try:
+                    self.age = int(value)
+                except (TypeError, ValueError):
+                    pass
+            elif key in ('name', 'sex', 'city'):
+                setattr(self, key, value)
+
+    def apply_effects(self, effects):
+        """把事件效果（如 {"intelligence": 2}）计入属性，结果限制在 0 到 max_stats"""
+        for attr, value in (effects or {}).items():
+            key = attr.lower()
+            if key in STAT_FIELDS and type(value) in (int, float):
+                setattr(self, key, max(0, min(self.max_stats, int(getattr(self, key) + value))))
 
     def add_event(self, event):
         """添加新事件到历史记录"""
         if not event:
             return
-            
+
         # 移除可能存在的年龄前缀
         age_prefix = f"{self.age}岁："
         if event.startswith(age_prefix):
             event = event[len(age_prefix):]
-        
+
         # 替换事件内容中的年龄引用
-        event = event.replace(f"{int(self.age)-1} 岁", f"{self.age}岁")
-        event = event.replace(f"{int(self.age)-1}岁", f"{self.age}岁")
-        
+        event = event.replace(f"{self.age - 1} 岁", f"{self.age}岁")
+        event = event.replace(f"{self.age - 1}岁", f"{self.age}岁")
+
         # 添加到事件列表
-        self.events.append(event)
-        if len(self.events) > self.max_history:
-            self.events = self.events[-self.max_history:]
+        self._append_event(event)
 
     def add_message(self, message):
         """添加新消息到历史记录"""
         if not message:
             return
-            
+
         # 统一消息格式：{年龄}岁 {发送者}: [{内容}] [{时间}]
         if not message.startswith(f"{self.age}岁"):
             if '[' in message and ']' in message:
@@ -109,44 +208,105 @@ class GameState:
             else:
                 # 完全格式化消息
                 message = f"{self.age}岁 {message.split(':')[0]}: [{message.split(':')[1].strip()}] [当天]"
-            
-        self.messages.append(message)
-        if len(self.messages) > self.max_history:
-            self.messages = self.messages[-self.max_history:]
+
+        self._append_message(message)
 
     def add_character(self, character_name, relationship=None):
         """添加新角色"""
-        if character_name:
+        if character_name and character_name not in self.characters:
             self.characters.add(character_name)
+            self._characters_text = None
 
     def remove_character(self, character_name):
         """移除角色（禁用）"""
         if character_name in self.characters:
             self.characters.remove(character_name)
+            self._characters_text = None
+
+    def _add_characters(self, names):
+        for name in names:
+            self.add_character(name)
+
+    def _append_event(self, event):
+        # 空事件不进入历史
+        if not event.strip():
+            return
+        # 事件在历史字符串中的形式：{年龄}岁：{内容}
+        prefix = f"{self.age}岁："
+        serialized = event if event.startswith(prefix) else f"{prefix}{event}"
+        self.events.append(self.age, event, serialized)
 
+    def _append_message(self, message):
+        if not message.strip():
+            return
+        # 确保消息格式：{年龄}岁 {发送者}: [{内容}] [{时间}]
+        serialized = message
+        if not message.split(' ', 1)[0].endswith('岁'):
+            serialized = f"{self.age}岁 {message}"
+        self.messages.append(self.age, message, serialized)
+
+    @timed(PARAMETERS_LATENCY)
     def get_parameters(self):
         """获取当前游戏状态的参数"""
-        event_history = []
-        message_history = []
-        
-        # 添加事件历史，过滤掉空事件
-        for event in self.events:
-            if event.strip():  # 只添加非空事件
-                # 确保年龄引用正确
-                event_text = event
-                if not event_text.startswith(f"{self.age}岁："):
-                    event_text = f"{self.age}岁：{event_text}"
-                event_history.append(event_text)
-        
-        # 添加消息历史，确保包含时间和年龄信息
-        for message in self.messages:
-            if message.strip():  # 只添加非空消息
-                # 确保消息格式：{年龄}岁 {发送者}: [{内容}] [{时间}]
-                parts = message.split(' ', 1)  # 分割年龄和其他部分
-                if not parts[0].endswith('岁'):
-                    message = f"{self.age}岁 {message}"
-                message_history.append(message)
-        
+        if self._characters_text is None:
+            self._characters_text = ",".join(sorted(self.characters))
+
+        return {
+            "name": self.name,
+            "sex": self.sex,
+            "age": str(self.age),
+            "appearance": str(self.appearance),
+            "intelligence": str(self.intelligence),
+            "physical": str(self.physical),
+            "wealth": str(self.wealth),
+            "city": self.city,
+            "character": self.character,
+            "characters": self._characters_text,
+            "talents": self.talents,
+            "events": self.events.text,
+            "messages": self.messages.text
+        }
+
+    def memory_usage(self):
+        """估算本状态占用的内存字节数"""
+        size = sys.getsizeof(self)
+        for slot in ('name', 'sex', 'city', 'character', '_characters_text'):
+            size += sys.getsizeof(getattr(self, slot))
+        size += sys.getsizeof(self.characters) + sum(sys.getsizeof(c) for c in self.characters)
+        size += sys.getsizeof(self.talents) + sum(sys.getsizeof(t) for t in self.talents)
+        size += self.events.memory_usage() + self.messages.memory_usage()
+        return size
+
+    def reset(self):
+        """重置游戏状态"""
+        self.__init__()
+
+    def restore(self, snapshot):
+        """用快照（copy.deepcopy 得到的 GameState）整体替换当前状态，用于出错时回滚"""
+        for slot in self.__slots__:
+            setattr(self, slot, getattr(snapshot, slot))
+
+    def snapshot(self):
+        """
+        请求开始时的回滚快照，与 rollback() 配合使用。
+
+        比 copy.deepcopy 便宜：属性按值保存，角色集合和天赋列表只复制容器，
+        历史记录只保存缓冲区的 mark()。
+        """
+        return ({slot: getattr(self, slot) for slot in self.__slots__},
+                set(self.characters), list(self.talents), self.events.mark(), self.messages.mark())
+
+    def rollback(self, snapshot):
+        """恢复到 snapshot() 时的状态；历史缓冲区原地恢复，会话日志仍能按增量记录"""
+        slots, self.characters, self.talents, events, messages = snapshot
+        for slot, value in slots.items():
+            if slot not in ('characters', 'talents'):
+                setattr(self, slot, value)
+        self.events.rollback(events)
+        self.messages.rollback(messages)
+
+    def to_dict(self):
+        """导出可序列化的状态快照（用于会话存储）"""
         return {
             "name": self.name,
             "sex": self.sex,
@@ -157,12 +317,41 @@ class GameState:
             "wealth": self.wealth,
             "city": self.city,
             "character": self.character,
-            "characters": ",".join(sorted(self.characters)) if self.characters else "",
-            "talents": self.talents,
-            "events": "；".join(filter(None, event_history)) if event_history else "",  # 过滤空字符串
-            "messages": "；".join(filter(None, message_history)) if message_history else ""  # 过滤空字符串
+            "characters": sorted(self.characters),
+            "talents": list(self.talents),
+            "events": [list(entry) for entry in self.events],
+            "messages": [list(entry) for entry in self.messages],
+            "version": self.version,
+            "history": {
+                key: [buffer.total, buffer.folded, list(buffer.digest)]
+                for key, buffer in (('events', self.events), ('messages', self.messages))
+            }
         }
 
-    def reset(self):
-        """重置游戏状态"""
-        self.__init__() 
\ No newline at end of file
+    @classmethod
+    def from_dict(cls, data):
+        """从状态快照恢复游戏状态"""
+        state = cls()
+        for key in ('name', 'sex', 'city', 'character'):
+            if key in data:
+                setattr(state, key, data[key])
+        state.update_state(**{k: data[k] for k in ('age',) + STAT_FIELDS if k in data})
+        state._add_characters(data.get('characters', []))
+        state.talents = list(data.get('talents', []))
+        state.version = data.get('version', 0)
+        current_age = state.age
+        for key, append in (('events', state._append_event), ('messages', state._append_message)):
+            for entry in data.get(key, []):
+                # 兼容旧格式：条目只有内容，没有年龄
+                if isinstance(entry, str):
+                    state.age, text = current_age, entry
+                else:
+                    state.age, text = entry
+                append(text)
+        state.age = current_age
+        for key, (total, folded, digest) in data.get('history', {}).items():
+            buffer = getattr(state, key)
+            buffer.total = max(buffer.total, total)
+            buffer.folded = folded
+            buffer.digest.extend(digest)
+        return state
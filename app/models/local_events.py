@@ -0,0 +1,123 @@
+"""
+这个文件负责本地事件引擎，在 Coze 事件工作流超时或出错时生成事件。主要功能包括：
+
+1. 事件表：
+   - 事件模板来自 app/data/local_events.csv
+   - 每条模板有年龄范围、权重、触发条件（属性阈值、城市）和效果
+
+2. 条件抽取：
+   - 按当前年龄、属性和城市筛选可用模板
+   - 按权重随机抽取，尽量避开最近已经出现过的事件
+   - 没有可用模板时（例如自定义事件表没覆盖到当前年龄）使用内置的通用事件，
+     保证合法的状态总能生成事件
+
+3. 输出格式：
+   - 与 CozeAPI._handle_event_response() 返回的结构一致
+     （briefDescription、content、effects、age、triggers），前端无需区分来源
+"""
+
+import re
+import random
+import logging
+from app.utils.data_loader import load_local_event_data
+
+logger = logging.getLogger('app')
+
+STAT_KEYS = ('appearance', 'intelligence', 'physical', 'wealth')
+
+_CONDITION = re.compile(r'^\s*(appearance|intelligence|physical|wealth)\s*(>=|<=|>|<|==)\s*(-?\d+)\s*$')
+_COMPARATORS = {
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+    '==': lambda a, b: a == b
+}
+
+# 事件表里没有可用模板时使用的通用事件
+GENERIC_TEMPLATE = {
+    'min_age': 0,
+    'max_age': None,
+    'weight': 1.0,
+    'requirements': '',
+    'checks': [],
+    'briefDescription': '平凡的一年',
+    'content': '{age}岁这一年没有什么大事发生，日子照常过去。',
+    'effects': {}
+}
+
+
+def parse_requirements(text):
+    """
+    把触发条件字符串编译为判断函数列表。
+
+    支持以分号分隔的多个条件：
+    - 属性阈值：intelligence>=14、wealth<=8
+    - 城市：city=北京|上海
+    """
+    checks = []
+    for part in filter(None, (p.strip() for p in (text or '').split(';'))):
+        if part.startswith('city='):
+            cities = frozenset(c.strip() for c in part[len('city='):].split('|') if c.strip())
+            checks.append(lambda state, cities=cities: state.city in cities)
+            continue
+        match = _CONDITION.match(part)
+        if match is None:
+            raise ValueError(f"Invalid local event requirement: {part}")
+        attr, op, value = match.group(1), _COMPARATORS[match.group(2)], int(match.group(3))
+        checks.append(lambda state, attr=attr, op=op, value=value: op(getattr(state, attr), value))
+    return checks
+
+
+class LocalEventEngine:
+    """基于事件表的本地事件生成器"""
+
+    def __init__(self, templates=None, rng=None):
+        self.templates = []
+        for template in (templates if templates is not None else load_local_event_data()):
+            template = dict(template)
+            template['checks'] = parse_requirements(template.get('requirements'))
+            template['effects'] = {k: v for k, v in template['effects'].items() if k in STAT_KEYS}
+            self.templates.append(template)
+        self.rng = rng or random.Random()
+        self.generated = 0
+
+    def candidates(self, state):
+        """当前状态下可以触发的模板"""
+        return [
+            t for t in self.templates
+            if t['min_age'] <= state.age <= t['max_age'] and all(check(state) for check in t['checks'])
+        ]
+
+    def generate(self, state):
+        """
+        生成一个事件，并像 Coze 事件一样记录到游戏状态。
+
+        返回值：
+        dict: 事件数据，结构与 Coze 事件一致
+        """
+        candidates = self.candidates(state)
+        if not candidates:
+            logger.warning(f"No local event template for age {state.age}, using the generic event")
+            candidates = [GENERIC_TEMPLATE]
+
+        # 避开最近的事件，全部出现过时再放开
+        recent = {text for _, text in state.events}
+        fresh = [t for t in candidates if self._render(t, state) not in recent]
+        pool = fresh or candidates
+        template = self.rng.choices(pool, weights=[t['weight'] for t in pool])[0]
+
+        content = self._render(template, state)
+        state.add_event(content)
+        self.generated += 1
+        return {
+            'briefDescription': template['briefDescription'],
+            'content': content,
+            'effects': dict(template['effects']),
+            'age': str(state.age),
+            'triggers': {}
+        }
+
+    @staticmethod
+    def _render(template, state):
+        return template['content'].format(age=state.age, city=state.city, name=state.name)
@@ -0,0 +1,146 @@
+"""
+这个模块负责增量协议：完整的游戏状态只保存在服务端，客户端每次只发送状态版本和本次的变化，主要功能包括：
+
+1. 版本检查：
+   - GameState.version 在每次修改状态的请求成功后加一
+   - 请求中的版本与服务端不一致时抛出 StateConflict，路由返回 409、当前版本和状态
+
+2. 增量转换：
+   - 把增量转换为原有接口使用的上下文，事件和消息的处理流程不变
+   - 事件：{"age": 年龄}，省略时为下一年
+   - 微信：{"character": 联系人, "message": 玩家发出的消息（可省略）}
+   - 回合：{"age": 年龄, "wechat": [微信增量, ...]}
+
+3. 新人生：
+   - start_life() 用开局数据重置会话状态，版本继续递增，旧页面的请求会得到 409
+
+请求格式：
+    {"version": 3, "delta": {"age": 5}}              # 增量协议
+    {"context": {...}}                                # 旧协议：完整上下文，不检查版本
+"""
+
+from app.models.game_state import STAT_FIELDS
+
+MAX_AGE = 150
+MAX_NAME_LENGTH = 64
+MAX_MESSAGE_LENGTH = 500
+
+# 开局数据中的中文属性名
+ATTRIBUTE_NAMES = {'颜值': 'appearance', '智力': 'intelligence', '体质': 'physical', '家境': 'wealth'}
+
+
+class DeltaError(ValueError):
+    """增量格式错误"""
+
+
+class StateConflict(Exception):
+    """请求基于的状态版本与服务端不一致"""
+
+    def __init__(self, state):
+        super().__init__(f"State version is {state.version}")
+        self.version = state.version
+        self.state = client_state(state)
+
+
+def client_state(state):
+    """客户端显示需要的状态（冲突时用来同步）"""
+    result = {
+        "name": state.name,
+        "sex": state.sex,
+        "age": state.age,
+        "city": state.city,
+        "talents": list(state.talents)
+    }
+    result.update((key, getattr(state, key)) for key in STAT_FIELDS)
+    return result
+
+
+def check_version(state, version):
+    """版本不一致时抛出 StateConflict"""
+    if type(version) is not int:
+        raise DeltaError("version must be an integer")
+    if version != state.version:
+        raise StateConflict(state)
+
+
+def commit(state):
+    """状态修改完成，递增并返回新版本"""
+    state.version += 1
+    return state.version
+
+
+def commit_event(state, event):
+    """把事件效果计入服务端状态并递增版本，返回带新版本号的事件"""
+    state.apply_effects(event.get('effects'))
+    return dict(event, version=commit(state))
+
+
+def _expect_text(delta, key, max_length, required=False):
+    value = delta.get(key)
+    if value is None or value == '':
+        if required:
+            raise DeltaError(f"delta.{key} is required")
+        return ''
+    if not isinstance(value, str) or len(value) > max_length:
+        raise DeltaError(f"delta.{key} must be a string of at most {max_length} characters")
+    return value
+
+
+def _expect_age(delta, state):
+    age = delta.get('age', state.age + 1)
+    if type(age) is not int or not 0 <= age <= MAX_AGE:
+        raise DeltaError(f"delta.age must be an integer between 0 and {MAX_AGE}")
+    return age
+
+
+def event_context(state, delta):
+    """事件增量 -> 事件上下文"""
+    context = {'age': str(_expect_age(delta, state))}
+    # 属性已经在服务端，带上它们是为了让事件预取按同样的上下文推算下一年
+    context.update((key, str(getattr(state, key))) for key in STAT_FIELDS)
+    return context
+
+
+def message_context(state, delta, age=None):
+    """微信增量 -> 微信上下文，玩家发出的消息记入消息历史"""
+    character = _expect_text(delta, 'character', MAX_NAME_LENGTH, required=True)
+    message = _expect_text(delta, 'message', MAX_MESSAGE_LENGTH)
+    context = {'character': character, 'characters': character}
+    if message:
+        context['messages'] = f"{state.age if age is None else age}岁 {state.name}: [{message}]"
+    return context
+
+
+def turn_context(state, delta):
+    """回合增量 -> (事件上下文, [微信上下文, ...])"""
+    wechat = delta.get('wechat', [])
+    if not isinstance(wechat, list) or not all(isinstance(item, dict) for item in wechat):
+        raise DeltaError("delta.wechat must be a list of objects")
+    context = event_context(state, delta)
+    age = int(context['age'])
+    return context, [message_context(state, item, age) for item in wechat]
+
+
+def start_life(state, data):
+    """
+    用开局数据（与 index.html 保存的 gameData 相同）重置会话状态。
+
+    返回值：
+    int: 新人生的状态版本
+    """
+    attributes = data.get('attributes') or {}
+    talents = data.get('talents') or []
+    if not isinstance(attributes, dict) or not isinstance(talents, list):
+        raise DeltaError("attributes must be an object and talents a list")
+
+    version = state.version
+    state.reset()
+    for key in ('name', 'sex', 'city'):
+        value = data.get(key)
+        if isinstance(value, str) and value:
+            state.update_state(**{key: value[:MAX_NAME_LENGTH]})
+    state.update_state(**{ATTRIBUTE_NAMES[name]: value for name, value in attributes.items() if name in ATTRIBUTE_NAMES})
+    state.update_state(talents=[str(talent) for talent in talents])
+    # 版本不从 0 重新开始，旧人生的请求不会与新人生的版本相同
+    state.version = version
+    return commit(state)
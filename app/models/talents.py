@@ -9,15 +9,159 @@
    - 从天赋池中随机选择3个天赋
    - 返回天赋名称列表和完整的天赋对象列表
 
+3. 天赋注册表：
+   - 本地天赋池（talents.csv）和 AI 生成的天赋统一由 TalentRegistry 管理
+   - AI 天赋字符串（例如 "明眸皓齿（颜值+3，智力-1）"）用预编译的正则解析，
+     支持多个效果、全角/半角括号和正负号
+   - 解析结果按原始字符串缓存（有上限，先进先出淘汰），AI 反复给出相同天赋时直接查表
+   - talents.csv 在第一次用到天赋时才读取，导入本模块不读文件
+
 该模块与属性系统紧密配合，通过天赋效果来调整角色的基础属性值。
 """
 
+import os
+import re
+import sys
 import random
+import logging
+import threading
+from types import MappingProxyType
 from app.utils.data_loader import load_talent_data
 
-# 使用data_loader加载天赋数据
-talent_pool = load_talent_data()
+logger = logging.getLogger('app')
+
+TALENT_CACHE_SIZE = int(os.getenv('TALENT_CACHE_SIZE', 1024))
+
+TALENT_ATTRIBUTES = ('颜值', '智力', '体质', '家境')
+
+# 名称（效果1，效果2）——括号可以是全角或半角
+_TALENT_PATTERN = re.compile(r'^\s*(?P<name>.*?)\s*[（(](?P<effects>[^（）()]*)[）)]\s*$')
+# 空白不作为分隔符：AI 经常写成"颜值 +3"
+_EFFECT_SEPARATOR = re.compile(r'[，,、；;]+')
+# 属性 + 可选冒号 + 可选符号 + 数字，之间允许空白，\d 也匹配全角数字；
+# 一个片段里可以有多个只用空白隔开的效果（"家境+1 智力+1"）
+_EFFECT_PATTERN = re.compile(
+    r'(?P<attr>%s)\s*[:：]?\s*(?P<sign>[+＋\-－−]?)\s*(?P<value>\d+)' % '|'.join(TALENT_ATTRIBUTES)
+)
+_NEGATIVE_SIGNS = frozenset('-－−')
+
+_talent_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_talent_pool():
+    """本地天赋池（第一次调用时使用data_loader加载）"""
+    global _talent_pool
+    if _talent_pool is None:
+        with _pool_lock:
+            if _talent_pool is None:
+                _talent_pool = load_talent_data()
+    return _talent_pool
+
+
+class Talent:
+    """解析后的天赋（不可变，可在会话之间共享）"""
+
+    __slots__ = ('name', 'effect', 'label')
+
+    def __init__(self, name, effect, label=None):
+        self.name = sys.intern(name)
+        self.effect = MappingProxyType(dict(effect))  # 属性 -> 增减值
+        self.label = label or name                     # 展示给玩家的原始字符串
+
+    def apply(self, attributes):
+        """把天赋效果加到属性字典上"""
+        for attr, value in self.effect.items():
+            attributes[attr] = attributes.get(attr, 0) + value
+
+    def to_dict(self):
+        return {"name": self.name, "effect": dict(self.effect)}
+
+    def __repr__(self):
+        return f"Talent({self.label!r})"
+
+
+def parse_talent(text):
+    """
+    解析天赋字符串。
+
+    示例："明眸皓齿（颜值+3，智力-1）" -> Talent("明眸皓齿", {"颜值": 3, "智力": -1})
+    没有括号的字符串视为没有效果的天赋；无法识别的效果片段会被忽略并记录日志。
+    """
+    match = _TALENT_PATTERN.match(text)
+    if match is None:
+        return Talent(text.strip(), {}, text)
+
+    effect = {}
+    for fragment in filter(None, (f.strip() for f in _EFFECT_SEPARATOR.split(match.group('effects')))):
+        parts = list(_EFFECT_PATTERN.finditer(fragment))
+        if not parts or _EFFECT_PATTERN.sub('', fragment).strip():
+            logger.warning(f"Unrecognized talent effect '{fragment}' in '{text}'")
+            continue
+        for part in parts:
+            value = int(part.group('value'))
+            if part.group('sign') in _NEGATIVE_SIGNS:
+                value = -value
+            attr = part.group('attr')
+            effect[attr] = effect.get(attr, 0) + value
+    return Talent(match.group('name'), effect, text)
+
+
+class TalentRegistry:
+    """本地天赋池 + AI 天赋解析缓存"""
+
+    def __init__(self, pool=None, max_entries=TALENT_CACHE_SIZE):
+        self._pool = pool             # 为空时使用 get_talent_pool()
+        self._local = None            # 名称 -> Talent，第一次查询时构建
+        self._parsed = {}  # 原始字符串 -> Talent，按插入顺序淘汰
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _load_local(self):
+        pool = self._pool if self._pool is not None else get_talent_pool()
+        self._local = {talent["name"]: Talent(talent["name"], talent["effect"]) for talent in pool}
+        return self._local
+
+    def get(self, name):
+        """按名称查找本地天赋"""
+        local = self._local if self._local is not None else self._load_local()
+        return local.get(name)
+
+    def parse(self, text):
+        """解析天赋字符串，本地天赋和已解析过的字符串直接查表"""
+        local = self._local if self._local is not None else self._load_local()
+        talent = local.get(text) or self._parsed.get(text)
+        if talent is not None:
+            self.hits += 1
+            return talent
+        talent = parse_talent(text)
+        if not talent.effect and talent.name in local:
+            # AI 给出了本地天赋的名字但没写效果，使用本地定义
+            talent = local[talent.name]
+        with self._lock:
+            self.misses += 1
+            self._parsed[text] = talent
+            # 超出上限时淘汰最早解析的条目
+            while len(self._parsed) > self.max_entries:
+                del self._parsed[next(iter(self._parsed))]
+        return talent
+
+    def stats(self):
+        local = self._local if self._local is not None else self._load_local()
+        return {
+            "local": len(local),
+            "cached": len(self._parsed),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+talent_registry = TalentRegistry()
+
 
 def generate_random_talents():
-    selected_talents = random.sample(talent_pool, 3)
-    return [talent["name"] for talent in selected_talents], selected_talents 
\ No newline at end of file
+    selected_talents = random.sample(get_talent_pool(), 3)
+    return [talent["name"] for talent in selected_talents], selected_talents
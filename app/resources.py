@@ -0,0 +1,142 @@
+"""
+这个文件负责应用级资源的注册和懒加载，主要功能包括：
+
+1. 资源注册表：
+   - 每个资源对应一个工厂函数，首次访问时创建，之后复用同一个实例
+   - 工厂函数可以通过注册表取得它依赖的其他资源
+   - 每个 create_app() 拥有自己的注册表，存放在 app.extensions['resources']
+
+2. 懒加载与预热：
+   - 导入路由模块时不再创建 Coze 客户端和会话存储，缺少 workflow ID 等配置
+     只会让用到 Coze 的接口报错，不会让导入失败
+   - warm_up() 在启动阶段显式创建全部资源（serve.py 在 fork 之前调用）
+
+已注册的资源：
+- coze_systems / async_coze_systems: Coze 同步 / 异步接口
+- event_prefetcher: 事件预取器（PREFETCH_ENABLED 关闭时为 None）
+- session_store: 会话存储
+- idempotency_store: Idempotency-Key 请求结果
+- rate_limiter / admission_queue: 限流和 Coze 请求排队（关闭时为 None）
+- talent_buffer: AI 天赋缓冲队列
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('app')
+
+
+class ResourceRegistry:
+    """按名称注册、首次使用时创建的资源"""
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        # 工厂函数里会再取依赖的资源，使用可重入锁
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        """注册资源，factory 接收注册表本身作为参数"""
+        if name in self._factories:
+            raise ValueError(f"Duplicate resource: {name}")
+        self._factories[name] = factory
+
+    def get(self, name):
+        """取得资源，不存在时创建"""
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                factory = self._factories[name]
+                started = time.perf_counter()
+                self._instances[name] = factory(self)
+                logger.info(f"Initialized resource '{name}' in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return self._instances[name]
+
+    def peek(self, name):
+        """取得已经创建的资源，尚未创建时返回 None（不触发创建）"""
+        return self._instances.get(name)
+
+    def __getattr__(self, name):
+        factories = self.__dict__.get('_factories')
+        if factories is None or name not in factories:
+            raise AttributeError(name)
+        return self.get(name)
+
+    def warm_up(self, names=None):
+        """
+        提前创建资源。
+
+        创建失败只记录日志：缺少 Coze 配置时应用仍然可以启动，
+        用到该资源的请求会得到同样的错误。
+        """
+        for name in names or list(self._factories):
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.warning(f"Failed to initialize resource '{name}': {e}")
+
+
+def _coze_systems(resources):
+    from app.models.coze_systems import CozeSystems
+    from app.utils.prefetch import EventPrefetcher, PREFETCH_ENABLED
+
+    systems = CozeSystems()
+    # 事件预取在线程池中使用同步客户端
+    systems.api.prefetcher = EventPrefetcher(systems.api) if PREFETCH_ENABLED else None
+    return systems
+
+
+def _async_coze_systems(resources):
+    from app.models.coze_systems import AsyncCozeSystems
+
+    systems = AsyncCozeSystems()
+    systems.api.prefetcher = resources.event_prefetcher
+    return systems
+
+
+def _event_prefetcher(resources):
+    return resources.coze_systems.api.prefetcher
+
+
+def _session_store(resources):
+    from app.utils.session_store import create_session_store
+    return create_session_store()
+
+
+def _idempotency_store(resources):
+    from app.utils.idempotency import create_idempotency_store
+    return create_idempotency_store()
+
+
+def _rate_limiter(resources):
+    from app.utils.admission import create_rate_limiter
+    return create_rate_limiter()
+
+
+def _admission_queue(resources):
+    from app.utils.admission import create_admission_queue
+    return create_admission_queue()
+
+
+def _talent_buffer(resources):
+    from app.utils.talent_buffer import TalentBuffer
+    # AI 天赋在后台预先生成，首次取用时启动
+    return TalentBuffer(resources.coze_systems.process_talents)
+
+
+def create_resources():
+    """创建注册了全部应用资源的注册表"""
+    resources = ResourceRegistry()
+    resources.register('coze_systems', _coze_systems)
+    resources.register('async_coze_systems', _async_coze_systems)
+    resources.register('event_prefetcher', _event_prefetcher)
+    resources.register('session_store', _session_store)
+    resources.register('idempotency_store', _idempotency_store)
+    resources.register('rate_limiter', _rate_limiter)
+    resources.register('admission_queue', _admission_queue)
+    resources.register('talent_buffer', _talent_buffer)
+    return resources
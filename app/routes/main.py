@@ -1,11 +1,160 @@
+import os
+import re
+import math
+import time
+import uuid
 import logging
-from flask import jsonify, request, render_template
+from flask import jsonify, request, render_template, g, current_app, Response, stream_with_context
 from app.routes import main_bp
-from app.models.attributes import generate_random_attributes_and_city
+from app.models.attributes import generate_random_attributes_and_city, generate_characters_batch
 from app.utils.data_loader import load_city_data
-from app.models.coze_systems import CozeSystems
+from app.utils.session_store import SESSION_TTL
+from app.models.state_delta import (
+    DeltaError, StateConflict, check_version, commit, commit_event,
+    event_context, message_context, turn_context, start_life
+)
+from app.utils.idempotency import (
+    IDEMPOTENCY_HEADER, IDEMPOTENCY_KEY_PATTERN, IdempotencyConflict, request_fingerprint
+)
+from app.utils.sse import format_sse
+from app.utils.admission import ROUTE_CLASSES, ADMISSION_RETRY_AFTER, client_ip, is_coze_route
+from app.utils import metrics
 
-coze_systems = CozeSystems()
+logger = logging.getLogger('app')
+
+
+def resources():
+    """当前应用的资源注册表（Coze 接口、会话存储等，见 app/resources.py）"""
+    return current_app.extensions['resources']
+
+def _session_count():
+    store = resources().peek('session_store')
+    return store.stats()['sessions'] if store is not None else 0
+
+def _talent_buffer_size():
+    buffer = resources().peek('talent_buffer')
+    return len(buffer) if buffer is not None else 0
+
+def _prefetch_stat(key):
+    systems = resources().peek('coze_systems')
+    prefetcher = systems.api.prefetcher if systems is not None else None
+    return prefetcher.stats()[key] if prefetcher is not None else 0
+
+def _admission_stat(key):
+    queue = resources().peek('admission_queue')
+    return queue.stats()[key] if queue is not None else 0
+
+# 抓取 /metrics 时读取的状态指标（资源尚未创建时为 0）
+metrics.Gauge('lifesim_sessions', 'Stored game sessions').set_function(_session_count)
+metrics.Gauge('lifesim_talent_buffer_size', 'AI talent sets ready to serve').set_function(_talent_buffer_size)
+# 预取是否值得它的 Coze 开销：命中数与提交、丢弃数对比
+for _outcome, _key in (('submitted', 'submitted'), ('hit', 'hits'), ('miss', 'misses'), ('discarded', 'discarded')):
+    metrics.PREFETCH_EVENTS.labels(_outcome).set_function(lambda key=_key: _prefetch_stat(key))
+metrics.Gauge('lifesim_prefetch_pending', 'Speculative events generating or ready').set_function(
+    lambda: _prefetch_stat('pending'))
+metrics.Gauge('lifesim_admission_active', 'Coze-backed requests being handled').set_function(
+    lambda: _admission_stat('active'))
+metrics.Gauge('lifesim_admission_queued', 'Coze-backed requests waiting for a slot').set_function(
+    lambda: _admission_stat('queued'))
+
+SESSION_COOKIE_NAME = 'session_id'
+SESSION_HEADER_NAME = 'X-Session-Id'
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+MAX_BATCH_COUNT = 100  # /random_allocate?count=N 的上限
+# 一个回合最多同时请求的微信联系人数
+TURN_MAX_WECHAT = int(os.getenv('TURN_MAX_WECHAT', 3))
+
+@main_bp.before_request
+def load_session_id():
+    """从请求头或 cookie 中读取会话ID，没有则新建"""
+    session_id = request.headers.get(SESSION_HEADER_NAME) or request.cookies.get(SESSION_COOKIE_NAME)
+    if not session_id or not SESSION_ID_PATTERN.match(session_id):
+        session_id = uuid.uuid4().hex
+        g.new_session_id = session_id
+    g.session_id = session_id
+
+@main_bp.before_request
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    metrics.HTTP_IN_PROGRESS.labels(g.metrics_route).inc()
+
+def rejection(status, message, retry_after):
+    """429/503 响应，Retry-After 为整数秒"""
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": message, "retry_after": seconds})
+    response.status_code = status
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+@main_bp.before_request
+def admit_request():
+    """限流和过载保护：令牌用完返回 429，Coze 请求排队已满返回 503（在读取会话状态之前）"""
+    route = g.metrics_route
+    if route not in ROUTE_CLASSES:
+        return None
+    registry = resources()
+    limiter = registry.rate_limiter
+    if limiter is not None:
+        retry_after = limiter.check(route, g.session_id, client_ip(request.access_route, request.remote_addr))
+        if retry_after:
+            metrics.ADMISSION_DECISIONS.labels(route, 'throttled').inc()
+            return rejection(429, "Too many requests", retry_after)
+    queue = registry.admission_queue
+    if queue is not None and is_coze_route(route):
+        if not queue.acquire():
+            metrics.ADMISSION_DECISIONS.labels(route, 'shed').inc()
+            return rejection(503, "Server is busy, please retry later", ADMISSION_RETRY_AFTER)
+        g.admission_queue = queue
+    metrics.ADMISSION_DECISIONS.labels(route, 'allowed').inc()
+    return None
+
+@main_bp.after_request
+def hold_admission_slot_for_stream(response):
+    """流式响应在视图返回后才生成内容，名额保留到响应关闭"""
+    if response.is_streamed:
+        queue = g.pop('admission_queue', None)
+        if queue is not None:
+            response.call_on_close(queue.release)
+    return response
+
+@main_bp.teardown_request
+def release_admission_slot(exc):
+    queue = g.pop('admission_queue', None)
+    if queue is not None:
+        queue.release()
+
+@main_bp.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@main_bp.teardown_request
+def finish_request_metrics(exc):
+    route = g.get('metrics_route')
+    if route is None:
+        return
+    metrics.HTTP_IN_PROGRESS.labels(route).dec()
+    metrics.HTTP_LATENCY.labels(route).observe(time.perf_counter() - g.metrics_started)
+    status = 500 if exc is not None else g.get('metrics_status', 500)
+    metrics.HTTP_REQUESTS.labels(route, request.method, status).inc()
+
+@main_bp.after_request
+def save_session_id(response):
+    """新会话写入 cookie"""
+    if g.get('new_session_id'):
+        response.set_cookie(
+            SESSION_COOKIE_NAME,
+            g.new_session_id,
+            max_age=SESSION_TTL,
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @main_bp.route('/')
 def index():
@@ -14,30 +163,47 @@ def index():
 
 @main_bp.route('/random_allocate', methods=['GET'])
 def random_allocate():
+    count = request.args.get('count', type=int)
+    if count is not None:
+        return random_allocate_batch(count)
     try:
         cities = load_city_data()
-        # 首先尝试使用 coze天赋系统
+        # 首先尝试使用 coze天赋系统（从预生成的缓冲队列中取）
         try:
-            if current_app.config['USE_AI_TALENTS']:
-                coze_talents = coze_systems.process_talents()
+            if current_app.config.get('USE_AI_TALENTS'):
+                coze_talents = resources().talent_buffer.pop()
                 if coze_talents:
-                    attributes_copy, _, city = generate_random_attributes_and_city(cities)
+                    attributes_copy, talent_names, city = generate_random_attributes_and_city(cities, coze_talents)
                     return jsonify({
                         "attributes": attributes_copy,
-                        "talents": coze_talents,
+                        "talents": talent_names,
                         "city": city
                     })
+                metrics.FALLBACKS.labels('random_allocate', 'talent_buffer_empty').inc()
         except Exception as e:
+            metrics.FALLBACKS.labels('random_allocate', 'ai_error').inc()
             logger.warning(f"AI talent generation failed: {e}, falling back to local generation")
         
         # 如果 AI 生成失败或未启用，使用本地生成
         return generate_local_talents()
         
     except Exception as e:
+        metrics.FALLBACKS.labels('random_allocate', 'error').inc()
         logging.error(f"Error in random_allocate: {str(e)}")
         # 如果出现任何错误，也使用本地生成
         return generate_local_talents()
 
+def random_allocate_batch(count):
+    """批量生成角色（使用本地天赋池）"""
+    if count < 1 or count > MAX_BATCH_COUNT:
+        return jsonify({"error": f"count must be between 1 and {MAX_BATCH_COUNT}"}), 400
+    try:
+        characters = generate_characters_batch(load_city_data(), count)
+        return jsonify({"characters": characters})
+    except Exception as e:
+        logging.error(f"Error in batch generation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 def generate_local_talents():
     try:
         cities = load_city_data()
@@ -48,6 +214,7 @@ def generate_local_talents():
             "city": city
         })
     except Exception as e:
+        metrics.FALLBACKS.labels('random_allocate', 'default_character').inc()
         logging.error(f"Error in local talent generation: {str(e)}")
         # 返回最基础的默认值
         return jsonify({
@@ -61,37 +228,246 @@ def generate_local_talents():
             "city": "北京"
         })
 
+def idempotent_replay(scope):
+    """
+    处理 Idempotency-Key 请求头（需要在会话锁内调用）。
+
+    返回值：
+    重复的键返回之前结果的响应，键无效或冲突时返回错误响应；
+    其他情况返回 None，由调用方正常处理后调用 remember_result()
+    """
+    g.idempotency = None
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    if not IDEMPOTENCY_KEY_PATTERN.match(key):
+        return jsonify({"error": f"Invalid {IDEMPOTENCY_HEADER}"}), 400
+    fingerprint = request_fingerprint(request.get_json(silent=True))
+    try:
+        result = resources().idempotency_store.lookup(scope, g.session_id, key, fingerprint)
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+    if result is None:
+        g.idempotency = (scope, key, fingerprint)
+        return None
+    metrics.IDEMPOTENT_REPLAYS.labels(scope).inc()
+    response = jsonify(result)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def remember_result(result):
+    """保存成功的结果，同一个 Idempotency-Key 再次请求时直接返回"""
+    if g.get('idempotency') is not None:
+        scope, key, fingerprint = g.idempotency
+        resources().idempotency_store.save(scope, g.session_id, key, fingerprint, result)
+
+def request_context(game_state, build):
+    """
+    读取请求中的上下文（需要在会话锁内调用）。
+
+    增量协议 {"version": N, "delta": {...}} 先检查版本，再由 build 把增量转换为上下文；
+    旧协议 {"context": {...}} 直接使用完整上下文。
+    """
+    body = request.get_json(silent=True) or {}
+    if 'version' in body:
+        check_version(game_state, body['version'])
+        delta = body.get('delta') or {}
+        if not isinstance(delta, dict):
+            raise DeltaError("delta must be an object")
+        return build(game_state, delta)
+    return body.get('context', {})
+
+def conflict_response(conflict):
+    """409：客户端用返回的版本和状态同步后重新发送增量"""
+    return jsonify({"error": str(conflict), "version": conflict.version, "state": conflict.state}), 409
+
+def stream_error(error):
+    """流式接口无法再修改状态码，冲突和格式错误作为 error 消息发送"""
+    if isinstance(error, StateConflict):
+        return ('error', {"error": str(error), "status": 409, "version": error.version, "state": error.state})
+    return ('error', {"error": str(error), "status": 400})
+
+# 下面的异步视图由 Flask 在当前 worker 线程中运行到结束（async_to_sync），每个请求占用一个线程，
+# 异步只让同一请求内的多个 Coze 调用并发。会话锁是线程锁，await 期间一直持有，
+# 因此这些视图不能直接放到共享事件循环的 ASGI 服务器上运行。
 @main_bp.route('/generate_event', methods=['POST'])
-def generate_event():
+async def generate_event():
     try:
-        context = request.json.get('context', {})
-        event_data = coze_systems.process_event(context)
-        if not event_data:
-            raise ValueError("No event data received")
-        
+        registry = resources()
+        with registry.session_store.session(g.session_id) as game_state:
+            # 重复提交的请求直接返回第一次的结果，不会再次修改游戏状态
+            replay = idempotent_replay('generate_event')
+            if replay is not None:
+                return replay
+            context = request_context(game_state, event_context)
+            event_data = await registry.async_coze_systems.process_event(context, game_state, g.session_id)
+            if not event_data:
+                raise ValueError("No event data received")
+            event_data = commit_event(game_state, event_data)
+        # 状态写回成功后才保存结果（sqlite 后端写回时可能发现其他 worker 的修改）
+        remember_result(event_data)
         return jsonify(event_data)
+    except StateConflict as e:
+        return conflict_response(e)
+    except DeltaError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error in generate_event: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @main_bp.route('/get_messages', methods=['POST'])
-def get_messages():
+async def get_messages():
     try:
-        context = request.json.get('context', {})
-        messages = coze_systems.process_messages(context)
-        return jsonify({"messages": messages})
+        registry = resources()
+        with registry.session_store.session(g.session_id) as game_state:
+            replay = idempotent_replay('get_messages')
+            if replay is not None:
+                return replay
+            context = request_context(game_state, message_context)
+            # 微信对话会改变状态，之前推测的事件都不再有效
+            if registry.event_prefetcher is not None:
+                registry.event_prefetcher.discard(g.session_id)
+            messages = await registry.async_coze_systems.process_messages(context, game_state)
+            result = {"messages": messages, "version": commit(game_state)}
+        remember_result(result)
+        return jsonify(result)
+    except StateConflict as e:
+        return conflict_response(e)
+    except DeltaError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error in get_messages: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def legacy_turn_context(body):
+    """旧协议的回合请求：{"context": {...}, "wechat": [{...}, ...]}"""
+    context = body.get('context')
+    wechat_contexts = body.get('wechat', [])
+    if not isinstance(context, dict) or not context:
+        raise DeltaError("Missing event context")
+    if (not isinstance(wechat_contexts, list)
+            or not all(isinstance(item, dict) for item in wechat_contexts)):
+        raise DeltaError("wechat must be a list of contexts")
+    return context, wechat_contexts
+
+@main_bp.route('/turn', methods=['POST'])
+async def play_turn():
+    """一年的事件和微信消息合并为一次请求，两个工作流并发执行"""
+    try:
+        body = request.get_json(silent=True) or {}
+        registry = resources()
+        with registry.session_store.session(g.session_id) as game_state:
+            replay = idempotent_replay('turn')
+            if replay is not None:
+                return replay
+            if 'version' in body:
+                context, wechat_contexts = request_context(game_state, turn_context)
+            else:
+                context, wechat_contexts = legacy_turn_context(body)
+            if len(wechat_contexts) > TURN_MAX_WECHAT:
+                raise DeltaError(f"At most {TURN_MAX_WECHAT} wechat contexts per turn")
+            result = await registry.async_coze_systems.process_turn(
+                context, wechat_contexts, game_state, g.session_id
+            )
+            event = commit_event(game_state, result['event'])
+            result = {"event": event, "messages": result['messages'], "version": event['version']}
+        remember_result(result)
+        return jsonify(result)
+    except StateConflict as e:
+        return conflict_response(e)
+    except DeltaError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error in play_turn: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def sse_response(events):
+    """把 (类型, 数据) 序列包装成 SSE 响应"""
+    def generate():
+        try:
+            for kind, payload in events:
+                yield format_sse(kind, payload)
+        except (StateConflict, DeltaError) as e:
+            # 写回会话时发现其他 worker 已经修改了状态，客户端按 409 同步
+            yield format_sse(*stream_error(e))
+        except Exception as e:
+            logging.error(f"Error in event stream: {str(e)}")
+            yield format_sse('error', {"error": str(e)})
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@main_bp.route('/generate_event/stream', methods=['POST'])
+def generate_event_stream():
+    session_id = g.session_id
+    registry = resources()
+    
+    def events():
+        done = None
+        with registry.session_store.session(session_id) as game_state:
+            try:
+                context = request_context(game_state, event_context)
+            except (StateConflict, DeltaError) as e:
+                yield stream_error(e)
+                return
+            for kind, payload in registry.coze_systems.stream_event(context, game_state, session_id):
+                if kind == 'done':
+                    done = commit_event(game_state, payload)
+                else:
+                    yield (kind, payload)
+        # 客户端收到 done 就停止读取，状态写回成功后再发送
+        if done is not None:
+            yield ('done', done)
+    return sse_response(events())
+
+@main_bp.route('/get_messages/stream', methods=['POST'])
+def get_messages_stream():
+    session_id = g.session_id
+    registry = resources()
+    
+    def events():
+        done = None
+        with registry.session_store.session(session_id) as game_state:
+            try:
+                context = request_context(game_state, message_context)
+            except (StateConflict, DeltaError) as e:
+                yield stream_error(e)
+                return
+            if registry.event_prefetcher is not None:
+                registry.event_prefetcher.discard(session_id)
+            for kind, payload in registry.coze_systems.stream_messages(context, game_state):
+                if kind == 'done':
+                    done = {"messages": payload, "version": commit(game_state)}
+                else:
+                    yield (kind, payload)
+        if done is not None:
+            yield ('done', done)
+    return sse_response(events())
+
 @main_bp.route('/start_new_life', methods=['POST'])
 def start_new_life():
-    selected_city = request.json.get('city')
-    attributes_copy = request.json.get('attributes')
-    talents = request.json.get('talents')
+    data = request.get_json(silent=True) or {}
+    selected_city = data.get('city')
+    attributes_copy = data.get('attributes')
+    talents = data.get('talents') or []
+    
+    registry = resources()
+    try:
+        # 服务端保存这局的完整状态，之后的请求只需要发送版本和增量
+        with registry.session_store.session(g.session_id) as game_state:
+            version = start_life(game_state, data)
+    except StateConflict as e:
+        return conflict_response(e)
+    except DeltaError as e:
+        return jsonify({"error": str(e)}), 400
+    if registry.event_prefetcher is not None:
+        registry.event_prefetcher.discard(g.session_id)
     
     return jsonify({
-        "message": f"开始新人生，分配结果：{attributes_copy}, 城市: {selected_city}, 天赋: {', '.join(talents)}"
+        "message": f"开始新人生，分配结果：{attributes_copy}, 城市: {selected_city}, 天赋: {', '.join(map(str, talents))}",
+        "version": version
     })
 
 @main_bp.route('/game')
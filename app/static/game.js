@@ -0,0 +1,579 @@
+let gameData = null;  // 声明全局变量
+let stateVersion = null;  // 服务端状态版本，null 表示服务端还没有这局的状态（发送完整上下文）
+let lifeReady = Promise.resolve();
+
+// 在页面加载时初始化属性数据
+document.addEventListener('DOMContentLoaded', function() {
+    gameData = JSON.parse(localStorage.getItem('gameData'));
+    if (gameData) {
+        lifeReady = startNewLife();
+
+        // 更新基本信息
+        document.getElementById('player-name').textContent = gameData.name;
+        document.getElementById('player-gender').textContent = gameData.sex;
+
+        // 更新属性值
+        document.getElementById('intelligence').textContent = String(gameData.attributes.智力 || 10);
+        document.getElementById('physical').textContent = String(gameData.attributes.体质 || 10);
+        document.getElementById('appearance').textContent = String(gameData.attributes.颜值 || 10);
+        document.getElementById('wealth').textContent = String(gameData.attributes.家境 || 10);
+
+        // 可以添加其他初始化逻辑
+        console.log('玩家城市:', gameData.city);
+        console.log('玩家天赋:', gameData.talents);
+
+        // 初始化状态栏
+        document.getElementById('current-year').textContent = currentYear;
+        document.getElementById('current-round').textContent = '1';
+    }
+});
+
+// 添加事件折叠/展开功能
+function toggleEventDetail(header) {
+    const eventItem = header.parentElement;
+    eventItem.classList.toggle('expanded');
+}
+
+// 添加事件的函数
+function addEvent(year, age, effect, detail) {
+    const eventList = document.getElementById('event-list');
+    const eventItem = document.createElement('div');
+    eventItem.className = 'event-item expanded';  // 添加 expanded 类使其默认展开
+
+    eventItem.innerHTML = `
+      <div class="event-header" onclick="toggleEventDetail(this)">
+        <span class="event-year">${year}年</span>
+        <span class="event-age">${age}岁</span>
+        ${effect ? `<span class="event-effect">${effect}</span>` : ''}
+      </div>
+      <div class="event-detail">
+        ${detail}
+      </div>
+    `;
+
+    eventList.appendChild(eventItem);
+
+    // 自动滚动到新事件
+    eventItem.scrollIntoView({ behavior: 'smooth', block: 'end' });
+}
+
+let currentYear = 2025;
+let currentAge = -1;  // -1 表示未出生
+let isFirstClick = true;
+
+// 处理新消息
+function handleNewMessages(messages) {
+  if (!messages || !messages.length) return;
+
+  messages.forEach(message => {
+    // 检查是否需要创建新角色
+    if (message.fromCharacter) {
+      // 找到或创建这个角色的聊天记录
+      let contact = contacts.find(c => c.name === message.fromCharacter);
+      if (!contact) {
+        contact = {
+          name: message.fromCharacter,
+          messages: [],
+          unread: 0
+        };
+        contacts.push(contact);
+      }
+
+      // 添加消息
+      if (message.messageChain) {
+        message.messageChain.forEach(msg => {
+          contact.messages.push({
+            text: msg.text,
+            year: currentYear,
+            from: 'other',
+            effects: msg.effects,
+            hasEffect: msg.hasEffect
+          });
+        });
+
+        // 更新未读消息数
+        contact.unread += message.messageChain.length;
+
+        // 更新最新消息预览
+        const lastMessage = message.messageChain[message.messageChain.length - 1];
+        contact.message = lastMessage.text;
+
+        // 如果有回复选项，保存到消息中
+        if (message.responses) {
+          contact.messages[contact.messages.length - 1].responses = message.responses;
+        }
+      }
+
+      // 处理角色效果
+      if (message.characterEffect) {
+        contact.relationship = message.characterEffect.type;
+      }
+
+      // 如果当前正在与这个联系人聊天，立即更新聊天窗口
+      const currentContactName = document.getElementById('chat-contact-name');
+      if (currentContactName && currentContactName.textContent === contact.name) {
+        showChatWindow(contact);
+      }
+    }
+  });
+
+  // 刷新联系人列表
+  initChatList();
+
+  // 如果当前在社交界面，显示新消息提醒
+  const socialView = document.getElementById('social-view');
+  if (socialView.style.display !== 'none') {
+    socialView.classList.add('new-message');
+    setTimeout(() => {
+      socialView.classList.remove('new-message');
+    }, 1000);
+  }
+}
+
+function showChatWindow(contact) {
+  const chatWindow = document.getElementById('chat-window');
+  const chatContactName = document.getElementById('chat-contact-name');
+  const chatMessages = document.getElementById('chat-messages');
+
+  chatContactName.textContent = contact.name;
+  chatMessages.innerHTML = '';
+
+  // 按年份对消息进行分组并显示
+  const messagesByYear = {};
+  contact.messages.forEach(msg => {
+    const year = msg.year || currentYear;  // 如果没有年份，使用当前年份
+    if (!messagesByYear[year]) {
+      messagesByYear[year] = [];
+    }
+    messagesByYear[year].push(msg);
+  });
+
+  // 按年份显示消息
+  Object.keys(messagesByYear).sort().forEach(year => {
+    // 添加年份分隔线
+    const yearDivider = document.createElement('div');
+    yearDivider.className = 'year-divider';
+    yearDivider.innerHTML = `
+      <span class="year-text">${year}</span>
+      <div class="divider-line"></div>
+    `;
+    chatMessages.appendChild(yearDivider);
+
+    // 显示该年份的消息
+    messagesByYear[year].forEach(msg => {
+      const messageDiv = document.createElement('div');
+      messageDiv.className = `message ${msg.from === 'self' ? 'self' : 'other'}`;
+      messageDiv.innerHTML = `
+        <div class="message-content">
+          <p>${msg.text}</p>
+        </div>
+      `;
+      chatMessages.appendChild(messageDiv);
+    });
+  });
+
+  // 清除未读消息计数
+  contact.unread = 0;
+
+  // 显示聊天窗口
+  chatWindow.style.display = 'flex';
+
+  // 自动滚动到底部
+  chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+async function nextYear() {
+  try {
+    console.log('Current game data:', gameData);
+    // 检查是否达到游戏结束条件（例如80岁）
+    if (currentAge >= 80) {
+      alert('你已经度过了精彩的一生！游戏结束。');
+      document.getElementById('next-year-button').disabled = true;
+      return;
+    }
+
+    const button = document.getElementById('next-year-button');
+    button.disabled = true;
+
+    // 处理第一次点击（出生）
+    if (isFirstClick) {
+      currentAge = 0;
+      document.getElementById('current-age').textContent = '0岁';
+      button.textContent = '下一年';
+      isFirstClick = false;
+    } else {
+      currentAge++;
+      currentYear++;
+      document.getElementById('current-age').textContent = `${currentAge}岁`;
+      document.getElementById('current-year').textContent = `${currentYear}年`;
+    }
+
+    // 准备发送给后端的数据
+    const context = {
+      name: document.getElementById('player-name').textContent,
+      sex: document.getElementById('player-gender').textContent,
+      age: currentAge.toString(),
+      appearance: String(parseInt(document.getElementById('appearance').textContent) || 10),
+      intelligence: String(parseInt(document.getElementById('intelligence').textContent) || 10),
+      physical: String(parseInt(document.getElementById('physical').textContent) || 10),
+      wealth: String(parseInt(document.getElementById('wealth').textContent) || 10),
+      city: (gameData && gameData.city) || '北京',
+      character: gameData.character || '',
+      characters: gameData.characters || '',
+      events: gameData.events || '',
+      messages: gameData.messages || '',
+      talents: gameData.talents || []  // 添加天赋列表
+    };
+
+    const delta = { age: currentAge };
+    await lifeReady;
+
+    // 先创建事件元素，正文随流式结果逐步显示
+    const eventItem = document.createElement('div');
+    eventItem.className = 'event-item';
+    eventItem.innerHTML = `
+      <div class="event-header" onclick="toggleEventDetail(this)">
+        <span class="event-year">${currentYear}年</span>
+        <span class="event-age">${currentAge}岁</span>
+      </div>
+      <div class="event-detail"></div>
+    `;
+    const eventList = document.getElementById('event-list');
+    eventList.appendChild(eventItem);
+    const eventDetail = eventItem.querySelector('.event-detail');
+
+    let eventData;
+    try {
+      eventData = await fetchEventStream(stateBody(delta, context), text => {
+        eventDetail.textContent += text;
+      });
+      adoptVersion(eventData);
+    } catch (streamError) {
+      // 流式接口不可用或版本冲突时回退到普通接口（冲突在普通接口中同步后重试）
+      console.warn('流式获取事件失败，改用普通接口:', streamError);
+      eventDetail.textContent = '';
+      try {
+        eventData = await postState('/generate_event', delta, context);
+      } catch (error) {
+        eventItem.remove();
+        throw error;
+      }
+    }
+
+    if (!eventData || typeof eventData.content !== 'string') {
+      eventItem.remove();
+      throw new Error('事件数据格式错误');
+    }
+
+    // 应用事件效果
+    if (eventData.effects) {
+      Object.entries(eventData.effects).forEach(([attr, value]) => {
+        // 转换属性名称
+        const attrMap = {
+          'intelligence': 'intelligence',
+          'physical': 'physical',
+          'appearance': 'appearance',
+          'wealth': 'wealth'
+        };
+        const elementId = attrMap[attr.toLowerCase()];
+        const element = document.getElementById(elementId);
+        if (element) {
+          const currentValue = parseInt(element.textContent) || 0;
+          element.textContent = Math.max(0, Math.min(20, currentValue + value));
+        }
+      });
+    }
+
+    // 更新事件显示
+    eventItem.innerHTML = `
+      <div class="event-header" onclick="toggleEventDetail(this)">
+        <span class="event-year">${currentYear}年</span>
+        <span class="event-age">${currentAge}岁</span>
+        ${eventData.effects ? `<span class="event-effect">${formatEffects(eventData.effects)}</span>` : ''}
+      </div>
+      <div class="event-detail">
+        ${eventData.content}
+      </div>
+    `;
+
+    // 处理触发器（如微信消息等）
+    if (eventData.triggers && eventData.triggers.messages) {
+      handleNewMessages(eventData.triggers.messages);
+    }
+
+    // 自动滚动到新添加的事件
+    setTimeout(() => {
+      const eventList = document.getElementById('event-list');
+      eventList.scrollTo({
+        top: eventList.scrollHeight,
+        behavior: 'smooth'
+      });
+    }, 100);
+
+    button.disabled = false;
+  } catch (error) {
+    console.error('生成事件失败:', error);
+    console.error('错误详情:', { gameData, currentAge, currentYear });
+    alert('获取事件失败，请刷新页面重试');
+    button.disabled = false;
+  }
+}
+
+// 每次操作使用一个新的 Idempotency-Key；网络中断时用同一个键重试，服务端不会重复处理
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+async function postIdempotent(url, body, retries = 1) {
+  const key = newIdempotencyKey();
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': key
+        },
+        body: JSON.stringify(body)
+      });
+      // 服务端繁忙（503）或请求太快（429）时，按 Retry-After 等一会再重试，等待太久就交给调用方
+      const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+      if ((response.status === 429 || response.status === 503) && attempt < retries && retryAfter <= 10) {
+        console.warn(`请求 ${url} 被限流，${retryAfter} 秒后重试`);
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        continue;
+      }
+      return response;
+    } catch (error) {
+      if (attempt >= retries) {
+        throw error;
+      }
+      console.warn(`请求 ${url} 失败，重试中:`, error);
+    }
+  }
+}
+
+// 用开局数据在服务端建立这局的状态，之后的请求只发送版本和本次的变化
+async function startNewLife() {
+  try {
+    const response = await fetch('/start_new_life', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({
+        name: gameData.name,
+        sex: gameData.sex,
+        city: gameData.city,
+        attributes: gameData.attributes,
+        talents: gameData.talents || []
+      })
+    });
+    if (response.ok) {
+      adoptVersion(await response.json());
+    }
+  } catch (error) {
+    console.warn('建立服务端状态失败，改为发送完整上下文:', error);
+  }
+}
+
+function stateBody(delta, context) {
+  return stateVersion === null ? { context: context } : { version: stateVersion, delta: delta };
+}
+
+function adoptVersion(data) {
+  if (data && Number.isInteger(data.version)) {
+    stateVersion = data.version;
+  }
+}
+
+// 版本冲突时以服务端状态为准
+function syncState(conflict) {
+  adoptVersion(conflict);
+  const state = conflict.state || {};
+  ['appearance', 'intelligence', 'physical', 'wealth'].forEach(key => {
+    if (Number.isInteger(state[key])) {
+      document.getElementById(key).textContent = String(state[key]);
+    }
+  });
+}
+
+// 发送修改状态的请求，版本冲突（409）时同步服务端状态后重试一次
+async function postState(url, delta, context) {
+  let response = await postIdempotent(url, stateBody(delta, context));
+  if (response.status === 409 && stateVersion !== null) {
+    syncState(await response.json());
+    response = await postIdempotent(url, stateBody(delta, context));
+  }
+  if (!response.ok) {
+    throw new Error(`请求 ${url} 失败: ${response.status}`);
+  }
+  const data = await response.json();
+  adoptVersion(data);
+  return data;
+}
+
+// 通过 SSE 流式获取事件，onDelta 接收正文片段，返回完整事件
+async function fetchEventStream(body, onDelta) {
+  const response = await fetch('/generate_event/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify(body)
+  });
+  if (!response.ok || !response.body) {
+    throw new Error('流式接口不可用');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE 消息以空行分隔
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let eventType = 'message';
+      let data = '';
+      raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+          eventType = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          data += line.slice(5).trim();
+        }
+      });
+      const payload = data ? JSON.parse(data) : {};
+      if (eventType === 'delta') {
+        onDelta(payload.text || '');
+      } else if (eventType === 'done') {
+        reader.cancel();
+        return payload;
+      } else if (eventType === 'error') {
+        throw new Error(payload.error || '事件流出错');
+      }
+    }
+  }
+  throw new Error('事件流意外结束');
+}
+
+// 格式化效果显示
+function formatEffects(effects) {
+  return Object.entries(effects)
+    .map(([attr, value]) => {
+      const attrNames = {
+        'intelligence': '智力',
+        'physical': '体质',
+        'appearance': '颜值',
+        'wealth': '家境'
+      };
+      const displayName = attrNames[attr.toLowerCase()] || attr;
+      return `${displayName}${value > 0 ? '+' : ''}${value}`;
+    })
+    .join(' ');
+}
+
+// 添加一些 CSS 样式
+
+function showTab(tabName) {
+  // 隐藏所有视图
+  document.querySelectorAll('.view').forEach(view => {
+    view.style.display = 'none';
+    view.style.visibility = 'hidden';  // 添加可见性控制
+  });
+
+  // 移除所有标签的激活状态
+  document.querySelectorAll('.tab-button').forEach(button => {
+    button.classList.remove('active');
+  });
+
+  // 显示选中的视图
+  const selectedView = document.getElementById(tabName + '-view');
+  selectedView.style.display = 'flex';
+  selectedView.style.visibility = 'visible';  // 显示选中的视图
+
+  // 激活对应的标签
+  document.querySelector(`[data-tab="${tabName}"]`).classList.add('active');
+}
+
+function sendMessage() {
+  const chatInput = document.getElementById('chat-input');
+  const message = chatInput.value.trim();
+  if (message) {
+    const chatMessages = document.getElementById('chat-messages');
+    const year = document.getElementById('current-year').textContent;
+
+    // 获取当前聊天的联系人名称
+    const contactName = document.getElementById('chat-contact-name').textContent;
+    const currentContact = contacts.find(contact => contact.name === contactName);
+
+    if (currentContact) {
+      currentContact.messages.push({
+        text: message,
+        year: currentYear,
+        from: 'self'
+      });
+
+      // 创建新消息元素
+      const messageDiv = document.createElement('div');
+      messageDiv.className = 'message self';
+      messageDiv.innerHTML = `
+        <div class="message-content">
+          <p>${message}</p>
+        </div>
+      `;
+      chatMessages.appendChild(messageDiv);
+
+      // 清空输入框
+      chatInput.value = '';
+
+      // 自动滚动到底部
+      chatMessages.scrollTop = chatMessages.scrollHeight;
+
+      // 获取 AI 回复
+      getAIResponse(currentContact, message).then(response => {
+        if (response && response.messages && response.messages.length > 0) {
+          handleNewMessages(response.messages);
+        }
+      });
+    }
+  }
+}
+
+// 获取 AI 回复
+async function getAIResponse(contact, message) {
+  try {
+    // 获取当前游戏状态
+    const currentState = {
+      name: document.getElementById('player-name').textContent,
+      sex: document.getElementById('player-gender').textContent,
+      age: currentAge.toString(),
+      appearance: document.getElementById('appearance').textContent,
+      intelligence: document.getElementById('intelligence').textContent,
+      physical: document.getElementById('physical').textContent,
+      wealth: document.getElementById('wealth').textContent,
+      city: gameData.city,
+      character: contact.name,
+      characters: contact.name,
+      events: gameData.events || [],
+      messages: contact.messages.map(msg => {
+        const sender = msg.from === 'self' ? gameData.name : contact.name;
+        return `${currentAge}岁 ${sender}: [${msg.text}]`;
+      }).join('；')
+    };
+
+    await lifeReady;
+    return await postState('/get_messages', { character: contact.name, message: message }, currentState);
+  } catch (error) {
+    console.error('获取 AI 回复失败:', error);
+    return null;
+  }
+}
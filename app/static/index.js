@@ -0,0 +1,73 @@
+document.getElementById("random-allocate-btn").onclick = function() {
+  // 发起随机分配请求
+  fetch('/random_allocate')
+    .then(response => response.json())
+    .then(data => {
+      // 检查返回的数据是否有效
+      if (!data || !data.attributes || !data.talents) {
+          console.error('Invalid response data:', data);
+          throw new Error('服务器返回数据格式错误');
+      }
+
+      // 更新属性值
+      Object.keys(data.attributes).forEach(key => {
+          const element = document.getElementById(key);
+          if (element) {
+              element.innerText = data.attributes[key];
+          }
+      });
+
+      // 更新天赋列表
+      const talentList = document.getElementById("talent-list");
+      talentList.innerHTML = '';
+      (data.talents || []).forEach(talent => {
+          const li = document.createElement("li");
+          li.textContent = talent;
+          talentList.appendChild(li);
+      });
+
+      // 更新城市显示
+      const citySelect = document.getElementById("city-select");
+      if (citySelect && data.city) {
+          citySelect.value = data.city;
+      }
+    })
+    .catch(error => {
+        console.error("随机分配失败:", error);
+        alert("随机分配失败，请重试");
+    });
+};
+
+document.getElementById("start-life-btn").onclick = function() {
+  const playerName = document.getElementById("player-name").value.trim();
+  if (!playerName) {
+    alert("请输入姓名");
+    return;
+  }
+
+  const selectedGender = document.querySelector('input[name="gender"]:checked').value;
+  const selectedCity = document.getElementById("city-select").value;
+
+  // 获取当前属性值
+  const attributes = {
+    "颜值": parseInt(document.getElementById("颜值").innerText),
+    "智力": parseInt(document.getElementById("智力").innerText),
+    "体质": parseInt(document.getElementById("体质").innerText),
+    "家境": parseInt(document.getElementById("家境").innerText)
+  };
+
+  // 获取天赋列表
+  const talents = Array.from(document.getElementById("talent-list").children).map(item => item.textContent);
+
+  // 保存数据到 localStorage
+  localStorage.setItem('gameData', JSON.stringify({
+    name: playerName,
+    sex: selectedGender,
+    city: selectedCity,
+    attributes: attributes,
+    talents: talents
+  }));
+
+  // 跳转到模拟手机界面
+  window.location.href = '/game';
+};
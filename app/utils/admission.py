@@ -0,0 +1,334 @@
+"""
+这个模块负责请求的准入控制（限流和过载保护），主要功能包括：
+
+1. 令牌桶限流：
+   - 每个会话、每个 IP 各有一个令牌桶，请求需要两个桶都有令牌
+   - 按路由分类设置限额：调用 Coze 的路由（coze）和随机分配等本地路由（allocate）
+   - 限额格式 "容量/秒数"：桶最多存 容量 个令牌，每 秒数 秒补满，"off" 表示不限制
+   - 没有令牌时返回需要等待的秒数，路由返回 429 和 Retry-After
+
+2. 存储后端：
+   - memory: 进程内字典
+   - sqlite: 本地 SQLite 文件，多个 worker 进程共享同一组令牌桶
+
+3. 过载保护（排队）：
+   - 每个进程同时处理的 Coze 请求不超过 ADMISSION_MAX_ACTIVE，
+     其余请求最多 ADMISSION_MAX_QUEUED 个排队等待 ADMISSION_QUEUE_TIMEOUT 秒
+   - 队列已满或等待超时立即拒绝，路由返回 503 和 Retry-After，不再堆积到 worker 线程里
+
+使用方式：
+    limiter = create_rate_limiter()
+    retry_after = limiter.check('/generate_event', session_id, ip)   # 0 表示放行
+    queue = AdmissionQueue()
+    if queue.acquire(): ... queue.release()
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+
+logger = logging.getLogger('app')
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', 'data/ratelimit.db')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+# 前面有几层反向代理（从 X-Forwarded-For 右数第几个地址是客户端），0 表示直接使用连接地址
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
+
+# 路由 -> 限流类别，不在表中的路由不限流
+ROUTE_CLASSES = {
+    '/generate_event': 'coze',
+    '/generate_event/stream': 'coze',
+    '/get_messages': 'coze',
+    '/get_messages/stream': 'coze',
+    '/turn': 'coze',
+    '/random_allocate': 'allocate',
+    '/start_new_life': 'allocate',
+}
+
+# 类别 -> (每个会话的限额, 每个 IP 的限额)；同一个 IP 后面可能有多个玩家，IP 限额更宽
+RATE_LIMITS = {
+    'coze': (os.getenv('RATE_LIMIT_COZE_SESSION', '30/60'), os.getenv('RATE_LIMIT_COZE_IP', '180/60')),
+    'allocate': (os.getenv('RATE_LIMIT_ALLOCATE_SESSION', '60/60'), os.getenv('RATE_LIMIT_ALLOCATE_IP', '300/60')),
+}
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', 6))
+ADMISSION_MAX_QUEUED = int(os.getenv('ADMISSION_MAX_QUEUED', 2))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 5))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 5))
+
+# sqlite 后端每处理这么多次请求清理一次已经补满的桶
+_PRUNE_INTERVAL = 1000
+
+
+def parse_limit(spec):
+    """
+    解析限额。
+
+    返回值：
+    tuple: (容量, 每秒补充的令牌数)；"off"、"0" 或空值返回 None
+    """
+    spec = (spec or '').strip().lower()
+    if spec in ('', '0', 'off', 'none'):
+        return None
+    capacity, _, period = spec.partition('/')
+    capacity, period = float(capacity), float(period or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit: {spec}")
+    return capacity, capacity / period
+
+
+def client_ip(access_route, remote_addr, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES):
+    """按可信代理层数取客户端地址（access_route 为 X-Forwarded-For 中的地址列表）"""
+    if trusted_proxies > 0 and len(access_route) >= trusted_proxies:
+        return access_route[-trusted_proxies]
+    return remote_addr or 'unknown'
+
+
+def is_coze_route(route):
+    """是否为调用 Coze 的路由（受排队限制）"""
+    return ROUTE_CLASSES.get(route) == 'coze'
+
+
+def _level(tokens, updated_at, now, capacity, rate):
+    """按经过的时间补充令牌后的数量"""
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶"""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [令牌数, 更新时间, 补满时间]
+        self._lock = threading.Lock()
+
+    def acquire(self, buckets):
+        """
+        从每个桶各取一个令牌，任一个桶不够时都不取。
+
+        参数：
+        buckets: [(键, 容量, 每秒补充数), ...]
+
+        返回值：
+        float: 0 表示成功，否则为最早可以重试的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, capacity, rate in buckets:
+                entry = self._buckets.get(key)
+                tokens = capacity if entry is None else _level(entry[0], entry[1], now, capacity, rate)
+                levels.append(tokens)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if wait:
+                return wait
+            for (key, capacity, rate), tokens in zip(buckets, levels):
+                tokens -= 1
+                self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now):
+        # 已经补满的桶与不存在的桶等价，可以直接删除
+        for key in [key for key, entry in self._buckets.items() if entry[2] <= now]:
+            del self._buckets[key]
+        overflow = len(self._buckets) - self.max_keys
+        if overflow > 0:
+            # 仍然超出时删除最快补满的桶
+            for key in sorted(self._buckets, key=lambda k: self._buckets[k][2])[:overflow]:
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """本地 SQLite 令牌桶，多个 worker 进程共享"""
+
+    def __init__(self, path=RATE_LIMIT_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._operations = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # 建表使用临时连接，fork 出的 worker 进程各自重新连接
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_full ON buckets(full_at)")
+            conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 自动提交模式，事务由 acquire() 用 BEGIN IMMEDIATE 显式开启
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, buckets):
+        """同 MemoryBucketStore.acquire()，读取和扣减在同一个写事务中，多个进程之间不会超发"""
+        conn = self._connection()
+        keys = [key for key, _, _ in buckets]
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = {
+                key: (tokens, updated_at)
+                for key, tokens, updated_at in conn.execute(
+                    f"SELECT key, tokens, updated_at FROM buckets WHERE key IN ({','.join('?' * len(keys))})",
+                    keys
+                )
+            }
+            levels = []
+            wait = 0.0
+            for key, capacity, rate in buckets:
+                row = rows.get(key)
+                tokens = capacity if row is None else _level(row[0], row[1], now, capacity, rate)
+                levels.append(tokens)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if not wait:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, tokens - 1, now, now + (capacity - tokens + 1) / rate)
+                        for (key, capacity, rate), tokens in zip(buckets, levels)
+                    ]
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._operations += 1
+        if self._operations % _PRUNE_INTERVAL == 0:
+            self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        try:
+            self._connection().execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to prune rate limit buckets: {e}")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """按路由类别、会话和 IP 限流"""
+
+    def __init__(self, store, limits=RATE_LIMITS, route_classes=ROUTE_CLASSES):
+        self.store = store
+        self.route_classes = route_classes
+        # 类别 -> [(范围, 容量, 每秒补充数), ...]
+        self.limits = {}
+        for category, (session_spec, ip_spec) in limits.items():
+            rules = []
+            for scope, spec in (('session', session_spec), ('ip', ip_spec)):
+                parsed = parse_limit(spec)
+                if parsed is not None:
+                    rules.append((scope,) + parsed)
+            self.limits[category] = rules
+
+    def check(self, route, session_id, ip):
+        """
+        取一个令牌。
+
+        返回值：
+        float: 0 表示放行（包括不限流的路由），否则为建议的重试等待秒数
+        """
+        category = self.route_classes.get(route)
+        rules = self.limits.get(category)
+        if not rules:
+            return 0.0
+        identities = {'session': session_id, 'ip': ip}
+        return self.store.acquire([
+            (f"{category}:{scope}:{identities[scope]}", capacity, rate)
+            for scope, capacity, rate in rules
+        ])
+
+    def stats(self):
+        return {"buckets": len(self.store)}
+
+
+class AdmissionQueue:
+    """进程内 Coze 请求的并发上限和有界等待队列"""
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, max_queued=ADMISSION_MAX_QUEUED,
+                 timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        取得一个处理名额。
+
+        返回值：
+        bool: False 表示队列已满或等待超时，请求应被拒绝
+        """
+        with self._cond:
+            # 有请求在排队时新请求不插队
+            if self.active < self.max_active and self.queued == 0:
+                self.active += 1
+                return True
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.max_active, self.timeout)
+            finally:
+                self.queued -= 1
+            if not admitted:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        return {"active": self.active, "queued": self.queued,
+                "max_active": self.max_active, "max_queued": self.max_queued}
+
+
+def create_rate_limiter():
+    """根据 RATE_LIMIT_BACKEND 创建限流器，RATE_LIMIT_ENABLED 关闭时返回 None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        logger.info(f"Using SQLite rate limit store: {RATE_LIMIT_PATH}")
+        return RateLimiter(SQLiteBucketStore())
+    if RATE_LIMIT_BACKEND != 'memory':
+        logger.warning(f"Unknown rate limit backend '{RATE_LIMIT_BACKEND}', falling back to memory")
+    return RateLimiter(MemoryBucketStore())
+
+
+def create_admission_queue():
+    """ADMISSION_ENABLED 关闭时返回 None"""
+    return AdmissionQueue() if ADMISSION_ENABLED else None
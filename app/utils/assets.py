@@ -0,0 +1,359 @@
+"""
+这个模块负责静态资源的构建和发送，主要功能包括：
+
+1. 构建（启动时或 python -m app.utils.assets）：
+   - 压缩 app/static 下的 JS 和 CSS（去掉注释和多余空白，不改写代码）
+   - 按内容哈希命名（game.3f2a1b9c04.js），内容不变时文件名不变
+   - 预先生成 .gz 和 .br（需要 Brotli 包）版本，请求时不再压缩
+   - 清单 manifest.json 记录源文件哈希，源文件未变时跳过构建
+
+2. 发送（/assets/<文件名>）：
+   - 按 Accept-Encoding 选择 br、gzip 或原文件
+   - 文件名带哈希，设置 Cache-Control: immutable，浏览器一年内不再请求
+
+3. 模板：
+   - asset_url('game.js') 返回带哈希的地址，未构建时返回 /static/ 下的原文件
+   - 调试模式下渲染时检查源文件，修改 JS/CSS 后刷新页面即可，不需要重启
+
+旧版本的文件保留在构建目录中，仍在使用旧页面的客户端可以继续取到。
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from app.utils.compression import gzip_bytes, brotli_bytes, choose_encoding
+
+logger = logging.getLogger('app')
+
+ASSETS_ENABLED = os.getenv('ASSETS_ENABLED', 'true').lower() == 'true'
+ASSETS_BUILD_DIR = os.getenv('ASSETS_BUILD_DIR', 'data/assets')
+ASSETS_URL_PATH = '/assets'
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+MANIFEST_NAME = 'manifest.json'
+FINGERPRINT_LENGTH = 10
+# 压缩后至少节省这个比例才保留压缩版本
+MIN_COMPRESSION_SAVING = 0.1
+
+_REGEX_PRECEDERS = frozenset('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = frozenset(('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void',
+                             'yield', 'await', 'delete', 'throw', 'instanceof', 'new'))
+_IDENTIFIER_TAIL = re.compile(r'[A-Za-z_$][\w$]*$')
+# 只发送带哈希的文件（包括旧版本），不发送清单和临时文件
+_FINGERPRINTED = re.compile(r'^[\w-]+(\.[\w-]+)*\.[0-9a-f]{%d}\.\w+$' % FINGERPRINT_LENGTH)
+
+
+class _JSMinifier:
+    """
+    保守的 JS 压缩：去掉注释、行首行尾空白和空行，行内连续空白保留一个。
+    换行全部保留，不依赖分号；字符串、模板字符串和正则字面量原样输出。
+    """
+
+    def __init__(self, source):
+        self.src = source
+        self.out = []
+
+    def minify(self):
+        self._code(0, nested=False)
+        return ''.join(self.out).strip() + '\n'
+
+    def _code(self, i, nested):
+        """扫描代码，nested 时在不匹配的 } 处返回（模板字符串中的 ${...}）"""
+        src, out, n = self.src, self.out, len(self.src)
+        depth = 0
+        while i < n:
+            c = src[i]
+            if c in ' \t\r':
+                j = i
+                while j < n and src[j] in ' \t\r':
+                    j += 1
+                if out and out[-1] != '\n' and j < n and src[j] != '\n':
+                    out.append(' ')
+                i = j
+            elif c == '\n':
+                while out and out[-1] == ' ':
+                    out.pop()
+                if out and out[-1] != '\n':
+                    out.append('\n')
+                i += 1
+            elif c in '"\'':
+                j = self._string(i, c)
+                out.append(src[i:j])
+                i = j
+            elif c == '`':
+                i = self._template(i)
+            elif src.startswith('//', i):
+                j = src.find('\n', i)
+                i = n if j < 0 else j
+            elif src.startswith('/*', i):
+                j = src.find('*/', i + 2)
+                if j < 0:
+                    raise ValueError("Unterminated comment")
+                # 注释两侧的记号不能连在一起
+                if out and out[-1] not in (' ', '\n'):
+                    out.append(' ')
+                i = j + 2
+            elif c == '/' and self._regex_allowed():
+                j = self._regex(i)
+                out.append(src[i:j])
+                i = j
+            elif nested and c == '{':
+                depth += 1
+                out.append(c)
+                i += 1
+            elif nested and c == '}':
+                if depth == 0:
+                    return i
+                depth -= 1
+                out.append(c)
+                i += 1
+            else:
+                j = i + 1
+                while j < n and src[j] not in ' \t\r\n"\'`/{}':
+                    j += 1
+                out.append(src[i:j])
+                i = j
+        if nested:
+            raise ValueError("Unterminated template expression")
+        return i
+
+    def _string(self, i, quote):
+        src, n = self.src, len(self.src)
+        j = i + 1
+        while j < n:
+            c = src[j]
+            if c == '\\':
+                j += 2
+            elif c == quote:
+                return j + 1
+            elif c == '\n':
+                break
+            else:
+                j += 1
+        raise ValueError(f"Unterminated string at offset {i}")
+
+    def _template(self, i):
+        src, out, n = self.src, self.out, len(self.src)
+        start = i
+        j = i + 1
+        while j < n:
+            c = src[j]
+            if c == '\\':
+                j += 2
+            elif c == '`':
+                out.append(src[start:j + 1])
+                return j + 1
+            elif src.startswith('${', j):
+                out.append(src[start:j + 2])
+                j = self._code(j + 2, nested=True)
+                start = j
+                j += 1
+            else:
+                j += 1
+        raise ValueError(f"Unterminated template literal at offset {i}")
+
+    def _regex_allowed(self):
+        """/ 出现在这些记号之后时是正则字面量，否则是除号"""
+        tail = ''.join(self.out[-16:]).rstrip()
+        if not tail:
+            return True
+        if tail[-1] in _REGEX_PRECEDERS:
+            return True
+        match = _IDENTIFIER_TAIL.search(tail)
+        return match is not None and match.group(0) in _REGEX_KEYWORDS
+
+    def _regex(self, i):
+        src, n = self.src, len(self.src)
+        j = i + 1
+        in_class = False
+        while j < n:
+            c = src[j]
+            if c == '\\':
+                j += 2
+                continue
+            if c == '\n':
+                break
+            if c == '[':
+                in_class = True
+            elif c == ']':
+                in_class = False
+            elif c == '/' and not in_class:
+                j += 1
+                while j < n and (src[j].isalnum() or src[j] == '_'):
+                    j += 1
+                return j
+            j += 1
+        raise ValueError(f"Unterminated regular expression at offset {i}")
+
+
+def minify_js(source):
+    return _JSMinifier(source).minify()
+
+
+def minify_css(source):
+    css = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+COMPRESSIBLE = ('.js', '.css', '.svg', '.ico', '.json', '.txt')
+
+
+def fingerprinted_name(name, content):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def _write_atomic(path, data):
+    # 多个 worker 同时构建时不会读到写了一半的文件
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _source_files(static_dir):
+    return sorted(
+        name for name in os.listdir(static_dir)
+        if os.path.isfile(os.path.join(static_dir, name)) and not name.startswith('.')
+    )
+
+
+def load_manifest(build_dir=ASSETS_BUILD_DIR):
+    """读取清单，不存在或损坏时返回 None"""
+    try:
+        with open(os.path.join(build_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_current(manifest, sources, build_dir):
+    if manifest is None or manifest.get('sources') != sources:
+        return False
+    return all(os.path.exists(os.path.join(build_dir, name)) for name in manifest['files'].values())
+
+
+def build_assets(static_dir=STATIC_DIR, build_dir=ASSETS_BUILD_DIR, force=False):
+    """
+    构建静态资源，源文件没有变化时直接返回已有的清单。
+
+    返回值：
+    dict: {"sources": {源文件: 源文件哈希}, "files": {源文件: 带哈希的文件名}, "sizes": {...}}
+    """
+    os.makedirs(build_dir, exist_ok=True)
+    contents = {}
+    for name in _source_files(static_dir):
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            contents[name] = f.read()
+    sources = {name: hashlib.sha256(data).hexdigest() for name, data in contents.items()}
+
+    manifest = load_manifest(build_dir)
+    if not force and _is_current(manifest, sources, build_dir):
+        return manifest
+
+    files, sizes = {}, {}
+    for name, data in contents.items():
+        ext = os.path.splitext(name)[1]
+        minify = MINIFIERS.get(ext)
+        if minify is not None:
+            try:
+                data = minify(data.decode('utf-8')).encode('utf-8')
+            except (ValueError, UnicodeDecodeError) as e:
+                # 压缩器不认识的写法按原文件发送
+                logger.warning(f"Not minifying {name}: {e}")
+        hashed = fingerprinted_name(name, data)
+        path = os.path.join(build_dir, hashed)
+        _write_atomic(path, data)
+        sizes[name] = {'source': len(contents[name]), 'minified': len(data)}
+
+        if ext in COMPRESSIBLE:
+            for encoding, suffix, compress in (('gzip', '.gz', gzip_bytes), ('br', '.br', brotli_bytes)):
+                compressed = compress(data)
+                if compressed is not None and len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+                    _write_atomic(path + suffix, compressed)
+                    sizes[name][encoding] = len(compressed)
+        files[name] = hashed
+
+    manifest = {'sources': sources, 'files': files, 'sizes': sizes}
+    _write_atomic(os.path.join(build_dir, MANIFEST_NAME),
+                  json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    logger.info(f"Built {len(files)} static assets into {build_dir}")
+    return manifest
+
+
+def asset_url(name):
+    """模板中使用：返回静态资源的地址"""
+    from flask import current_app, url_for
+
+    files = current_app.extensions.get('assets')
+    if files and current_app.debug:
+        # 调试时源文件随时会改，渲染时检查是否需要重新构建（源文件未变时只计算哈希）
+        files = build_assets(current_app.static_folder, current_app.extensions['assets_dir'])['files']
+        current_app.extensions['assets'] = files
+    if files and name in files:
+        return f"{ASSETS_URL_PATH}/{files[name]}"
+    return url_for('static', filename=name)
+
+
+def send_asset(filename):
+    """发送带哈希的静态资源，按 Accept-Encoding 选择预压缩的版本"""
+    from flask import current_app, request, send_from_directory, abort
+
+    if not _FINGERPRINTED.match(filename):
+        abort(404)
+    build_dir = current_app.extensions['assets_dir']
+    available = tuple(
+        encoding for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+        if os.path.exists(os.path.join(build_dir, filename + suffix))
+    )
+    encoding = choose_encoding(request.accept_encodings, available)
+    suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+
+    response = send_from_directory(
+        build_dir, filename + suffix,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        max_age=ASSETS_MAX_AGE
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    """构建静态资源并注册 /assets 路由和模板函数 asset_url"""
+    app.add_template_global(asset_url)
+    app.extensions['assets'] = {}
+    if not ASSETS_ENABLED:
+        return
+    build_dir = os.path.abspath(ASSETS_BUILD_DIR)
+    try:
+        manifest = build_assets(app.static_folder, build_dir)
+    except OSError as e:
+        # 构建目录不可写时使用 /static 下的原文件
+        logger.warning(f"Failed to build static assets: {e}")
+        return
+    app.extensions['assets'] = manifest['files']
+    app.extensions['assets_dir'] = build_dir
+    app.add_url_rule(f"{ASSETS_URL_PATH}/<path:filename>", 'assets', send_asset)
+
+
+if __name__ == '__main__':
+    manifest = build_assets(force='--force' in sys.argv[1:])
+    print(f"{'asset':<14} {'source':>8} {'minified':>9} {'gzip':>7} {'br':>7}  file")
+    for name, hashed in manifest['files'].items():
+        size = manifest['sizes'][name]
+        print(f"{name:<14} {size['source']:>8} {size['minified']:>9} "
+              f"{size.get('gzip', '-'):>7} {size.get('br', '-'):>7}  {hashed}")
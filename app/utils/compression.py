@@ -0,0 +1,81 @@
+"""
+这个模块负责 HTTP 响应压缩，主要功能包括：
+
+1. 压缩算法：
+   - gzip 使用标准库
+   - brotli 需要安装 Brotli 包（可选，未安装时只提供 gzip）
+
+2. JSON 响应压缩：
+   - 超过 JSON_GZIP_MIN_BYTES 的 JSON 响应在客户端接受 gzip 时压缩
+   - 小响应压缩后节省不了多少字节，反而多花 CPU，保持原样
+
+3. 编码协商：
+   - 按 Accept-Encoding 的 q 值在可用的编码中选择，q=0 表示拒绝
+"""
+
+import os
+import gzip
+
+JSON_GZIP_ENABLED = os.getenv('JSON_GZIP_ENABLED', 'true').lower() == 'true'
+JSON_GZIP_MIN_BYTES = int(os.getenv('JSON_GZIP_MIN_BYTES', 1024))
+JSON_GZIP_LEVEL = int(os.getenv('JSON_GZIP_LEVEL', 6))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def gzip_bytes(data, level=9):
+    # mtime=0：内容相同时输出相同，预压缩的文件可以复现
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def brotli_bytes(data):
+    """brotli 压缩，未安装 Brotli 时返回 None"""
+    if brotli is None:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def choose_encoding(accept_encodings, available):
+    """
+    在可用的编码中选择客户端接受且 q 值最高的一个。
+
+    参数：
+    accept_encodings: request.accept_encodings
+    available: 按服务端偏好排序的编码，如 ('br', 'gzip')
+
+    返回值：
+    str: 选中的编码，都不接受时返回 None（发送原文）
+    """
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_json_response(response):
+    """after_request：压缩较大的 JSON 响应"""
+    from flask import request
+
+    if (response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < JSON_GZIP_MIN_BYTES or choose_encoding(request.accept_encodings, ('gzip',)) is None:
+        return response
+    response.set_data(gzip_bytes(data, JSON_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_compression(app):
+    if JSON_GZIP_ENABLED:
+        app.after_request(compress_json_response)
@@ -13,21 +13,95 @@
 3. 响应数据处理：
    - 解析 API 返回的 JSON 数据
    - 转换为程序可用的数据结构
+
+4. 异步接口：
+   - AsyncCozeAPI 提供相同方法的 async 版本，复用响应解析逻辑
+   - 事件请求（包括流式事件）有延迟预算，可选在等待一段时间后发出对冲请求
+
+5. 流式接口：
+   - stream_event / stream_wechat_messages 使用 Coze 流式工作流，
+     先逐段产出正文，结束后再产出与非流式接口相同的完整结果
+
+6. 本地回退：
+   - 事件工作流超出延迟预算或出错时，由本地事件引擎生成事件
+
+7. 请求合并：
+   - 参数完全相同的并发请求只向 Coze 发送一次，共享同一个响应（对冲请求除外）
+
+8. 回合接口：
+   - play_turn 并发请求事件和微信工作流，全部返回后一次性写入游戏状态
 """
 
 import os
-import json
+import copy
+import time
+import queue
+import functools
+import threading
+import asyncio
+import concurrent.futures
 import requests
 import logging
 from app.models.game_state import GameState  # 导入 GameState 类
+from app.models.local_events import LocalEventEngine
+import httpx
+from app.utils.http_client import get_http_client, get_async_http_client
+from app.utils.response_cache import get_response_cache, parameters_hash
+from app.utils.single_flight import SingleFlight
+from app.utils.sse import iter_sse_events, PartialJSONString
+from app.utils.history_compactor import HistoryCompactor, HISTORY_COMPACTION
+from app.utils.log_pipeline import log_payload
+from app.utils.coze_decoder import CozePayloadError, loads, decode_talents, decode_event, decode_messages
+from app.utils import metrics
 
 # 获取API日志记录器
 logger = logging.getLogger('api')
 
+# 事件请求的延迟预算（毫秒，0 表示不限制）和对冲请求的触发时间（毫秒，0 表示不对冲）
+EVENT_LATENCY_BUDGET_MS = int(os.getenv('EVENT_LATENCY_BUDGET_MS', 15000))
+EVENT_HEDGE_AFTER_MS = int(os.getenv('EVENT_HEDGE_AFTER_MS', 0))
+# Coze 事件超时或出错时是否使用本地事件
+LOCAL_EVENT_FALLBACK = os.getenv('LOCAL_EVENT_FALLBACK', 'true').lower() == 'true'
+# 合并参数相同的并发工作流请求
+COZE_SINGLE_FLIGHT = os.getenv('COZE_SINGLE_FLIGHT', 'true').lower() == 'true'
+
+# 同步和异步接口共用，两者之间的相同请求也会合并
+_in_flight = SingleFlight()
+
+
+def _remaining(deadline):
+    """距离截止时间的秒数（没有截止时间时为 None）"""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _instrument_decode(workflow):
+    """装饰器：记录响应解析的耗时，抛出异常或结果为空时计为解析失败"""
+    def decorator(func):
+        latency = metrics.DECODE_LATENCY.labels(workflow)
+        errors = metrics.DECODE_ERRORS.labels(workflow)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+            if not result:
+                errors.inc()
+            return result
+        return wrapper
+    return decorator
+
+
 class CozeAPI:
     def __init__(self):
         self.token = os.getenv('COZE_API_TOKEN')
-        self.base_url = "https://api.coze.cn"
+        self.client = get_http_client()
+        self.base_url = self.client.base_url
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
@@ -44,220 +118,671 @@ class CozeAPI:
         missing_ids = [k for k, v in self.workflow_ids.items() if not v]
         if missing_ids:
             raise ValueError(f"Missing workflow IDs in environment variables: {missing_ids}")
+        self.workflow_names = {v: k for k, v in self.workflow_ids.items()}
+        
+        # 响应缓存
+        self.cache = get_response_cache()
+        
+        # 历史记录压缩
+        self.compactor = HistoryCompactor() if HISTORY_COMPACTION else None
+        
+        # 本地事件引擎（Coze 事件超时或出错时使用）
+        self.local_events = LocalEventEngine() if LOCAL_EVENT_FALLBACK else None
+        
+        # 进行中的请求，用于合并相同的并发请求
+        self.in_flight = _in_flight if COZE_SINGLE_FLIGHT else None
             
-        # 初始化游戏状态
+        # 默认游戏状态（未指定会话状态的调用方使用）
         self.game_state = GameState()
+        
+        # 事件预取器（可选），由调用方设置
+        self.prefetcher = None
 
-    def _make_request(self, workflow_id, parameters):
-        """发送请求到 Coze API"""
-        url = 'https://api.coze.cn/v1/workflow/run'
-        headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': 'application/json'
-        }
+    def _build_parameters(self, state, workflow):
+        """生成发给工作流的参数（按预算压缩历史记录）"""
+        if self.compactor is None:
+            return state.get_parameters()
+        return self.compactor.compact(state, workflow)
+
+    def _make_request(self, workflow_id, parameters, coalesce=True):
+        """
+        发送请求到 Coze API，优先使用缓存的响应。
+
+        coalesce 为 True 时，与正在进行的相同请求共享响应，不再单独发送。
+        """
+        workflow = self.workflow_names.get(workflow_id)
+        cached = self.cache.lookup(workflow, workflow_id, parameters)
+        if cached is not None:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, 'cache_hit').inc()
+            return cached
+        if not coalesce or self.in_flight is None:
+            return self._request_upstream(workflow, workflow_id, parameters)
+        response, shared = self.in_flight.do(
+            f"{workflow_id}:{parameters_hash(parameters)}",
+            lambda: self._request_upstream(workflow, workflow_id, parameters)
+        )
+        if shared:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, 'coalesced').inc()
+        return response
+
+    def _request_upstream(self, workflow, workflow_id, parameters):
+        """向 Coze 发送请求，记录指标并缓存响应"""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            with metrics.WORKFLOW_IN_PROGRESS.labels(workflow).track_inprogress():
+                response = self._post_workflow(workflow_id, parameters)
+            outcome = 'ok'
+        finally:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, outcome).inc()
+            metrics.WORKFLOW_LATENCY.labels(workflow).observe(time.perf_counter() - started)
+        self.cache.store(workflow, workflow_id, parameters, response)
+        return response
+
+    def _observe_payload(self, workflow_id, request_body, response_body):
+        """记录请求/响应的字节数"""
+        workflow = self.workflow_names.get(workflow_id)
+        metrics.WORKFLOW_REQUEST_BYTES.labels(workflow).observe(len(request_body or b''))
+        metrics.WORKFLOW_RESPONSE_BYTES.labels(workflow).observe(len(response_body or b''))
+
+    def _post_workflow(self, workflow_id, parameters):
+        """发送工作流请求"""
+        path = '/v1/workflow/run'
+        url = f"{self.base_url}{path}"
         data = {
             'workflow_id': workflow_id,
             'parameters': parameters
         }
         
         logger.info(f"Making request to {url}")
-        logger.debug(f"Request data: {json.dumps(data, ensure_ascii=False)}")
+        log_payload(logger, "Request data", data)
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.client.post(path, json=data, headers=self.headers)
             response.raise_for_status()
+            self._observe_payload(workflow_id, response.request.body, response.content)
             
             logger.info(f"Response status: {response.status_code}")
-            logger.debug(f"Response content: {response.text}")
+            log_payload(logger, "Response content", lambda: response.text)
             
-            return response.json()
+            return loads(response.content)
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed: {str(e)}")
-            logger.error(f"Response content: {getattr(e.response, 'text', 'No response text')}")
+            log_payload(logger, "Response content", getattr(e.response, 'text', 'No response text'), error=True)
             raise
 
-    def get_random_talents(self):
+    def _stream_workflow(self, workflow_id, parameters):
+        """
+        流式运行工作流。
+
+        逐段产出工作流输出的文本，结束后（StopIteration.value）返回
+        与 _make_request 结构相同的完整响应。
+        """
+        path = '/v1/workflow/stream_run'
+        data = {
+            'workflow_id': workflow_id,
+            'parameters': parameters
+        }
+        
+        logger.info(f"Making stream request to {self.base_url}{path}")
+        log_payload(logger, "Request data", data)
+        
+        response = self.client.stream(path, json=data, headers=self.headers)
+        chunks = []
+        try:
+            response.raise_for_status()
+            response.encoding = 'utf-8'
+            for event, payload in iter_sse_events(response.iter_lines(decode_unicode=True)):
+                if event == 'Message':
+                    content = loads(payload, '$.stream').get('content') or ''
+                    if content:
+                        chunks.append(content)
+                        yield content
+                elif event == 'Error':
+                    logger.error(f"Workflow stream error: {payload}")
+                    raise Exception(f"Workflow stream error: {payload}")
+        finally:
+            # 正文读完后连接已归还连接池，这里只处理中途退出的情况
+            response.close()
+        
+        content = ''.join(chunks)
+        log_payload(logger, "Stream content", content)
+        return self._stream_response(content)
+
+    def _stream_response(self, content):
+        """把流式输出拼成与非流式接口一致的响应结构"""
+        try:
+            parsed = loads(content)
+        except CozePayloadError:
+            parsed = None
+        if isinstance(parsed, dict) and 'output' in parsed:
+            return {'data': content}
+        return {'data': {'output': content}}
+
+    def _forward_partial(self, stream, field):
+        """转发流中指定 JSON 字段的增量文本，返回流的最终响应"""
+        extractor = PartialJSONString(field)
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            text = extractor.feed(chunk)
+            if text:
+                yield ('delta', {'text': text})
+
+    def get_random_talents(self, game_state=None):
         """获取随机天赋"""
+        state = game_state or self.game_state
+        try:
+            response = self._make_request(self.workflow_ids['talent'], self._build_parameters(state, 'talent'))
+            return self._handle_talents_response(response)
+        except Exception as e:
+            logger.error(f"Error processing talents: {str(e)}")
+            raise
+
+    @_instrument_decode('talent')
+    def _handle_talents_response(self, response):
+        """解析天赋系统的响应，格式错误时返回空列表"""
         try:
-            response = self._make_request(self.workflow_ids['talent'], self.game_state.get_parameters())
-            if not response:
-                logger.error("Empty response from API")
-                return []
+            talents = list(decode_talents(response))
+        except CozePayloadError as e:
+            logger.error(f"Invalid talent payload: {e}")
+            return []
+        logger.info(f"Successfully got talents: {talents}")
+        return talents
+
+    def generate_event(self, context=None, game_state=None, session_id=None):
+        """生成随机事件"""
+        state = game_state or self.game_state
+        try:
+            original_context = copy.deepcopy(context)
+            self._prepare_event_state(context, state)
+            parameters = self._build_parameters(state, 'event')
             
-            # 尝试从响应中提取数据
+            response = None
+            future = self._take_prefetched(session_id, parameters)
+            if future is not None:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logger.warning(f"Prefetched event failed, requesting again: {e}")
+            if response is None:
+                response = self._make_request(self.workflow_ids['event'], parameters)
+            
+            result = self._handle_event_response(response, state)
+            self._schedule_prefetch(session_id, state, original_context, result)
+            return result
+        except Exception as e:
+            logger.error(f"Error generating event: {str(e)}")
+            if self.local_events is None:
+                raise
+            return self._local_event(state, 'coze_error')
+
+    def stream_event(self, context=None, game_state=None, session_id=None):
+        """
+        流式生成随机事件。
+
+        产出 ('delta', {'text': ...}) 形式的事件正文片段，
+        最后产出 ('done', result)，result 与 generate_event 的返回值相同。
+        与 AsyncCozeAPI.generate_event 使用同一个延迟预算和对冲设置，
+        超出预算或 Coze 出错时回退到本地事件（已经发出的片段由 done 中的事件替换）。
+        游戏状态在副本上修改，产出 done 时才写回，中途出错或客户端断开时状态不变。
+        """
+        state = game_state or self.game_state
+        deadline = time.monotonic() + EVENT_LATENCY_BUDGET_MS / 1000 if EVENT_LATENCY_BUDGET_MS > 0 else None
+        original_context = copy.deepcopy(context)
+        working = copy.deepcopy(state)
+        self._prepare_event_state(context, working)
+        parameters = self._build_parameters(working, 'event')
+        workflow_id = self.workflow_ids['event']
+        
+        try:
+            response = None
+            future = self._take_prefetched(session_id, parameters)
+            if future is not None:
+                try:
+                    response = future.result(timeout=_remaining(deadline))
+                except concurrent.futures.TimeoutError:
+                    raise TimeoutError(f"Event workflow exceeded {EVENT_LATENCY_BUDGET_MS} ms")
+                except Exception as e:
+                    logger.warning(f"Prefetched event failed, requesting again: {e}")
+            if response is None:
+                response = self.cache.lookup('event', workflow_id, parameters)
+            if response is None:
+                stream = self._stream_event_workflow(workflow_id, parameters, deadline)
+                response = yield from self._forward_partial(stream, 'content')
+            result = self._handle_event_response(response, working)
+        except Exception as e:
+            logger.error(f"Error streaming event: {str(e)}")
+            if self.local_events is None:
+                raise
+            state.restore(working)
+            yield ('done', self._local_event(state, 'timeout' if isinstance(e, TimeoutError) else 'coze_error'))
+            return
+        
+        state.restore(working)
+        self._schedule_prefetch(session_id, state, original_context, result)
+        yield ('done', result)
+
+    def _stream_event_workflow(self, workflow_id, parameters, deadline):
+        """
+        在延迟预算内流式请求事件工作流。
+
+        逐段产出工作流输出的文本，返回完整响应（与 _stream_workflow 相同），
+        超出预算时抛出 TimeoutError。
+
+        没有预算也不对冲时直接读取流。否则流在后台线程中读取，等待下一段数据时也能按时放弃。
+        配置了 EVENT_HEDGE_AFTER_MS 时，超过该时间流仍未结束，会再发出一个非流式请求，
+        取先返回的结果。同步请求无法取消，被放弃的请求在后台读完后丢弃（响应照常缓存）。
+        """
+        hedge_at = time.monotonic() + EVENT_HEDGE_AFTER_MS / 1000 if EVENT_HEDGE_AFTER_MS > 0 else None
+        if deadline is None and hedge_at is None:
+            response = yield from self._stream_workflow(workflow_id, parameters)
+            self.cache.store('event', workflow_id, parameters, response)
+            return response
+
+        results = queue.Queue()
+        abandoned = threading.Event()
+
+        def read_stream():
+            stream = self._stream_workflow(workflow_id, parameters)
             try:
-                if isinstance(response, str):
-                    # 如果响应是字符串，直接解析
-                    data = json.loads(response)
-                else:
-                    # 如果响应是字典，获取 data 字段
-                    data = response.get('data', '')
-                    if isinstance(data, str):
-                        data = json.loads(data)
-                    
-                # 提取 output 字段
-                if isinstance(data, dict) and 'output' in data:
-                    output = data['output']
-                    # 如果 output 是字符串，需要再次解析
-                    if isinstance(output, str):
-                        talents = json.loads(output)
-                    else:
-                        talents = output
-                        
-                    logger.info(f"Successfully got talents: {talents}")
-                    return talents
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
+                while not abandoned.is_set():
+                    try:
+                        chunk = next(stream)
+                    except StopIteration as stop:
+                        self.cache.store('event', workflow_id, parameters, stop.value)
+                        results.put(('response', stop.value))
+                        return
+                    results.put(('chunk', chunk))
             except Exception as e:
-                logger.error(f"Error processing response: {e}")
+                results.put(('error', e))
+            finally:
+                stream.close()
+
+        def request_hedge():
+            try:
+                results.put(('response', self._make_request(workflow_id, parameters, coalesce=False)))
+            except Exception as e:
+                results.put(('error', e))
+
+        threading.Thread(target=read_stream, name='event-stream', daemon=True).start()
+        running = 1
+        error = None
+        try:
+            while running:
+                wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+                try:
+                    kind, value = results.get(timeout=_remaining(wake))
+                except queue.Empty:
+                    kind, value = None, None
+
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'response':
+                    return value
+                elif kind == 'error':
+                    running -= 1
+                    error = value
+                    logger.warning(f"Event request failed: {error}")
+
+                now = time.monotonic()
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    if running:
+                        running += 1
+                        threading.Thread(target=request_hedge, name='event-hedge', daemon=True).start()
+                        metrics.HEDGED_REQUESTS.labels('event').inc()
+                        logger.info(f"Event stream slower than {EVENT_HEDGE_AFTER_MS} ms, sent hedged request")
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError(f"Event workflow exceeded {EVENT_LATENCY_BUDGET_MS} ms")
+            raise error
+        finally:
+            abandoned.set()
+
+    def _local_event(self, state, reason):
+        """用本地事件引擎生成事件，并记录回退原因"""
+        metrics.FALLBACKS.labels('generate_event', reason).inc()
+        logger.warning(f"Serving local event ({reason})")
+        result = self.local_events.generate(state)
+        result['source'] = 'local'
+        return result
+
+    def _take_prefetched(self, session_id, parameters):
+        """查找与当前参数匹配的预取请求"""
+        if self.prefetcher is None or not session_id:
+            return None
+        return self.prefetcher.take(session_id, parameters)
+
+    def _schedule_prefetch(self, session_id, state, context, result):
+        """提交下一年事件的推测生成"""
+        if self.prefetcher is None or not session_id or not context:
+            return
+        try:
+            self.prefetcher.schedule(session_id, state, context, result)
+        except Exception as e:
+            logger.warning(f"Failed to schedule prefetch: {e}")
+
+    def _prepare_event_state(self, context, state):
+        """用请求上下文更新游戏状态"""
+        if context:
+            # 确保角色信息正确处理
+            if 'characterEffects' in context:
+                char_effects = context['characterEffects']
+                if char_effects.get('character'):
+                    char_name = char_effects['character'].get('name', '')
+                    if char_name:
+                        # 更新角色列表
+                        if not context.get('characters'):
+                            context['characters'] = []
+                        if char_name not in context['characters']:
+                            context['characters'].append(char_name)
             
-            # 如果处理失败，返回空列表
+            state.update_state(**context)
+
+    @_instrument_decode('event')
+    def _handle_event_response(self, response, state):
+        """解析事件系统的响应，并把事件记录到游戏状态（格式错误时抛出 CozePayloadError）"""
+        try:
+            event = decode_event(response)
+        except CozePayloadError as e:
+            logger.error(f"Invalid event payload: {e}")
+            raise
+        
+        # 处理角色效果
+        if event.character_name:
+            state.add_character(event.character_name)
+        # 记录事件内容
+        state.add_event(event.content)
+        return event.to_dict(state.age)
+
+    def get_wechat_messages(self, context=None, game_state=None):
+        """获取微信消息"""
+        state = game_state or self.game_state
+        try:
+            if context:
+                state.update_state(**context)
+            response = self._make_request(self.workflow_ids['wechat'], self._build_parameters(state, 'wechat'))
+            return self._handle_messages_response(response, state)
+        except Exception as e:
+            logger.error(f"Error getting messages: {str(e)}")
+            return []
+
+    def stream_wechat_messages(self, context=None, game_state=None):
+        """
+        流式获取微信消息。
+
+        产出 ('delta', {'text': ...}) 形式的第一条消息片段，
+        最后产出 ('done', messages)。
+        """
+        state = game_state or self.game_state
+        if context:
+            state.update_state(**context)
+        stream = self._stream_workflow(self.workflow_ids['wechat'], self._build_parameters(state, 'wechat'))
+        response = yield from self._forward_partial(stream, 'text')
+        yield ('done', self._handle_messages_response(response, state))
+
+    @_instrument_decode('wechat')
+    def _handle_messages_response(self, response, state):
+        """解析微信系统的响应，并把消息记录到游戏状态，格式错误时返回空列表"""
+        try:
+            batch = decode_messages(response)
+        except CozePayloadError as e:
+            logger.error(f"Invalid message payload: {e}")
             return []
+        
+        # 记录消息到游戏状态，使用统一的消息格式
+        for message in batch.messages:
+            for text in message.texts:
+                state.add_message(f"{state.age}岁 {message.from_character}: [{text}]")
+        return batch.raw()
+
+class AsyncCozeAPI(CozeAPI):
+    """
+    CozeAPI 的异步版本：等待 Coze 响应时不占用事件循环，一个请求内的多个工作流可以并发
+    （回合、对冲请求）。在 Flask 的异步视图中，整个请求仍然占用一个 worker 线程。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.async_client = get_async_http_client()
+
+    async def _make_request(self, workflow_id, parameters, coalesce=True):
+        """异步发送请求到 Coze API，优先使用缓存的响应，相同的并发请求只发送一次"""
+        workflow = self.workflow_names.get(workflow_id)
+        cached = self.cache.lookup(workflow, workflow_id, parameters)
+        if cached is not None:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, 'cache_hit').inc()
+            return cached
+        if not coalesce or self.in_flight is None:
+            return await self._request_upstream(workflow, workflow_id, parameters)
+        response, shared = await self.in_flight.do_async(
+            f"{workflow_id}:{parameters_hash(parameters)}",
+            lambda: self._request_upstream(workflow, workflow_id, parameters)
+        )
+        if shared:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, 'coalesced').inc()
+        return response
+
+    async def _request_upstream(self, workflow, workflow_id, parameters):
+        """异步向 Coze 发送请求，记录指标并缓存响应"""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            with metrics.WORKFLOW_IN_PROGRESS.labels(workflow).track_inprogress():
+                response = await self._post_workflow(workflow_id, parameters)
+            outcome = 'ok'
+        except asyncio.CancelledError:
+            # 超出延迟预算或对冲请求已先返回
+            outcome = 'cancelled'
+            raise
+        finally:
+            metrics.WORKFLOW_REQUESTS.labels(workflow, outcome).inc()
+            metrics.WORKFLOW_LATENCY.labels(workflow).observe(time.perf_counter() - started)
+        self.cache.store(workflow, workflow_id, parameters, response)
+        return response
+
+    async def _post_workflow(self, workflow_id, parameters):
+        """异步发送工作流请求"""
+        path = '/v1/workflow/run'
+        url = f"{self.base_url}{path}"
+        data = {
+            'workflow_id': workflow_id,
+            'parameters': parameters
+        }
+        
+        logger.info(f"Making async request to {url}")
+        log_payload(logger, "Request data", data)
+        
+        try:
+            response = await self.async_client.post(path, json=data, headers=self.headers)
+            response.raise_for_status()
+            self._observe_payload(workflow_id, response.request.content, response.content)
+            
+            logger.info(f"Response status: {response.status_code}")
+            log_payload(logger, "Response content", lambda: response.text)
             
+            return loads(response.content)
+            
+        except httpx.HTTPError as e:
+            logger.error(f"Async request failed: {str(e)}")
+            response = getattr(e, 'response', None)
+            log_payload(logger, "Response content", response.text if response is not None else 'No response text', error=True)
+            raise
+
+    async def get_random_talents(self, game_state=None):
+        """获取随机天赋"""
+        state = game_state or self.game_state
+        try:
+            response = await self._make_request(self.workflow_ids['talent'], self._build_parameters(state, 'talent'))
+            return self._handle_talents_response(response)
         except Exception as e:
             logger.error(f"Error processing talents: {str(e)}")
             raise
 
-    def generate_event(self, context=None):
+    async def generate_event(self, context=None, game_state=None, session_id=None):
         """生成随机事件"""
+        state = game_state or self.game_state
         try:
-            if context:
-                # 确保角色信息正确处理
-                if 'characterEffects' in context:
-                    char_effects = context['characterEffects']
-                    if char_effects.get('character'):
-                        char_name = char_effects['character'].get('name', '')
-                        if char_name:
-                            # 更新角色列表
-                            if not context.get('characters'):
-                                context['characters'] = []
-                            if char_name not in context['characters']:
-                                context['characters'].append(char_name)
-                
-                self.game_state.update_state(**context)
+            original_context = copy.deepcopy(context)
+            self._prepare_event_state(context, state)
+            parameters = self._build_parameters(state, 'event')
             
-            response = self._make_request(self.workflow_ids['event'], self.game_state.get_parameters())
-            if not response:
-                logger.error("Empty response from API")
-                raise Exception("Empty response from API")
-            
-            # 尝试从响应中提取数据
-            try:
-                if isinstance(response, str):
-                    data = json.loads(response)
-                else:
-                    data = response.get('data', '')
-                    if isinstance(data, str):
-                        data = json.loads(data)
-                    
-                # 提取 output 字段并解析
-                if isinstance(data, dict) and 'output' in data:
-                    output = data['output']
-                    if isinstance(output, str):
-                        event_data = json.loads(output)
-                    else:
-                        event_data = output
-                    
-                    if isinstance(event_data, dict) and 'events' in event_data:
-                        events = event_data['events']
-                        if events and len(events) > 0:
-                            event = events[0]
-                            
-                            # 处理角色效果
-                            if 'characterEffects' in event:
-                                char_effects = event['characterEffects']
-                                if char_effects.get('character'):
-                                    char_name = char_effects['character'].get('name', '')
-                                    if char_name:
-                                        self.game_state.characters.add(char_name)
-                            
-                            # 记录事件内容
-                            if 'content' in event:
-                                self.game_state.add_event(event['content'])
-                            
-                            # 构建新的事件结构
-                            result = {
-                                'briefDescription': event.get('briefDescription', ''),  # 新增简短描述
-                                'content': event.get('content', ''),  # 详细内容
-                                'effects': event.get('effects', {}),  # 事件效果
-                                'age': self.game_state.age,  # 添加年龄
-                                'triggers': event.get('triggers', {})  # 保留triggers
-                            }
-                            
-                            # 如果有角色效果，也添加到结果中
-                            if 'characterEffects' in event:
-                                result['characterEffects'] = event['characterEffects']
-                            
-                            return result
-                            
-                    logger.error(f"Invalid event data format: {data}")
-                    raise Exception("Invalid event data format")
-                    
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                raise
-            except Exception as e:
-                logger.error(f"Error processing event data: {e}")
-                raise
+            # 预取可能仍在进行，等待它而不是重复请求
+            future = self._take_prefetched(session_id, parameters)
+            response = await self._request_event(parameters, future)
+            if response is None:
+                if self.local_events is None:
+                    raise TimeoutError(f"Event workflow exceeded {EVENT_LATENCY_BUDGET_MS} ms")
+                return self._local_event(state, 'timeout')
             
+            result = self._handle_event_response(response, state)
+            self._schedule_prefetch(session_id, state, original_context, result)
+            return result
         except Exception as e:
             logger.error(f"Error generating event: {str(e)}")
-            raise
+            if self.local_events is None:
+                raise
+            return self._local_event(state, 'coze_error')
+
+    async def _request_event(self, parameters, prefetched=None):
+        """
+        在延迟预算内请求事件工作流。
+
+        参数：
+        parameters: 工作流参数
+        prefetched: 预取得到的 Future（可选），优先等待它
 
-    def get_wechat_messages(self, context=None):
+        返回值：
+        dict: 最先成功的响应；超出预算时返回 None。所有请求都失败时抛出最后一个异常。
+
+        配置了 EVENT_HEDGE_AFTER_MS 时，第一个请求超过该时间仍未返回，
+        会再发出一个相同的请求，取先返回的结果。预取失败时也会重新请求一次。
+        这些额外的请求不参与请求合并，否则会和第一个请求合并成同一个。
+        """
+        workflow_id = self.workflow_ids['event']
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + EVENT_LATENCY_BUDGET_MS / 1000 if EVENT_LATENCY_BUDGET_MS > 0 else None
+        hedge_at = started + EVENT_HEDGE_AFTER_MS / 1000 if EVENT_HEDGE_AFTER_MS > 0 else None
+        spare = (1 if hedge_at is not None else 0) + (1 if prefetched is not None else 0)
+
+        def launch(coalesce=False):
+            return asyncio.ensure_future(self._make_request(workflow_id, parameters, coalesce))
+
+        running = {asyncio.wrap_future(prefetched) if prefetched is not None else launch(coalesce=True)}
+        error = None
+        try:
+            while running:
+                wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+                timeout = None if wake is None else max(0.0, wake - loop.time())
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"Event request failed: {error}")
+
+                now = loop.time()
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    if running and spare:
+                        spare -= 1
+                        running.add(launch())
+                        metrics.HEDGED_REQUESTS.labels('event').inc()
+                        logger.info(f"Event request slower than {EVENT_HEDGE_AFTER_MS} ms, sent hedged request")
+                if not running and spare:
+                    spare -= 1
+                    running.add(launch())
+                if deadline is not None and now >= deadline:
+                    return None
+            raise error or Exception("Event request cancelled")
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def get_wechat_messages(self, context=None, game_state=None):
         """获取微信消息"""
+        state = game_state or self.game_state
         try:
             if context:
-                self.game_state.update_state(**context)
-            response = self._make_request(self.workflow_ids['wechat'], self.game_state.get_parameters())
-            if not response:
-                logger.error("Empty response from API")
-                return []
-            
-            # 尝试从响应中提取数据
-            try:
-                if isinstance(response, str):
-                    data = json.loads(response)
-                else:
-                    data = response.get('data', '')
-                    if isinstance(data, str):
-                        data = json.loads(data)
-                        
-                # 提取 output 字段并解析
-                if isinstance(data, dict) and 'output' in data:
-                    output = data['output']
-                    if isinstance(output, str):
-                        messages_data = json.loads(output)
-                    else:
-                        messages_data = output
-                        
-                    if isinstance(messages_data, dict) and 'messages' in messages_data:
-                        messages = messages_data['messages']
-                        # 记录消息到游戏状态
-                        for msg in messages:
-                            if msg.get('messageChain'):
-                                for chain_msg in msg['messageChain']:
-                                    # 使用统一的消息格式
-                                    formatted_message = (
-                                        f"{self.game_state.age}岁 "
-                                        f"{msg['fromCharacter']}: "
-                                        f"[{chain_msg['text']}]"
-                                    )
-                                    self.game_state.add_message(formatted_message)
-                        return messages
-                        
-                logger.error(f"Invalid message data format: {data}")
-                return []
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                return []
-            except Exception as e:
-                logger.error(f"Error processing message data: {e}")
-                return []
-                
+                state.update_state(**context)
+            response = await self._make_request(self.workflow_ids['wechat'], self._build_parameters(state, 'wechat'))
+            return self._handle_messages_response(response, state)
         except Exception as e:
             logger.error(f"Error getting messages: {str(e)}")
-            return [] 
\ No newline at end of file
+            return []
+
+    async def play_turn(self, context, wechat_contexts=(), game_state=None, session_id=None):
+        """
+        进行一回合（一年）：事件工作流和各联系人的微信工作流并发请求。
+
+        参数：
+        context: 事件上下文（与 generate_event 相同）
+        wechat_contexts: 微信上下文列表，每项对应一个联系人（与 get_wechat_messages 相同）
+
+        返回值：
+        dict: {"event": 事件, "messages": 全部联系人的消息}
+
+        请求参数在状态副本上计算，全部请求返回后才按“事件 → 微信”的顺序写入游戏状态。
+        事件失败且没有本地回退时抛出异常，游戏状态保持不变；某个联系人的微信请求失败时该联系人没有消息。
+        """
+        state = game_state or self.game_state
+        original_context = copy.deepcopy(context)
+
+        scratch = copy.deepcopy(state)
+        self._prepare_event_state(copy.deepcopy(context), scratch)
+        event_parameters = self._build_parameters(scratch, 'event')
+        wechat_parameters = []
+        for wechat_context in wechat_contexts:
+            # 微信消息基于本年开始时的状态，与事件互不等待
+            contact_state = copy.deepcopy(scratch)
+            contact_state.update_state(**wechat_context)
+            wechat_parameters.append(self._build_parameters(contact_state, 'wechat'))
+
+        prefetched = self._take_prefetched(session_id, event_parameters)
+        wechat_id = self.workflow_ids['wechat']
+        event_response, *wechat_responses = await asyncio.gather(
+            self._request_event(event_parameters, prefetched),
+            *(self._make_request(wechat_id, parameters) for parameters in wechat_parameters),
+            return_exceptions=True
+        )
+
+        # 以下没有 await，同一会话的其他请求看不到写了一半的状态；出错时整体回滚
+        snapshot = copy.deepcopy(state)
+        try:
+            self._prepare_event_state(context, state)
+            event = self._turn_event(event_response, state)
+            messages = []
+            for wechat_context, response in zip(wechat_contexts, wechat_responses):
+                state.update_state(**wechat_context)
+                if isinstance(response, BaseException):
+                    logger.error(f"Error getting messages: {response}")
+                    continue
+                messages.extend(self._handle_messages_response(response, state))
+        except Exception:
+            state.restore(snapshot)
+            raise
+
+        self._schedule_prefetch(session_id, state, original_context, event)
+        return {"event": event, "messages": messages}
+
+    def _turn_event(self, response, state):
+        """把回合中事件请求的结果写入状态，超时或出错时使用本地事件"""
+        if response is None:
+            reason, error = 'timeout', TimeoutError(f"Event workflow exceeded {EVENT_LATENCY_BUDGET_MS} ms")
+        elif isinstance(response, BaseException):
+            reason, error = 'coze_error', response
+        else:
+            try:
+                return self._handle_event_response(response, state)
+            except CozePayloadError as e:
+                reason, error = 'coze_error', e
+        logger.error(f"Error generating event: {error}")
+        if self.local_events is None:
+            raise error
+        return self._local_event(state, reason)
@@ -0,0 +1,229 @@
+"""
+这个模块负责解析 Coze 工作流的响应，主要功能包括：
+
+1. 统一解包：
+   - Coze 的响应是多层嵌套的：响应 → data（可能是 JSON 字符串）→ output（可能是 JSON 字符串）
+   - unwrap_output() 逐层解码，三个工作流共用
+
+2. 类型化结果：
+   - TalentSet：天赋字符串列表
+   - Event：事件（简短描述、内容、效果、触发器、角色效果）
+   - MessageBatch：微信消息（每条消息的发送者和消息链）
+
+3. 校验与错误：
+   - 格式不对时抛出 CozePayloadError，错误信息包含出错字段的路径，
+     例如 "$.data.output.events[0].effects.intelligence: expected number, got 'abc'"
+
+4. JSON 后端：
+   - 安装了 orjson 时使用 orjson，否则使用标准库 json
+"""
+
+import json
+from dataclasses import dataclass, field
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+class CozePayloadError(ValueError):
+    """Coze 响应格式不正确"""
+
+    def __init__(self, path, message):
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+def loads(text, path='$'):
+    """解析 JSON 文本（str 或 bytes），失败时抛出 CozePayloadError"""
+    try:
+        return _loads(text)
+    except ValueError as e:
+        raise CozePayloadError(path, f"invalid JSON ({e})") from e
+
+
+def _describe(value):
+    text = repr(value)
+    return text if len(text) <= 40 else f"{text[:40]}..."
+
+
+def _fail(path, name, value):
+    return CozePayloadError(path, f"expected {name}, got {_describe(value)}")
+
+
+def _expect(value, kind, path, name):
+    if not isinstance(value, kind):
+        raise _fail(path, name, value)
+    return value
+
+
+def _number(value, path):
+    if isinstance(value, bool):
+        raise CozePayloadError(path, f"expected number, got {_describe(value)}")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        # LLM 偶尔会把数字写成字符串，例如 "+1"
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    raise CozePayloadError(path, f"expected number, got {_describe(value)}")
+
+
+def unwrap_output(response):
+    """
+    取出工作流的 output 字段，字符串形式的层级会被解码。
+
+    返回值：
+    tuple: (output, output 的路径)
+    """
+    if not response:
+        raise CozePayloadError('$', "empty response")
+    node, path = response, '$'
+    if isinstance(node, (str, bytes)):
+        node = loads(node, path)
+    if isinstance(node, dict) and 'output' not in node and 'data' in node:
+        node, path = node['data'], '$.data'
+        if isinstance(node, (str, bytes)):
+            node = loads(node, path)
+    _expect(node, dict, path, "object")
+    if 'output' not in node:
+        raise CozePayloadError(path, "missing 'output'")
+    output, path = node['output'], f"{path}.output"
+    if isinstance(output, (str, bytes)):
+        output = loads(output, path)
+    return output, path
+
+
+@dataclass
+class TalentSet:
+    talents: tuple
+
+    def __iter__(self):
+        return iter(self.talents)
+
+    def __len__(self):
+        return len(self.talents)
+
+
+@dataclass
+class Event:
+    brief_description: str
+    content: str
+    effects: dict
+    triggers: dict
+    character_effects: dict = None
+
+    @property
+    def character_name(self):
+        """角色效果中的角色名称，没有时为空字符串"""
+        character = (self.character_effects or {}).get('character')
+        return character.get('name', '') if isinstance(character, dict) else ''
+
+    def to_dict(self, age):
+        """转换为返回给前端的事件结构"""
+        result = {
+            'briefDescription': self.brief_description,
+            'content': self.content,
+            'effects': dict(self.effects),
+            'age': str(age),
+            'triggers': self.triggers
+        }
+        if self.character_effects is not None:
+            result['characterEffects'] = self.character_effects
+        return result
+
+
+@dataclass
+class Message:
+    from_character: str
+    texts: tuple
+    raw: dict = field(repr=False)  # 原始消息，前端需要其中的其他字段
+
+
+@dataclass
+class MessageBatch:
+    messages: tuple
+
+    def raw(self):
+        """原始消息列表（返回给前端）"""
+        return [message.raw for message in self.messages]
+
+
+def decode_talents(response):
+    """解析天赋工作流的响应"""
+    output, path = unwrap_output(response)
+    if isinstance(output, dict) and 'talents' in output:
+        output, path = output['talents'], f"{path}.talents"
+    _expect(output, list, path, "list of talents")
+    for i, talent in enumerate(output):
+        if not isinstance(talent, str):
+            raise _fail(f"{path}[{i}]", "string", talent)
+    return TalentSet(tuple(output))
+
+
+def decode_event(response):
+    """解析事件工作流的响应，返回第一个事件"""
+    output, path = unwrap_output(response)
+    _expect(output, dict, path, "object")
+    if 'events' not in output:
+        raise CozePayloadError(path, "missing 'events'")
+    events = _expect(output['events'], list, f"{path}.events", "list")
+    if not events:
+        raise CozePayloadError(f"{path}.events", "no events")
+    path = f"{path}.events[0]"
+    event = _expect(events[0], dict, path, "object")
+
+    content = _expect(event.get('content', ''), str, f"{path}.content", "string")
+    brief = _expect(event.get('briefDescription', ''), str, f"{path}.briefDescription", "string")
+    effects = _expect(event.get('effects') or {}, dict, f"{path}.effects", "object")
+    effects = {
+        attr: value if type(value) in (int, float) else _number(value, f"{path}.effects.{attr}")
+        for attr, value in effects.items()
+    }
+    triggers = _expect(event.get('triggers') or {}, dict, f"{path}.triggers", "object")
+    character_effects = event.get('characterEffects')
+    if character_effects is not None:
+        _expect(character_effects, dict, f"{path}.characterEffects", "object")
+    return Event(brief, content, effects, triggers, character_effects)
+
+
+def decode_messages(response):
+    """解析微信工作流的响应"""
+    output, path = unwrap_output(response)
+    _expect(output, dict, path, "object")
+    if 'messages' not in output:
+        raise CozePayloadError(path, "missing 'messages'")
+    items = _expect(output['messages'], list, f"{path}.messages", "list")
+
+    # 出错时才拼接字段路径，正常路径上不做字符串格式化
+    messages = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise _fail(f"{path}.messages[{i}]", "object", item)
+        chain = item.get('messageChain') or []
+        if not isinstance(chain, list):
+            raise _fail(f"{path}.messages[{i}].messageChain", "list", chain)
+        texts = []
+        for j, chain_msg in enumerate(chain):
+            if not isinstance(chain_msg, dict):
+                raise _fail(f"{path}.messages[{i}].messageChain[{j}]", "object", chain_msg)
+            text = chain_msg.get('text')
+            if not isinstance(text, str):
+                raise _fail(f"{path}.messages[{i}].messageChain[{j}].text", "string", text)
+            texts.append(text)
+        sender = item.get('fromCharacter')
+        if not isinstance(sender, str):
+            if texts:
+                raise _fail(f"{path}.messages[{i}].fromCharacter", "string", sender)
+            sender = ''
+        messages.append(Message(sender, tuple(texts), item))
+    return MessageBatch(tuple(messages))
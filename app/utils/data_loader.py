@@ -13,39 +13,124 @@
    - 使用环境变量来配置数据文件路径
    - 提供默认路径作为备选方案
 
+4. 城市索引缓存：
+   - 城市表只加载一次，构建成按名称和位置索引的不可变结构
+   - 预先计算别名表（alias method），家境档位抽样为 O(1)
+   - 校验每个城市的概率之和为 1
+   - CSV 文件修改时间变化时自动重新加载
+
 主要函数：
 - load_city_data(): 加载城市数据，包含各种经济水平的概率
 - load_talent_data(): 加载天赋数据，包含天赋名称和属性效果
+- load_local_event_data(): 加载本地事件表，Coze 不可用时生成事件
 """
 
 import csv
 import ast
 import os
-from dotenv import load_dotenv
+import random
+import threading
+from collections.abc import Sequence
+from types import MappingProxyType
 
-# 加载环境变量
-load_dotenv()
+# 家境档位对应的概率字段，顺序即档位编号
+CITY_PROBABILITY_FIELDS = (
+    'wealthy_chance',
+    'poor_chance',
+    'normal_chance',
+    'very_poor_chance',
+    'very_wealthy_chance'
+)
+PROBABILITY_TOLERANCE = 1e-6
 
-def load_city_data():
+
+def build_alias_table(probabilities):
     """
-    加载城市数据文件，读取每个城市的经济概率分布。
-    
+    用 Vose 别名法构建抽样表。
+
     返回值：
-    list: 包含城市信息的字典列表，每个字典包含：
-        - city: 城市名称
-        - wealthy_chance: 出现土豪的概率
-        - poor_chance: 出现穷人的概率
-        - normal_chance: 普通人的概率
-        - very_poor_chance: 特别穷的概率
-        - very_wealthy_chance: 特别富有的概率
+    tuple: (prob, alias)，抽样时先均匀选一列 i，
+           再以 prob[i] 的概率取 i，否则取 alias[i]
     """
-    city_data = []
-    city_data_path = os.getenv('CITY_DATA_PATH', 'app/data/city_data.csv')
-    
+    n = len(probabilities)
+    scaled = [p * n for p in probabilities]
+    prob = [0.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        (small if scaled[l] < 1.0 else large).append(l)
+    # 剩余列的概率在浮点误差范围内都是 1
+    for i in small + large:
+        prob[i] = 1.0
+    return tuple(prob), tuple(alias)
+
+
+class CityTable(Sequence):
+    """不可变的城市表，支持按位置和名称索引，以及 O(1) 的家境档位抽样"""
+
+    def __init__(self, rows):
+        cities = []
+        by_name = {}
+        alias_tables = []
+        for row in rows:
+            probabilities = [row[field] for field in CITY_PROBABILITY_FIELDS]
+            if any(p < 0 for p in probabilities):
+                raise ValueError(f"City {row['city']} has negative probabilities: {probabilities}")
+            total = sum(probabilities)
+            if abs(total - 1.0) > PROBABILITY_TOLERANCE:
+                raise ValueError(f"Probabilities of city {row['city']} sum to {total}, expected 1")
+            by_name.setdefault(row['city'], len(cities))
+            cities.append(MappingProxyType(dict(row)))
+            alias_tables.append(build_alias_table(probabilities))
+        self._cities = tuple(cities)
+        self._by_name = MappingProxyType(by_name)
+        self._alias_tables = tuple(alias_tables)
+
+    def __getitem__(self, index):
+        return self._cities[index]
+
+    def __len__(self):
+        return len(self._cities)
+
+    def get(self, name):
+        """按城市名称查找，不存在时返回 None"""
+        index = self._by_name.get(name)
+        return None if index is None else self._cities[index]
+
+    def index_of(self, city):
+        """返回城市记录在表中的位置，不是本表的记录时返回 None"""
+        index = self._by_name.get(city['city'])
+        if index is not None and self._cities[index] is city:
+            return index
+        return None
+
+    def sample_tier(self, index):
+        """按城市的概率分布抽取一个家境档位编号"""
+        prob, alias = self._alias_tables[index]
+        column = random.randrange(len(prob))
+        return column if random.random() < prob[column] else alias[column]
+
+    def alias_tables(self):
+        """所有城市的别名表，按城市位置排列"""
+        return self._alias_tables
+
+
+_city_table = None
+_city_table_key = None
+_city_table_lock = threading.Lock()
+
+
+def _read_city_rows(city_data_path):
+    rows = []
     with open(city_data_path, encoding='utf-8') as f:
         reader = csv.DictReader(f)
         for row in reader:
-            city_data.append({
+            rows.append({
                 'city': row['城市名称'],
                 'wealthy_chance': float(row['出现土豪几率']),
                 'poor_chance': float(row['出现穷鬼几率']),
@@ -53,7 +138,41 @@ def load_city_data():
                 'very_poor_chance': float(row['特别穷几率']),
                 'very_wealthy_chance': float(row['特别富贵的几率'])
             })
-    return city_data
+    return rows
+
+
+def get_city_table():
+    """
+    获取缓存的城市表，CSV 文件修改后自动重新加载。
+    
+    返回值：
+    CityTable: 按名称和位置索引的不可变城市表
+    """
+    global _city_table, _city_table_key
+    city_data_path = os.getenv('CITY_DATA_PATH', 'app/data/city_data.csv')
+    key = (city_data_path, os.stat(city_data_path).st_mtime_ns)
+    if key != _city_table_key:
+        with _city_table_lock:
+            if key != _city_table_key:
+                _city_table = CityTable(_read_city_rows(city_data_path))
+                _city_table_key = key
+    return _city_table
+
+
+def load_city_data():
+    """
+    加载城市数据文件，读取每个城市的经济概率分布。
+    
+    返回值：
+    CityTable: 城市信息的只读序列，每个元素包含：
+        - city: 城市名称
+        - wealthy_chance: 出现土豪的概率
+        - poor_chance: 出现穷人的概率
+        - normal_chance: 普通人的概率
+        - very_poor_chance: 特别穷的概率
+        - very_wealthy_chance: 特别富有的概率
+    """
+    return get_city_table()
 
 def load_talent_data():
     """
@@ -73,4 +192,35 @@ def load_talent_data():
             name = row['name']
             effect = ast.literal_eval(row['effect'])  # 将字符串格式的效果转换为字典
             talents.append({"name": name, "effect": effect})
-    return talents 
\ No newline at end of file
+    return talents 
+
+
+def load_local_event_data():
+    """
+    加载本地事件表（Coze 超时或出错时使用）。
+    
+    返回值：
+    list: 包含事件模板的字典列表，每个字典包含：
+        - min_age / max_age: 适用的年龄范围（含两端）
+        - weight: 抽取权重
+        - requirements: 触发条件字符串，例如 "intelligence>=14;city=北京|上海"
+        - briefDescription: 简短描述
+        - content: 事件内容模板，可使用 {age}、{city}、{name}
+        - effects: 事件效果（字典格式，键为 appearance/intelligence/physical/wealth）
+    """
+    events = []
+    events_data_path = os.getenv('LOCAL_EVENTS_DATA_PATH', 'app/data/local_events.csv')
+    
+    with open(events_data_path, encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            events.append({
+                'min_age': int(row['min_age']),
+                'max_age': int(row['max_age']),
+                'weight': float(row['weight']),
+                'requirements': row['requirements'],
+                'briefDescription': row['briefDescription'],
+                'content': row['content'],
+                'effects': ast.literal_eval(row['effects'])
+            })
+    return events
@@ -0,0 +1,151 @@
+"""
+这个模块负责压缩发给 Coze 的历史记录，主要功能包括：
+
+1. 字节预算：
+   - 每个工作流的 events / messages 字段各有一个 UTF-8 字节预算
+   - 人生越长，发给 LLM 的历史也不会越长
+
+2. 近期原文 + 早期摘要：
+   - 最近 K 条记录原样保留
+   - 更早的记录抽取第一句（截断）并入滚动摘要
+   - 摘要按会话保存在 GameState 的历史缓冲区里，每回合只处理新移出窗口的条目
+
+3. 统计：
+   - 记录每次调用节省的字节数
+"""
+
+import os
+import re
+import logging
+import threading
+from app.models.game_state import HISTORY_SEPARATOR
+
+logger = logging.getLogger('api')
+
+HISTORY_COMPACTION = os.getenv('HISTORY_COMPACTION', 'true').lower() == 'true'
+HISTORY_VERBATIM_ENTRIES = int(os.getenv('HISTORY_VERBATIM_ENTRIES', 8))
+HISTORY_BUDGET_EVENT = int(os.getenv('HISTORY_BUDGET_EVENT', 3000))
+HISTORY_BUDGET_WECHAT = int(os.getenv('HISTORY_BUDGET_WECHAT', 2000))
+HISTORY_BUDGET_TALENT = int(os.getenv('HISTORY_BUDGET_TALENT', 500))
+HISTORY_DIGEST_CHARS = int(os.getenv('HISTORY_DIGEST_CHARS', 24))
+HISTORY_DIGEST_MAX_ENTRIES = 200
+
+DIGEST_PREFIX = "往事摘要："
+DIGEST_JOINER = "、"
+HISTORY_FIELDS = ('events', 'messages')
+
+# 第一句话：到第一个句末标点为止
+_FIRST_CLAUSE = re.compile(r'^(.+?)[。！？!?；;\n]')
+# 记录自带的年龄前缀，例如 "12岁：" 或 "12岁 "
+_AGE_PREFIX = re.compile(r'^\d+\s*岁[：:\s]*')
+
+
+def extract_digest(age, text, max_chars=HISTORY_DIGEST_CHARS):
+    """抽取一条记录的摘要：年龄 + 第一句话（截断）"""
+    text = _AGE_PREFIX.sub('', text.strip())
+    match = _FIRST_CLAUSE.match(text)
+    clause = match.group(1) if match else text
+    if len(clause) > max_chars:
+        clause = clause[:max_chars] + "…"
+    return f"{age}岁{clause}"
+
+
+def _utf8_len(text):
+    return len(text.encode('utf-8'))
+
+
+class HistoryCompactor:
+    """按工作流字节预算压缩 GameState 的历史参数"""
+
+    def __init__(self, budgets=None, verbatim_entries=HISTORY_VERBATIM_ENTRIES):
+        self.budgets = budgets or {
+            'event': HISTORY_BUDGET_EVENT,
+            'wechat': HISTORY_BUDGET_WECHAT,
+            'talent': HISTORY_BUDGET_TALENT
+        }
+        self.verbatim_entries = verbatim_entries
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def compact(self, state, workflow):
+        """
+        生成压缩后的参数。
+
+        参数：
+        state: GameState
+        workflow: 工作流名称（talent / event / wechat）
+
+        返回值：
+        dict: 与 state.get_parameters() 结构相同，历史字段被压缩
+        """
+        parameters = state.get_parameters()
+        budget = self.budgets.get(workflow)
+        if budget is None:
+            return parameters
+
+        before = after = 0
+        for field in HISTORY_FIELDS:
+            original = parameters[field]
+            buffer = getattr(state, field)
+            self._fold(buffer)
+            compacted = self._render(buffer, budget)
+            parameters[field] = compacted
+            before += _utf8_len(original)
+            after += _utf8_len(compacted)
+
+        with self._lock:
+            self.calls += 1
+            self.bytes_before += before
+            self.bytes_after += after
+        if before != after:
+            logger.info(f"Compacted {workflow} history: {before} -> {after} bytes, saved {before - after}")
+        return parameters
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "bytes_before": self.bytes_before,
+                "bytes_after": self.bytes_after,
+                "bytes_saved": self.bytes_before - self.bytes_after
+            }
+
+    def _fold(self, buffer):
+        """把移出原文窗口的条目并入摘要（只处理新移出的条目）"""
+        boundary = buffer.total - self.verbatim_entries
+        while buffer.folded < boundary:
+            entry = buffer.entry(buffer.folded)
+            if entry is not None:
+                buffer.digest.append(extract_digest(*entry))
+            buffer.folded += 1
+        while len(buffer.digest) > HISTORY_DIGEST_MAX_ENTRIES:
+            buffer.digest.popleft()
+
+    def _render(self, buffer, budget):
+        recent = buffer.tail(self.verbatim_entries)
+        # 原文部分超出预算时，从最旧的开始丢弃，至少保留最新一条
+        used = sum(_utf8_len(part) for part in recent) + _utf8_len(HISTORY_SEPARATOR) * max(0, len(recent) - 1)
+        while len(recent) > 1 and used > budget:
+            used -= _utf8_len(recent.pop(0)) + _utf8_len(HISTORY_SEPARATOR)
+        if recent and used > budget:
+            recent[0] = recent[0].encode('utf-8')[:budget].decode('utf-8', 'ignore')
+            used = _utf8_len(recent[0])
+
+        # 剩余预算从新到旧放入摘要
+        remaining = budget - used - _utf8_len(DIGEST_PREFIX) - _utf8_len(HISTORY_SEPARATOR)
+        digest = []
+        for item in reversed(buffer.digest):
+            cost = _utf8_len(item) + (_utf8_len(DIGEST_JOINER) if digest else 0)
+            if cost > remaining:
+                break
+            digest.append(item)
+            remaining -= cost
+
+        parts = []
+        if digest:
+            digest.reverse()
+            parts.append(DIGEST_PREFIX + DIGEST_JOINER.join(digest))
+        parts.extend(recent)
+        return HISTORY_SEPARATOR.join(parts)
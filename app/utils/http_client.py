@@ -0,0 +1,379 @@
+"""
+这个模块负责与 Coze 平台通信的 HTTP 连接管理，主要功能包括：
+
+1. 连接池：
+   - 共享 requests.Session，复用 TCP/TLS 连接（keep-alive）
+   - 连接池大小可配置
+
+2. 超时与重试：
+   - 连接超时和读取超时分开配置
+   - 对 5xx 和连接错误使用带抖动的指数退避重试
+
+3. 熔断器：
+   - 连续失败达到阈值后快速失败，避免请求堆积
+   - 冷却期后放行一个探测请求（半开状态）
+   - 探测请求被取消或超过 COZE_BREAKER_PROBE_TIMEOUT 没有结果时，不会让熔断器一直停在半开状态
+
+4. 预热：
+   - 应用启动时提前建立连接
+
+5. 异步客户端：
+   - 基于 httpx.AsyncClient，运行在共享的后台事件循环上
+   - 与同步客户端共用重试策略和熔断器
+
+6. 多进程：
+   - 预加载后 fork 出的 worker 进程会重建连接池和后台事件循环，不复用父进程的 socket
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('api')
+
+COZE_BASE_URL = os.getenv('COZE_BASE_URL', 'https://api.coze.cn')
+COZE_POOL_SIZE = int(os.getenv('COZE_POOL_SIZE', 20))
+COZE_CONNECT_TIMEOUT = float(os.getenv('COZE_CONNECT_TIMEOUT', 3.05))
+COZE_READ_TIMEOUT = float(os.getenv('COZE_READ_TIMEOUT', 60))
+COZE_MAX_RETRIES = int(os.getenv('COZE_MAX_RETRIES', 2))
+COZE_RETRY_BACKOFF = float(os.getenv('COZE_RETRY_BACKOFF', 0.5))
+COZE_RETRY_BACKOFF_MAX = float(os.getenv('COZE_RETRY_BACKOFF_MAX', 8))
+COZE_BREAKER_THRESHOLD = int(os.getenv('COZE_BREAKER_THRESHOLD', 5))
+COZE_BREAKER_COOLDOWN = float(os.getenv('COZE_BREAKER_COOLDOWN', 30))
+# 半开状态的探测请求最长等待时间，超过后视为丢失，放行新的探测
+COZE_BREAKER_PROBE_TIMEOUT = float(os.getenv('COZE_BREAKER_PROBE_TIMEOUT', COZE_CONNECT_TIMEOUT + COZE_READ_TIMEOUT))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class CircuitBreaker:
+    """简单的三态熔断器：closed -> open -> half_open -> closed"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=COZE_BREAKER_THRESHOLD, cooldown=COZE_BREAKER_COOLDOWN,
+                 probe_timeout=COZE_BREAKER_PROBE_TIMEOUT):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """判断当前是否允许发出请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+                # 冷却结束，只放行一个探测请求
+                self.state = self.HALF_OPEN
+                self.probe_started = now
+                return True
+            if self.state == self.HALF_OPEN and now - self.probe_started >= self.probe_timeout:
+                # 探测请求迟迟没有结果（例如所在线程被卡住），视为丢失，放行新的探测
+                logger.warning(f"Circuit breaker probe got no result in {self.probe_timeout:.0f}s, probing again")
+                self.probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"Circuit breaker opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """
+        请求被取消（延迟预算到期、对冲请求中落后的一方），没有得到上游的结果。
+
+        关闭状态下不计入失败，取消不代表上游故障；
+        半开状态下丢失的就是探测结果，按失败处理，重新打开熔断，冷却后再探测。
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                logger.warning("Circuit breaker probe was cancelled, reopening")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """熔断打开时距离下一次探测的剩余秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略"""
+
+    RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+    def __init__(self, max_retries=COZE_MAX_RETRIES, backoff=COZE_RETRY_BACKOFF, backoff_max=COZE_RETRY_BACKOFF_MAX):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt):
+        """第 attempt 次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def should_retry_status(self, status_code):
+        return status_code in self.RETRY_STATUSES
+
+
+class CozeHttpClient:
+    """带连接池、超时、重试和熔断的 Coze HTTP 客户端"""
+
+    def __init__(self, base_url=COZE_BASE_URL, pool_size=COZE_POOL_SIZE,
+                 connect_timeout=COZE_CONNECT_TIMEOUT, read_timeout=COZE_READ_TIMEOUT,
+                 retry_policy=None, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.pool_size = pool_size
+        self.session = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        # 重试由本客户端自己控制，适配器不做重试
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def reset_after_fork(self):
+        """子进程换用新的连接池；父进程的 socket 仍归父进程使用，这里不关闭"""
+        self.session = self._new_session()
+
+    def post(self, path, json=None, headers=None):
+        """发送 POST 请求，失败时按策略重试，返回 Response"""
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Coze API circuit open, retry after {self.breaker.retry_after():.1f}s"
+                )
+            try:
+                response = self.session.post(url, headers=headers, json=json, timeout=self.timeout)
+                if self.retry_policy.should_retry_status(response.status_code):
+                    # 让 5xx 走统一的失败处理
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                attempt += 1
+                logger.warning(f"Request to {url} failed ({e}), retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # 其他错误（如 ChunkedEncodingError）不重试，同样计入失败
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+
+            self.breaker.record_success()
+            return response
+
+    def stream(self, path, json=None, headers=None):
+        """
+        发送流式 POST 请求，返回未读取正文的 Response。
+
+        只在建立连接阶段重试，开始接收数据后失败不再重试。
+        """
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Coze API circuit open, retry after {self.breaker.retry_after():.1f}s"
+                )
+            try:
+                response = self.session.post(url, headers=headers, json=json, timeout=self.timeout, stream=True)
+                if self.retry_policy.should_retry_status(response.status_code):
+                    response.close()
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                attempt += 1
+                logger.warning(f"Stream request to {url} failed ({e}), retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # 其他错误（如 ChunkedEncodingError）不重试，同样计入失败
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+
+            self.breaker.record_success()
+            return response
+
+    def warm_up(self):
+        """预先建立到 Coze 的连接，失败不影响启动"""
+        try:
+            self.session.head(self.base_url, timeout=self.timeout)
+            logger.info(f"Warmed up connection to {self.base_url}")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Connection warm-up failed: {e}")
+
+    def close(self):
+        self.session.close()
+
+
+class _LoopThread:
+    """后台事件循环线程，所有异步 Coze 请求都在这个循环上执行"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='coze-async-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+class AsyncCozeHttpClient:
+    """异步版本的 Coze HTTP 客户端，可以在任意事件循环中 await"""
+
+    def __init__(self, base_url=COZE_BASE_URL, pool_size=COZE_POOL_SIZE,
+                 connect_timeout=COZE_CONNECT_TIMEOUT, read_timeout=COZE_READ_TIMEOUT,
+                 retry_policy=None, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._loop_thread = _LoopThread()
+        self._client = None
+
+    def reset_after_fork(self):
+        """子进程里没有父进程的事件循环线程，重新启动循环，连接池在首次请求时创建"""
+        self._loop_thread = _LoopThread()
+        self._client = None
+
+    async def post(self, path, json=None, headers=None):
+        """发送 POST 请求，返回 httpx.Response"""
+        coro = self._post(path, json, headers)
+        if asyncio.get_running_loop() is self._loop_thread.loop:
+            return await coro
+        # 连接池绑定在后台循环上，其他循环通过跨线程 future 等待结果
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop_thread.loop)
+        return await asyncio.wrap_future(future)
+
+    async def _post(self, path, json, headers):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, limits=self._limits, timeout=self._timeout
+            )
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Coze API circuit open, retry after {self.breaker.retry_after():.1f}s"
+                )
+            try:
+                response = await self._client.post(path, json=json, headers=headers)
+                if self.retry_policy.should_retry_status(response.status_code):
+                    response.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                attempt += 1
+                logger.warning(f"Async request to {path} failed ({e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # 其他错误（如 httpx.DecodingError）不重试，同样计入失败
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # asyncio.CancelledError：延迟预算到期或对冲请求被取消
+                self.breaker.record_abandoned()
+                raise
+
+            self.breaker.record_success()
+            return response
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """获取进程内共享的 Coze HTTP 客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = CozeHttpClient()
+    return _client
+
+
+def get_async_http_client():
+    """获取进程内共享的异步 Coze HTTP 客户端（与同步客户端共用熔断器）"""
+    global _async_client
+    if _async_client is None:
+        sync_client = get_http_client()
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncCozeHttpClient(
+                    retry_policy=sync_client.retry_policy,
+                    breaker=sync_client.breaker
+                )
+    return _async_client
+
+
+def _reset_clients_after_fork():
+    global _client_lock
+    _client_lock = threading.Lock()
+    if _client is not None:
+        _client.reset_after_fork()
+    if _async_client is not None:
+        _async_client.reset_after_fork()
+
+
+# gunicorn 等预加载应用后再 fork 的服务器：每个 worker 使用自己的连接
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
@@ -0,0 +1,95 @@
+"""
+这个模块负责 Idempotency-Key 请求的结果保存，主要功能包括：
+
+1. 重复请求：
+   - 客户端在 /generate_event、/get_messages、/turn 请求头中带上 Idempotency-Key
+   - 同一会话内重复的键在有效期内直接返回第一次的结果，不会再次调用 Coze 或修改游戏状态
+   - 路由在会话锁内查找和保存结果，连点两次时第二个请求会等第一个完成后拿到同一个结果
+
+2. 冲突检测：
+   - 保存结果时同时保存请求体的哈希，同一个键配上不同的请求体视为冲突（422）
+
+3. 存储后端（复用响应缓存的后端）：
+   - memory: 进程内 LRU
+   - disk: 本地 SQLite 文件，多个 worker 进程共享
+
+只保存成功的结果，失败的请求可以用同一个键重试。
+"""
+
+import os
+import re
+import logging
+from app.utils.response_cache import MemoryCacheBackend, DiskCacheBackend, parameters_hash
+
+logger = logging.getLogger('app')
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_BACKEND = os.getenv('IDEMPOTENCY_BACKEND', 'memory')
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+IDEMPOTENCY_PATH = os.getenv('IDEMPOTENCY_PATH', 'data/idempotency.db')
+
+# 可打印 ASCII，最长 255 个字符
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[\x21-\x7e]{1,255}$')
+
+
+class IdempotencyConflict(ValueError):
+    """同一个 Idempotency-Key 被用于不同的请求"""
+
+
+def request_fingerprint(body):
+    """请求体的哈希，用于识别键被重复用于不同请求"""
+    return parameters_hash(body)
+
+
+class IdempotencyStore:
+    """按 (路由, 会话, 键) 保存请求结果"""
+
+    def __init__(self, backend, ttl=IDEMPOTENCY_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.replays = 0
+        self.conflicts = 0
+
+    def lookup(self, scope, session_id, key, fingerprint):
+        """
+        查找之前保存的结果。
+
+        返回值：
+        之前的结果；没有时返回 None。键已用于其他请求时抛出 IdempotencyConflict。
+        """
+        entry = self.backend.get(self._key(scope, session_id, key))
+        if entry is None:
+            return None
+        if entry['fingerprint'] != fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict(f"{IDEMPOTENCY_HEADER} '{key}' was already used for a different request")
+        self.replays += 1
+        return entry['result']
+
+    def save(self, scope, session_id, key, fingerprint, result):
+        self.backend.set(
+            self._key(scope, session_id, key),
+            {'fingerprint': fingerprint, 'result': result},
+            self.ttl
+        )
+
+    def stats(self):
+        return {
+            "entries": len(self.backend),
+            "ttl": self.ttl,
+            "replays": self.replays,
+            "conflicts": self.conflicts
+        }
+
+    @staticmethod
+    def _key(scope, session_id, key):
+        return f"{scope}:{session_id}:{key}"
+
+
+def create_idempotency_store():
+    """根据 IDEMPOTENCY_BACKEND 创建存储"""
+    if IDEMPOTENCY_BACKEND == 'disk':
+        logger.info(f"Using disk idempotency store: {IDEMPOTENCY_PATH}")
+        return IdempotencyStore(DiskCacheBackend(IDEMPOTENCY_PATH, IDEMPOTENCY_MAX_ENTRIES))
+    return IdempotencyStore(MemoryCacheBackend(IDEMPOTENCY_MAX_ENTRIES))
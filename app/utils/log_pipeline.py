@@ -0,0 +1,206 @@
+"""
+这个模块负责日志的写入管道，主要功能包括：
+
+1. 异步写入：
+   - 请求线程只把日志记录放入队列（QueueHandler）
+   - 后台线程（QueueListener）负责格式化后的落盘
+
+2. 多进程安全的滚动与压缩：
+   - 滚动时持有文件锁，并重新检查磁盘上的文件大小，避免多个进程重复滚动
+   - 发现日志文件已被其他进程滚动时重新打开
+   - 滚动出去的文件使用 gzip 压缩
+
+3. 请求/响应内容的日志：
+   - 只有日志级别开启时才序列化（跳过 json.dumps）
+   - 按比例采样，错误始终记录
+   - 超长内容截断
+
+4. fork 安全：
+   - 预加载后 fork 出的 worker 进程会换用新的队列并重新启动后台写入线程
+"""
+
+import os
+import gzip
+import json
+import queue
+import atexit
+import random
+import shutil
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内锁
+    fcntl = None
+
+LOG_DIR = os.getenv('LOG_DIR', 'logs')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+LOG_COMPRESS = os.getenv('LOG_COMPRESS', 'true').lower() == 'true'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.1))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', 2000))
+
+LOGGER_FILES = {
+    'app': ('app.log', '%(asctime)s - %(name)s - %(levelname)s - %(message)s'),
+    'api': ('api.log', '%(asctime)s - %(levelname)s - %(message)s')
+}
+
+_listeners = []
+_setup_lock = threading.Lock()
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """多个进程写同一个日志文件时也能安全滚动的 RotatingFileHandler"""
+
+    def __init__(self, filename, compress=LOG_COMPRESS, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+        self._lock_path = f"{self.baseFilename}.lock"
+        self._thread_lock = threading.Lock()
+        if compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = _gzip_rotator
+
+    def shouldRollover(self, record):
+        # 其他进程已经滚动过：重新打开当前文件
+        if self.stream is not None and self._replaced():
+            self.stream.close()
+            self.stream = None
+        if self.stream is None:
+            self.stream = self._open()
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with self._thread_lock, _FileLock(self._lock_path):
+            # 拿到锁后再确认一次，可能已经有其他进程完成了滚动
+            try:
+                size = os.path.getsize(self.baseFilename)
+            except OSError:
+                size = 0
+            if size + 1 >= self.maxBytes:
+                super().doRollover()
+            else:
+                if self.stream:
+                    self.stream.close()
+                self.stream = self._open()
+
+    def _replaced(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except OSError:
+            return True
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class _DropQueueHandler(QueueHandler):
+    """队列满时丢弃日志，而不是阻塞请求线程"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DropQueueHandler.dropped += 1
+
+
+def setup_logging(log_dir=LOG_DIR, level=LOG_LEVEL):
+    """为 app / api 日志记录器配置异步写入管道（重复调用无副作用）"""
+    with _setup_lock:
+        if _listeners:
+            return
+        os.makedirs(log_dir, exist_ok=True)
+        for name, (filename, fmt) in LOGGER_FILES.items():
+            handler = SharedRotatingFileHandler(
+                os.path.join(log_dir, filename),
+                maxBytes=LOG_MAX_BYTES,
+                backupCount=LOG_BACKUP_COUNT,
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter(fmt))
+
+            records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            listener = QueueListener(records, handler, respect_handler_level=True)
+            listener.start()
+            queue_handler = _DropQueueHandler(records)
+            _listeners.append((listener, queue_handler))
+
+            target = logging.getLogger(name)
+            target.setLevel(level)
+            target.addHandler(queue_handler)
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """把队列中剩余的日志写完并停止后台线程"""
+    with _setup_lock:
+        while _listeners:
+            listener, _ = _listeners.pop()
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+
+
+def _restart_after_fork():
+    """子进程中没有父进程的写入线程，换用新的队列后重新启动"""
+    global _setup_lock
+    _setup_lock = threading.Lock()
+    for listener, queue_handler in _listeners:
+        records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        listener.queue = queue_handler.queue = records
+        listener._thread = None
+        listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def log_payload(logger, label, payload, error=False):
+    """
+    记录请求或响应内容。
+
+    参数：
+    logger: 日志记录器
+    label: 日志前缀，例如 "Request data"
+    payload: 字符串、可 JSON 序列化的对象，或返回它们的无参函数
+    error: 为 True 时以 ERROR 级别记录且不采样
+    """
+    level = logging.ERROR if error else logging.DEBUG
+    if not logger.isEnabledFor(level):
+        return
+    if not error and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    if callable(payload):
+        payload = payload()
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, ensure_ascii=False)
+    if len(payload) > LOG_PAYLOAD_MAX_CHARS:
+        payload = f"{payload[:LOG_PAYLOAD_MAX_CHARS]}... ({len(payload)} chars)"
+    logger.log(level, f"{label}: {payload}")
@@ -0,0 +1,306 @@
+"""
+这个模块提供进程内的监控指标，主要功能包括：
+
+1. 指标类型：
+   - Counter：只增不减的计数（请求数、错误数、回退次数）
+   - Gauge：可增可减的当前值（进行中的请求数、缓冲区大小）
+   - Histogram：分桶统计（延迟、请求/响应字节数）
+
+2. 导出：
+   - render() 生成 Prometheus 文本格式，由 /metrics 路由返回
+
+记录一次观测只需要一次字典查找和一次加锁，开销可以忽略。
+"""
+
+import time
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟分桶（秒），覆盖本地计算到 LLM 长耗时
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 字节数分桶
+SIZE_BUCKETS = (128, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144, 1048576)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        """取得某组标签值对应的子指标"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(v) for v in values), self._new_child())
+                self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """返回 (后缀, 标签值, 额外标签, 值) 序列"""
+        seen = set()
+        for values, child in list(self._children.items()):
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            for suffix, extra, value in child.samples():
+                yield suffix, tuple(str(v) for v in values), extra, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+    # 无标签指标直接调用子指标的方法
+    def __getattr__(self, attr):
+        if attr.startswith('_') or self.__dict__.get('labelnames', ()):
+            raise AttributeError(attr)
+        return getattr(self.labels(), attr)
+
+
+class _CounterChild:
+    __slots__ = ('value', 'function', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, function):
+        """抓取时调用 function 取值（用于已有的 stats() 计数）"""
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        yield '', None, value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """抓取时调用 function 取值（用于已有的 stats() 数据）"""
+        self.function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        yield '', None, value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶是 +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', f'le="{_format_value(float(bound))}"', cumulative
+        yield '_sum', None, total
+        yield '_count', None, cumulative
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+def timed(histogram, *labels):
+    """装饰器：把函数耗时记录到 histogram"""
+    def decorator(func):
+        child = histogram.labels(*labels)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render():
+    """导出所有指标的 Prometheus 文本格式"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# ---- 应用指标 ----
+
+HTTP_REQUESTS = Counter(
+    'lifesim_http_requests_total', 'HTTP requests by route, method and status',
+    ('route', 'method', 'status')
+)
+HTTP_LATENCY = Histogram(
+    'lifesim_http_request_duration_seconds', 'HTTP request latency (streamed responses until the stream ends)',
+    ('route',)
+)
+HTTP_IN_PROGRESS = Gauge(
+    'lifesim_http_requests_in_progress', 'HTTP requests currently being handled', ('route',)
+)
+FALLBACKS = Counter(
+    'lifesim_fallbacks_total', 'Responses served by a fallback path', ('route', 'reason')
+)
+IDEMPOTENT_REPLAYS = Counter(
+    'lifesim_idempotent_replays_total', 'Responses replayed for a repeated Idempotency-Key', ('route',)
+)
+ADMISSION_DECISIONS = Counter(
+    'lifesim_admission_total', 'Rate-limited route requests by outcome (allowed, throttled, shed)',
+    ('route', 'outcome')
+)
+PREFETCH_EVENTS = Counter(
+    'lifesim_prefetch_events_total',
+    'Speculative event prefetches by outcome (submitted, hit, miss, discarded)', ('outcome',)
+)
+
+WORKFLOW_REQUESTS = Counter(
+    'lifesim_coze_requests_total', 'Coze workflow requests by outcome (ok, error, cache_hit, coalesced)',
+    ('workflow', 'outcome')
+)
+HEDGED_REQUESTS = Counter(
+    'lifesim_coze_hedged_requests_total', 'Hedged (duplicate) Coze requests sent after the hedge delay', ('workflow',)
+)
+WORKFLOW_LATENCY = Histogram(
+    'lifesim_coze_request_duration_seconds', 'Coze workflow latency (cache misses only)', ('workflow',)
+)
+WORKFLOW_IN_PROGRESS = Gauge(
+    'lifesim_coze_requests_in_progress', 'Coze workflow requests in flight', ('workflow',)
+)
+WORKFLOW_REQUEST_BYTES = Histogram(
+    'lifesim_coze_request_bytes', 'Coze workflow request body size', ('workflow',), buckets=SIZE_BUCKETS
+)
+WORKFLOW_RESPONSE_BYTES = Histogram(
+    'lifesim_coze_response_bytes', 'Coze workflow response body size', ('workflow',), buckets=SIZE_BUCKETS
+)
+DECODE_LATENCY = Histogram(
+    'lifesim_decode_duration_seconds', 'Workflow response decoding latency', ('workflow',)
+)
+DECODE_ERRORS = Counter(
+    'lifesim_decode_errors_total', 'Workflow responses that could not be decoded', ('workflow',)
+)
+PARAMETERS_LATENCY = Histogram(
+    'lifesim_game_state_parameters_seconds', 'GameState.get_parameters latency',
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+)
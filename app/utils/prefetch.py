@@ -0,0 +1,158 @@
+"""
+这个模块负责事件的推测式预取，主要功能包括：
+
+1. 推测下一年：
+   - 玩家阅读第 N 岁事件时，推算第 N+1 岁的请求上下文
+     （年龄加一，事件效果按 GameState.apply_effects 的规则计入属性，与服务端写入状态时一致）
+   - 在后台线程池中提前调用事件工作流
+   - 可配置向前预取的深度（lookahead）
+
+2. 命中判定：
+   - 以发给事件工作流的参数快照的哈希作为键
+   - 真实请求的参数哈希一致时直接使用预取结果
+   - 状态发生分歧（例如中间有微信对话）时丢弃该会话的所有推测
+
+3. 统计：
+   - 记录命中、未命中、提交和丢弃次数，用于评估预取是否值得它的 Coze 成本
+"""
+
+import os
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.models.game_state import GameState, STAT_FIELDS
+from app.utils.response_cache import parameters_hash
+
+logger = logging.getLogger('api')
+
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'
+PREFETCH_LOOKAHEAD = int(os.getenv('PREFETCH_LOOKAHEAD', 1))
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 4))
+PREFETCH_MAX_SESSIONS = int(os.getenv('PREFETCH_MAX_SESSIONS', 1000))
+
+
+def state_key(parameters):
+    """计算参数快照的哈希"""
+    return parameters_hash(parameters)
+
+
+def predict_next_context(context, event, state):
+    """推算下一次请求的上下文，属性按服务端提交事件时的规则（GameState.apply_effects）计算"""
+    next_context = copy.deepcopy(context)
+    next_context.pop('characterEffects', None)
+    next_context['age'] = str(int(context.get('age') or 0) + 1)
+    # 在只有属性的临时状态上应用效果，不复制历史记录
+    stats = GameState()
+    stats.max_stats = state.max_stats
+    for key in STAT_FIELDS:
+        setattr(stats, key, getattr(state, key))
+    stats.update_state(**{key: next_context[key] for key in STAT_FIELDS if key in next_context})
+    stats.apply_effects(event.get('effects'))
+    next_context.update((key, str(getattr(stats, key))) for key in STAT_FIELDS)
+    return next_context
+
+
+class EventPrefetcher:
+    """事件预取器，在后台线程池中推测生成后续年份的事件"""
+
+    def __init__(self, api, lookahead=PREFETCH_LOOKAHEAD, workers=PREFETCH_WORKERS,
+                 max_sessions=PREFETCH_MAX_SESSIONS):
+        self.api = api  # 同步 CozeAPI，在线程池中调用
+        self.lookahead = max(1, lookahead)
+        self.max_sessions = max_sessions
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='event-prefetch')
+        self._sessions = OrderedDict()  # session_id -> {state_key: Future}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.submitted = 0
+        self.discarded = 0
+
+    def take(self, session_id, parameters):
+        """
+        取出与当前参数匹配的预取结果。
+
+        返回值：
+        Future 或 None。命中时保留该会话更深层的推测，未命中时全部丢弃。
+        """
+        key = state_key(parameters)
+        with self._lock:
+            speculations = self._sessions.get(session_id)
+            future = speculations.pop(key, None) if speculations else None
+            if future is None:
+                stale = self._sessions.pop(session_id, {})
+                self.misses += 1
+            else:
+                stale = {}
+                self.hits += 1
+            self.discarded += len(stale)
+        for stale_future in stale.values():
+            stale_future.cancel()
+
+        if future is not None:
+            logger.info(f"Prefetch hit (hits={self.hits}, misses={self.misses})")
+        elif stale:
+            logger.info(f"Prefetch miss, discarded {len(stale)} stale speculations")
+        return future
+
+    def schedule(self, session_id, state, context, event):
+        """根据刚返回的事件推测下一年，并提交后台生成"""
+        self._submit(session_id, copy.deepcopy(state), context, event, depth=1)
+
+    def discard(self, session_id):
+        """丢弃某个会话的全部推测"""
+        with self._lock:
+            stale = self._sessions.pop(session_id, {})
+            self.discarded += len(stale)
+        for future in stale.values():
+            future.cancel()
+
+    def stats(self):
+        with self._lock:
+            pending = sum(len(s) for s in self._sessions.values())
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "submitted": self.submitted,
+                "discarded": self.discarded,
+                "pending": pending
+            }
+
+    def _submit(self, session_id, state, context, event, depth):
+        next_context = predict_next_context(context, event, state)
+        self.api._prepare_event_state(copy.deepcopy(next_context), state)
+        parameters = self.api._build_parameters(state, 'event')
+        key = state_key(parameters)
+
+        with self._lock:
+            speculations = self._sessions.setdefault(session_id, {})
+            if key in speculations:
+                return
+            future = self.executor.submit(self._run, session_id, state, next_context, parameters, depth)
+            speculations[key] = future
+            self._sessions.move_to_end(session_id)
+            stale = []
+            while len(self._sessions) > self.max_sessions:
+                _, dropped = self._sessions.popitem(last=False)
+                stale.extend(dropped.values())
+            self.submitted += 1
+            self.discarded += len(stale)
+        for stale_future in stale:
+            stale_future.cancel()
+
+    def _run(self, session_id, state, context, parameters, depth):
+        response = self.api._make_request(self.api.workflow_ids['event'], parameters)
+        with self._lock:
+            active = session_id in self._sessions
+        if depth < self.lookahead and active:
+            try:
+                # 在状态副本上应用推测结果，继续向后推测
+                event = self.api._handle_event_response(response, state)
+                self._submit(session_id, state, context, event, depth + 1)
+            except Exception as e:
+                logger.warning(f"Prefetch chain stopped at depth {depth}: {e}")
+        return response
@@ -0,0 +1,244 @@
+"""
+这个模块负责缓存 Coze 工作流的响应，主要功能包括：
+
+1. 缓存键：
+   - workflow ID + 参数规范化 JSON 的哈希
+   - 参数字段顺序不同也会得到相同的键
+
+2. 按工作流配置策略：
+   - talent: 池模式，同一参数最多缓存 N 个不同结果，池满后随机返回其中一个
+   - event: 精确模式，只在很短的 TTL 内复用完全相同的请求（重试、重复点击）
+   - wechat: 默认不缓存
+
+3. 存储后端：
+   - memory: 进程内 LRU，按条目数限制
+   - disk: 本地 SQLite 文件，多个 worker 进程共享
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing
+
+logger = logging.getLogger('api')
+
+COZE_CACHE_BACKEND = os.getenv('COZE_CACHE_BACKEND', 'memory')
+COZE_CACHE_MAX_ENTRIES = int(os.getenv('COZE_CACHE_MAX_ENTRIES', 5000))
+COZE_CACHE_PATH = os.getenv('COZE_CACHE_PATH', 'data/coze_cache.db')
+COZE_CACHE_TALENT_TTL = int(os.getenv('COZE_CACHE_TALENT_TTL', 3600))
+COZE_CACHE_TALENT_POOL = int(os.getenv('COZE_CACHE_TALENT_POOL', 20))
+COZE_CACHE_EVENT_TTL = int(os.getenv('COZE_CACHE_EVENT_TTL', 30))
+COZE_CACHE_WECHAT_TTL = int(os.getenv('COZE_CACHE_WECHAT_TTL', 0))
+
+
+def parameters_hash(parameters):
+    """计算参数的规范化哈希"""
+    payload = json.dumps(parameters, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CachePolicy:
+    """单个工作流的缓存策略"""
+
+    EXACT = 'exact'
+    POOL = 'pool'
+
+    def __init__(self, ttl, mode=EXACT, pool_size=1):
+        self.ttl = ttl
+        self.mode = mode
+        self.pool_size = pool_size
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+
+DEFAULT_POLICIES = {
+    'talent': CachePolicy(COZE_CACHE_TALENT_TTL, CachePolicy.POOL, COZE_CACHE_TALENT_POOL),
+    'event': CachePolicy(COZE_CACHE_EVENT_TTL, CachePolicy.EXACT),
+    'wechat': CachePolicy(COZE_CACHE_WECHAT_TTL, CachePolicy.EXACT)
+}
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存后端"""
+
+    def __init__(self, max_entries=COZE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """本地 SQLite 缓存后端，多个进程共享同一个文件"""
+
+    def __init__(self, path=COZE_CACHE_PATH, max_entries=COZE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # 建表后立即关闭连接，fork 出的 worker 进程各自重新连接
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+            conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Coze 工作流响应缓存"""
+
+    def __init__(self, backend, policies=None):
+        self.backend = backend
+        self.policies = policies or DEFAULT_POLICIES
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, workflow, workflow_id, parameters):
+        """查找缓存的响应，没有可用结果时返回 None"""
+        policy = self.policies.get(workflow)
+        if policy is None or not policy.enabled:
+            return None
+
+        cached = self.backend.get(self._key(workflow_id, parameters))
+        if policy.mode == CachePolicy.POOL:
+            # 池子还没攒满时继续请求上游，保证结果的多样性
+            if cached and len(cached) >= policy.pool_size:
+                self.hits += 1
+                return random.choice(cached)
+        elif cached is not None:
+            self.hits += 1
+            logger.info(f"Cache hit for {workflow} workflow")
+            return cached
+
+        self.misses += 1
+        return None
+
+    def store(self, workflow, workflow_id, parameters, response):
+        """保存上游响应"""
+        policy = self.policies.get(workflow)
+        if policy is None or not policy.enabled or not response:
+            return
+
+        key = self._key(workflow_id, parameters)
+        if policy.mode == CachePolicy.POOL:
+            pool = self.backend.get(key) or []
+            if len(pool) < policy.pool_size:
+                pool.append(response)
+            self.backend.set(key, pool, policy.ttl)
+        else:
+            self.backend.set(key, response, policy.ttl)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.backend)
+        }
+
+    def _key(self, workflow_id, parameters):
+        return f"{workflow_id}:{parameters_hash(parameters)}"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取进程内共享的响应缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if COZE_CACHE_BACKEND == 'disk':
+                    logger.info(f"Using disk response cache: {COZE_CACHE_PATH}")
+                    _cache = ResponseCache(DiskCacheBackend())
+                else:
+                    _cache = ResponseCache(MemoryCacheBackend())
+    return _cache
@@ -0,0 +1,521 @@
+"""
+这个模块负责可持久化的会话后端（SESSION_BACKEND=journal），主要功能包括：
+
+1. 内存索引：
+   - 会话状态仍然保存在进程内的 LRU 字典中，恢复会话是一次字典查找
+   - 容量控制（条目数、内存字节数、TTL）与 memory 后端相同
+
+2. 追加日志：
+   - 每次写回会话时，与上次写入的状态比较，只记录变化：新增的事件和消息、改变的属性
+   - 开始新人生、出错回滚等整体替换状态的情况记录完整状态
+   - 日志按段（segment-N.log）追加，每条记录带 CRC32，进程崩溃时写了一半的尾部记录在恢复时截掉
+
+3. 组提交：
+   - 写回会话的请求在记录写入磁盘（SESSION_JOURNAL_FSYNC=true 时 fsync）后才返回
+   - 同一时刻只有一个线程写文件，它写盘期间到达的记录由下一个线程一次写入、一次 fsync
+
+4. 快照与压缩：
+   - 日志段超过 SESSION_JOURNAL_SEGMENT_BYTES 或写了 SESSION_JOURNAL_SNAPSHOT_INTERVAL 秒后封存，开始新段
+   - 后台线程把上一个快照和已封存的段重放成新快照（snapshot-N.log，只包含未过期的完整状态），
+     然后删除旧快照和旧段
+   - 快照先写临时文件再改名，任何时刻崩溃都只会留下完整的旧快照或新快照
+
+5. 恢复：
+   - 进程第一次使用会话存储时加载最新快照，再重放之后的日志段
+   - 日志只允许一个进程写入（文件锁），多个 worker 时请使用 sqlite 后端
+
+日志记录（每行 "CRC32 JSON"）：
+    {"op": "put", "s": 会话ID, "t": 时间, "state": GameState.to_dict()}
+    {"op": "upd", "s": 会话ID, "t": 时间, "set": {属性: 值}, "events": [[序号, 年龄, 内容], ...],
+     "messages": [...], "history": {"events": [已折叠条目数, 摘要]}}
+    {"op": "del", "s": 会话ID, "t": 时间}
+"""
+
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from collections import deque
+from app.models.game_state import GameState, STAT_FIELDS
+from app.utils.session_store import (
+    MemorySessionBackend, estimate_state_size,
+    SESSION_MAX_ENTRIES, SESSION_MAX_BYTES, SESSION_TTL
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('app')
+
+SESSION_JOURNAL_DIR = os.getenv('SESSION_JOURNAL_DIR', 'data/journal')
+SESSION_JOURNAL_SEGMENT_BYTES = int(os.getenv('SESSION_JOURNAL_SEGMENT_BYTES', 16 * 1024 * 1024))
+SESSION_JOURNAL_SNAPSHOT_INTERVAL = int(os.getenv('SESSION_JOURNAL_SNAPSHOT_INTERVAL', 600))
+SESSION_JOURNAL_FSYNC = os.getenv('SESSION_JOURNAL_FSYNC', 'true').lower() == 'true'
+
+SEGMENT_PREFIX = 'segment-'
+SNAPSHOT_PREFIX = 'snapshot-'
+FILE_SUFFIX = '.log'
+LOCK_NAME = 'LOCK'
+
+# 直接记录最终值的属性（写入前已经校验过）
+SCALAR_FIELDS = ('name', 'sex', 'age', 'city', 'character', 'version') + STAT_FIELDS
+
+
+def encode_record(record):
+    payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def decode_record(line):
+    """解析一行日志，不完整或校验失败时返回 None"""
+    if len(line) < 10 or not line.endswith(b'\n') or line[8:9] != b' ':
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def _scalars(state):
+    """记录变化用的属性快照"""
+    values = {key: getattr(state, key) for key in SCALAR_FIELDS}
+    values['talents'] = list(state.talents)
+    values['characters'] = sorted(state.characters)
+    return values
+
+
+def _mark(state, scalars=None):
+    """上次写入日志时的状态位置：(事件缓冲, 条目数, 已折叠数, 消息缓冲, 条目数, 已折叠数, 属性)"""
+    return (state.events, state.events.total, state.events.folded,
+            state.messages, state.messages.total, state.messages.folded,
+            scalars if scalars is not None else _scalars(state))
+
+
+def diff_state(state, mark):
+    """
+    计算 state 相对于 mark 的变化。
+
+    返回值：
+    tuple: (变化记录, 当前属性快照)，变化记录为空字典表示没有变化；
+           无法用增量表示（缓冲区被整体替换、新增条目超出缓冲区长度）时返回 None
+    """
+    events, events_total, events_folded, messages, messages_total, messages_folded, scalars = mark
+    if state.events is not events or state.messages is not messages:
+        return None
+    current = _scalars(state)
+    changes = {}
+    changed = {key: value for key, value in current.items() if scalars[key] != value}
+    if changed:
+        changes['set'] = changed
+    for key, buffer, total, folded in (('events', events, events_total, events_folded),
+                                       ('messages', messages, messages_total, messages_folded)):
+        added = buffer.total - total
+        if added < 0 or added > len(buffer):
+            return None
+        if added:
+            changes[key] = [[seq, *buffer.entry(seq)] for seq in range(total, buffer.total)]
+        if buffer.folded != folded:
+            changes.setdefault('history', {})[key] = [buffer.folded, list(buffer.digest)]
+    return changes, current
+
+
+def apply_update(state, record):
+    """把 upd 记录应用到状态上（重放日志时使用）"""
+    values = record.get('set', {})
+    for key in SCALAR_FIELDS:
+        if key in values:
+            setattr(state, key, values[key])
+    if 'talents' in values:
+        state.talents = list(values['talents'])
+    if 'characters' in values:
+        names = set(values['characters'])
+        for name in state.characters - names:
+            state.remove_character(name)
+        state.update_state(characters=names)
+    current_age = state.age
+    for key in ('events', 'messages'):
+        buffer = getattr(state, key)
+        for seq, age, text in record.get(key, ()):
+            # 序号已经存在的条目跳过，重放同一条记录不会重复追加
+            if seq < buffer.total:
+                continue
+            buffer.total = seq
+            state.age = age
+            state.update_state(**{key: text})
+    state.age = current_age
+    for key, (folded, digest) in record.get('history', {}).items():
+        buffer = getattr(state, key)
+        buffer.folded = folded
+        buffer.digest = deque(digest)
+
+
+def replay_record(sessions, record):
+    """把一条日志记录应用到 sessions（会话ID -> [GameState, 写入时间]）"""
+    op, session_id = record.get('op'), record.get('s')
+    if op == 'put':
+        sessions[session_id] = [GameState.from_dict(record['state']), record['t']]
+    elif op == 'upd':
+        entry = sessions.get(session_id)
+        if entry is not None:
+            apply_update(entry[0], record)
+            entry[1] = record['t']
+    elif op == 'del':
+        sessions.pop(session_id, None)
+
+
+def retain(sessions, ttl, max_entries, now=None):
+    """去掉过期的会话，条目数超过上限时保留最近写入的，返回按写入时间排序的 [(会话ID, [状态, 时间]), ...]"""
+    cutoff = (now or time.time()) - ttl
+    live = sorted((item for item in sessions.items() if item[1][1] >= cutoff), key=lambda item: item[1][1])
+    return live[-max_entries:] if max_entries else live
+
+
+class SessionJournal:
+    """分段的追加日志，带组提交和后台快照压缩"""
+
+    def __init__(self, directory=SESSION_JOURNAL_DIR, segment_bytes=SESSION_JOURNAL_SEGMENT_BYTES,
+                 snapshot_interval=SESSION_JOURNAL_SNAPSHOT_INTERVAL, fsync=SESSION_JOURNAL_FSYNC,
+                 ttl=SESSION_TTL, max_entries=SESSION_MAX_ENTRIES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._cond = threading.Condition()
+        self._pending = []       # 等待写入的记录（已编码）
+        self._appended = 0       # 已提交给 append() 的记录数
+        self._written = 0        # 已写入（并 fsync）的记录数
+        self._flushing = False   # 是否有线程正在写文件
+        self._error = None       # 写入失败或关闭后不再接受新记录
+        self._compacting = False
+        self._lock_file = None
+        self._fd = None
+        self.segment = None
+        self._segment_size = 0
+        self._segment_started = 0.0
+
+        self.batches = 0
+        self.records = 0
+        self.bytes_written = 0
+        self.snapshots = 0
+        self.last_snapshot_ms = None
+
+    def _path(self, prefix, number):
+        return os.path.join(self.directory, f"{prefix}{number:08d}{FILE_SUFFIX}")
+
+    def _scan(self):
+        """返回 (快照编号列表, 日志段编号列表)，顺带删除中断的临时文件"""
+        snapshots, segments = [], []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+                continue
+            for prefix, numbers in ((SNAPSHOT_PREFIX, snapshots), (SEGMENT_PREFIX, segments)):
+                if name.startswith(prefix) and name.endswith(FILE_SUFFIX):
+                    try:
+                        numbers.append(int(name[len(prefix):-len(FILE_SUFFIX)]))
+                    except ValueError:
+                        pass
+        return sorted(snapshots), sorted(segments)
+
+    def _sync_directory(self):
+        # 新建、改名、删除文件后同步目录，文件名本身也要落盘
+        if not self.fsync or not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _acquire_lock(self):
+        self._lock_file = open(os.path.join(self.directory, LOCK_NAME), 'a')
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # 平滑重启时旧 worker 可能还在处理请求，等它退出
+            logger.warning(f"Session journal {self.directory} is locked by another process, waiting")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def _replay_file(self, sessions, path, truncate=False):
+        """重放一个文件，返回记录数；遇到损坏的记录时停止，truncate 为 True 时截掉损坏的尾部"""
+        count = valid = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                record = decode_record(line)
+                if record is None:
+                    break
+                replay_record(sessions, record)
+                valid += len(line)
+                count += 1
+            size = f.seek(0, os.SEEK_END)
+        if valid < size:
+            if truncate:
+                logger.warning(f"Truncating torn tail of {path}: {size - valid} bytes")
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+            else:
+                logger.error(f"Corrupt record in {path} at byte {valid}, skipped {size - valid} bytes")
+        return count
+
+    def open(self):
+        """
+        取得日志目录的文件锁，加载最新快照并重放之后的日志段，然后开始一个新的日志段。
+
+        返回值：
+        dict: 会话ID -> [GameState, 最后写入时间]
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._acquire_lock()
+        snapshots, segments = self._scan()
+        base = snapshots[-1] if snapshots else 0
+        # 比最新快照更旧的文件已经并入快照（上次压缩删除前中断时会留下）
+        for number in snapshots[:-1]:
+            os.remove(self._path(SNAPSHOT_PREFIX, number))
+        for number in segments:
+            if number < base:
+                os.remove(self._path(SEGMENT_PREFIX, number))
+        live = [number for number in segments if number >= base]
+
+        sessions = {}
+        snapshot_records = segment_records = 0
+        if snapshots:
+            snapshot_records = self._replay_file(sessions, self._path(SNAPSHOT_PREFIX, base))
+        for number in live:
+            # 只有最后一个日志段可能在写入时中断
+            segment_records += self._replay_file(sessions, self._path(SEGMENT_PREFIX, number),
+                                                 truncate=number == live[-1])
+        logger.info(f"Replayed {snapshot_records + segment_records} journal records "
+                    f"from snapshot {base} and {len(live)} segments")
+
+        self._open_segment(live[-1] + 1 if live else base)
+        if segment_records:
+            # 重启前的日志段压缩进快照，下次恢复只需要读快照
+            self._start_compaction(self.segment)
+        return sessions
+
+    def _open_segment(self, number):
+        if self._fd is not None:
+            os.close(self._fd)
+        self.segment = number
+        self._fd = os.open(self._path(SEGMENT_PREFIX, number), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = os.fstat(self._fd).st_size
+        self._segment_started = time.monotonic()
+        self._sync_directory()
+
+    def append(self, record):
+        """追加一条记录，写入磁盘后返回"""
+        line = encode_record(record)
+        with self._cond:
+            if self._error is not None:
+                raise OSError(f"Session journal is unavailable: {self._error}")
+            self._pending.append(line)
+            self._appended += 1
+            ticket = self._appended
+            while self._written < ticket:
+                if self._error is not None:
+                    raise OSError(f"Session journal is unavailable: {self._error}")
+                if self._flushing:
+                    # 其他线程正在写盘，等它写完后由某个等待者写下一批
+                    self._cond.wait()
+                    continue
+                batch, self._pending = self._pending, []
+                upto = self._appended
+                self._flushing = True
+                self._cond.release()
+                try:
+                    self._write_batch(batch)
+                except OSError as e:
+                    logger.error(f"Session journal write failed: {e}")
+                    self._error = e
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    if self._error is None:
+                        self._written = upto
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        """写入一批记录（只有持有 _flushing 的线程调用）"""
+        data = memoryview(b''.join(batch))
+        while data:
+            data = data[os.write(self._fd, data):]
+        if self.fsync:
+            os.fsync(self._fd)
+        size = sum(len(line) for line in batch)
+        self._segment_size += size
+        self.bytes_written += size
+        self.records += len(batch)
+        self.batches += 1
+        if (self._segment_size >= self.segment_bytes
+                or time.monotonic() - self._segment_started >= self.snapshot_interval):
+            self._open_segment(self.segment + 1)
+            self._start_compaction(self.segment)
+
+    def _start_compaction(self, upto):
+        with self._cond:
+            if self._compacting:
+                # 正在压缩，之后封存的段由下一次压缩处理
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, args=(upto,), name='session-journal-compact', daemon=True).start()
+
+    def _compact(self, upto):
+        """把最新快照和编号小于 upto 的日志段合并为 snapshot-upto"""
+        started = time.perf_counter()
+        try:
+            snapshots, segments = self._scan()
+            base = max((number for number in snapshots if number < upto), default=None)
+            sessions = {}
+            if base is not None:
+                self._replay_file(sessions, self._path(SNAPSHOT_PREFIX, base))
+            sealed = [number for number in segments if (base or 0) <= number < upto]
+            for number in sealed:
+                self._replay_file(sessions, self._path(SEGMENT_PREFIX, number))
+
+            path = self._path(SNAPSHOT_PREFIX, upto)
+            temp_path = path + '.tmp'
+            live = retain(sessions, self.ttl, self.max_entries)
+            with open(temp_path, 'wb') as f:
+                for session_id, (state, written_at) in live:
+                    f.write(encode_record({"op": "put", "s": session_id, "t": written_at, "state": state.to_dict()}))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            self._sync_directory()
+
+            if base is not None:
+                os.remove(self._path(SNAPSHOT_PREFIX, base))
+            for number in sealed:
+                os.remove(self._path(SEGMENT_PREFIX, number))
+            self.snapshots += 1
+            self.last_snapshot_ms = (time.perf_counter() - started) * 1000
+            logger.info(f"Session journal snapshot {upto}: {len(live)} sessions from {len(sealed)} segments "
+                        f"in {self.last_snapshot_ms:.1f} ms")
+        except Exception as e:
+            logger.error(f"Session journal compaction failed: {e}")
+        finally:
+            with self._cond:
+                self._compacting = False
+                self._cond.notify_all()
+
+    def close(self):
+        """等待正在进行的写入和压缩完成，关闭日志段并释放文件锁，之后不再接受新记录"""
+        with self._cond:
+            while self._flushing or self._compacting:
+                self._cond.wait()
+            self._error = OSError("journal is closed")
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "segment": self.segment,
+                "segment_bytes": self._segment_size,
+                "records": self.records,
+                "batches": self.batches,
+                "records_per_batch": round(self.records / self.batches, 2) if self.batches else 0,
+                "bytes_written": self.bytes_written,
+                "snapshots": self.snapshots,
+                "last_snapshot_ms": self.last_snapshot_ms,
+                "fsync": self.fsync
+            }
+
+
+class JournalSessionBackend(MemorySessionBackend):
+    """进程内 LRU 会话后端，状态变化写入追加日志，重启后从快照和日志恢复"""
+
+    def __init__(self, journal=None, max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES, ttl=SESSION_TTL):
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        # _entries: session_id -> [state, last_access, size, 上次写入日志时的 _mark()]
+        self.journal = journal or SessionJournal(ttl=ttl, max_entries=max_entries)
+        self._open_lock = threading.Lock()
+        self._pid = None
+        self.recovered = 0
+        self.recovery_ms = None
+
+    def _ensure_open(self):
+        """第一次使用时恢复会话（在 worker 进程中，而不是 fork 之前的主进程）"""
+        if self._pid is not None:
+            if self._pid != os.getpid():
+                raise RuntimeError("Session journal was opened before fork; use it only in worker processes")
+            return
+        with self._open_lock:
+            if self._pid is not None:
+                return
+            started = time.perf_counter()
+            sessions = self.journal.open()
+            now, monotonic_now = time.time(), time.monotonic()
+            with self._lock:
+                for session_id, (state, written_at) in retain(sessions, self.ttl, self.max_entries, now):
+                    size = estimate_state_size(state)
+                    # 日志记录的是墙上时间，换算成 TTL 淘汰使用的单调时钟
+                    self._entries[session_id] = [state, monotonic_now - (now - written_at), size, _mark(state)]
+                    self._bytes += size
+                self._evict()
+                self.recovered = len(self._entries)
+            self.recovery_ms = (time.perf_counter() - started) * 1000
+            self._pid = os.getpid()
+            logger.info(f"Recovered {self.recovered} sessions from {self.journal.directory} "
+                        f"in {self.recovery_ms:.1f} ms")
+
+    def load(self, session_id):
+        self._ensure_open()
+        return super().load(session_id)
+
+    def save(self, session_id, state, expected_version=None):
+        self._ensure_open()
+        with self._lock:
+            entry = self._entries.get(session_id)
+        result = diff_state(state, entry[3]) if entry is not None and entry[0] is state else None
+        if result is None:
+            scalars = None
+            record = {"op": "put", "s": session_id, "t": time.time(), "state": state.to_dict()}
+        else:
+            changes, scalars = result
+            record = dict(changes, op="upd", s=session_id, t=time.time()) if changes else None
+
+        size = estimate_state_size(state)
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[session_id] = [state, time.monotonic(), size, _mark(state, scalars)]
+            self._bytes += size
+            # 被淘汰的会话不写日志：恢复时按同样的上限和 TTL 重新淘汰
+            self._evict()
+        if record is not None:
+            self.journal.append(record)
+
+    def delete(self, session_id):
+        self._ensure_open()
+        super().delete(session_id)
+        self.journal.append({"op": "del", "s": session_id, "t": time.time()})
+
+    def purge_expired(self):
+        self._ensure_open()
+        return super().purge_expired()
+
+    def stats(self):
+        self._ensure_open()
+        stats = super().stats()
+        stats.update(self.journal.stats())
+        stats.update({"backend": "journal", "recovered": self.recovered, "recovery_ms": self.recovery_ms})
+        return stats
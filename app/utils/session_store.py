@@ -0,0 +1,353 @@
+"""
+这个模块负责按会话隔离的游戏状态存储，主要功能包括：
+
+1. 会话隔离：
+   - 每个玩家（会话ID）拥有独立的 GameState
+   - 会话ID来自请求头 X-Session-Id 或 cookie
+
+2. 容量控制：
+   - 内存后端使用 LRU + 空闲过期（TTL）淘汰
+   - 按条目数和估算内存字节数双重限制
+
+3. 并发控制：
+   - 按会话ID加锁，同一会话的请求串行执行，不同会话互不阻塞
+   - 会话锁只在进程内有效；sqlite 后端写回时按状态版本做比较并交换，
+     其他 worker 已经写入新版本时抛出 StateConflict，不会覆盖对方的修改
+   - 请求出错时不写回，已经做出的修改全部撤销，各个后端的行为一致
+
+4. 可插拔后端：
+   - memory: 进程内字典（默认）
+   - sqlite: 本地 SQLite 文件，可供多个 worker 进程共享
+   - journal: 进程内字典 + 追加日志和快照，重启后恢复（见 app/utils/session_journal.py）
+
+使用方式：
+    store = create_session_store()
+    with store.session(session_id) as state:
+        state.update_state(...)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from app.models.game_state import GameState
+from app.models.state_delta import StateConflict
+
+logger = logging.getLogger('app')
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 10000))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 256 * 1024 * 1024))
+SESSION_TTL = int(os.getenv('SESSION_TTL', 2 * 60 * 60))
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', 'data/sessions.db')
+
+
+def estimate_state_size(state):
+    """估算一个 GameState 占用的内存字节数"""
+    return state.memory_usage()
+
+
+class MemorySessionBackend:
+    """进程内 LRU 会话后端，支持空闲过期和内存上限"""
+
+    # load() 返回保存的对象本身，请求中途的修改会直接留在后端里
+    shares_state = True
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES, ttl=SESSION_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # session_id -> [state, last_access, size]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def load(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl:
+                self._drop(session_id)
+                self.expirations += 1
+                return None
+            entry[1] = now
+            self._entries.move_to_end(session_id)
+            return entry[0]
+
+    def save(self, session_id, state, expected_version=None):
+        # 同一进程内的会话锁已经保证串行，不需要检查版本
+        size = estimate_state_size(state)
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[session_id] = [state, time.monotonic(), size]
+            self._bytes += size
+            self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def purge_expired(self):
+        """清理所有过期会话，返回清理数量"""
+        cutoff = time.monotonic() - self.ttl
+        removed = 0
+        with self._lock:
+            # OrderedDict 按访问时间排序，最旧的在前面
+            while self._entries:
+                session_id, entry = next(iter(self._entries.items()))
+                if entry[1] >= cutoff:
+                    break
+                self._drop(session_id)
+                removed += 1
+            self.expirations += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _drop(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self):
+        # 保留最近写入的会话，从最久未访问的开始淘汰
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            session_id = next(iter(self._entries))
+            self._drop(session_id)
+            self.evictions += 1
+
+
+class SQLiteSessionBackend:
+    """本地 SQLite 会话后端，多个 worker 进程可共享同一个文件"""
+
+    shares_state = False
+
+    def __init__(self, path=SESSION_SQLITE_PATH, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self.evictions = 0
+        self.expirations = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # 建表使用临时连接，构造对象的线程（例如 fork 之前的主进程）不持有连接
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+            self._migrate(conn)
+            conn.commit()
+
+    @staticmethod
+    def _migrate(conn):
+        # 旧版本的表没有 version 列：补上并从状态数据中回填
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'version' in columns:
+            return
+        conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        rows = conn.execute("SELECT session_id, data FROM sessions").fetchall()
+        conn.executemany(
+            "UPDATE sessions SET version = ? WHERE session_id = ?",
+            [(json.loads(data).get('version', 0), session_id) for session_id, data in rows]
+        )
+
+    def _connection(self):
+        # sqlite3 连接不能跨线程共享，每个线程持有自己的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.delete(session_id)
+            self.expirations += 1
+            return None
+        return GameState.from_dict(json.loads(row[0]))
+
+    def save(self, session_id, state, expected_version=None):
+        """
+        写回会话状态。
+
+        expected_version 为加载时的状态版本（新会话为 None）。会话锁只在进程内有效，
+        其他 worker 在这期间写入了同一会话时，数据库中的版本已经不同，抛出 StateConflict。
+        """
+        conn = self._connection()
+        data = json.dumps(state.to_dict(), ensure_ascii=False)
+        now = time.time()
+        cursor = None
+        if expected_version is not None:
+            cursor = conn.execute(
+                "UPDATE sessions SET data = ?, version = ?, updated_at = ? WHERE session_id = ? AND version = ?",
+                (data, state.version, now, session_id, expected_version)
+            )
+        if cursor is None or cursor.rowcount == 0:
+            # 新会话，或者加载之后被过期清理删除了
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, data, state.version, now)
+            )
+        conn.commit()
+        if cursor.rowcount == 0:
+            row = conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            raise StateConflict(GameState.from_dict(json.loads(row[0])) if row else state)
+        self._evict(conn)
+
+    def delete(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._connection()
+        cursor = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        conn.commit()
+        self.expirations += cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self):
+        conn = self._connection()
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions ORDER BY updated_at LIMIT ?)",
+                (overflow,)
+            )
+            conn.commit()
+            self.evictions += overflow
+
+
+class SessionStore:
+    """会话状态存储，负责加锁、加载和写回"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        # 会话锁只在有请求持有时存在，数量不超过并发请求数
+        self._locks = {}  # session_id -> [RLock, 引用计数]
+        self._locks_guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def lock_for(self, session_id):
+        """持有会话对应的锁"""
+        with self._locks_guard:
+            entry = self._locks.get(session_id)
+            if entry is None:
+                entry = self._locks[session_id] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[session_id]
+
+    @contextmanager
+    def session(self, session_id):
+        """加锁获取会话状态，正常退出时写回后端，出错时撤销本次的修改"""
+        with self.lock_for(session_id):
+            state = self.backend.load(session_id)
+            expected_version = None
+            if state is None:
+                self.misses += 1
+                state = GameState()
+            else:
+                self.hits += 1
+                expected_version = state.version
+            # 内存类后端交给请求的是保存的对象本身，先留一份快照，出错时恢复
+            snapshot = state.snapshot() if expected_version is not None and self.backend.shares_state else None
+            try:
+                yield state
+            except BaseException:
+                # 包括流式响应被客户端中断时的 GeneratorExit
+                if snapshot is not None:
+                    state.rollback(snapshot)
+                raise
+            self.backend.save(session_id, state, expected_version)
+
+    def get(self, session_id):
+        """只读获取会话状态，不存在时返回 None"""
+        with self.lock_for(session_id):
+            return self.backend.load(session_id)
+
+    def reset(self, session_id):
+        """删除会话状态"""
+        with self.lock_for(session_id):
+            self.backend.delete(session_id)
+
+    def purge_expired(self):
+        return self.backend.purge_expired()
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats.update({"hits": self.hits, "misses": self.misses})
+        return stats
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """根据配置创建会话存储"""
+    if backend == 'sqlite':
+        logger.info(f"Using SQLite session backend: {SESSION_SQLITE_PATH}")
+        return SessionStore(SQLiteSessionBackend())
+    if backend == 'journal':
+        from app.utils.session_journal import JournalSessionBackend, SESSION_JOURNAL_DIR
+        logger.info(f"Using journal session backend: {SESSION_JOURNAL_DIR}")
+        return SessionStore(JournalSessionBackend())
+    if backend != 'memory':
+        logger.warning(f"Unknown session backend '{backend}', falling back to memory")
+    return SessionStore(MemorySessionBackend())
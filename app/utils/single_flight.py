@@ -0,0 +1,115 @@
+"""
+这个模块负责合并并发的相同请求（single-flight），主要功能包括：
+
+1. 请求合并：
+   - 同一个键同时只有一个调用真正执行（leader），其余调用等待它的结果
+   - 结果或异常原样交给所有等待者，调用结束后立即移除，之后的调用重新执行
+
+2. 同步与异步：
+   - do() 用于线程，do_async() 用于协程，两者共享同一个表，
+     同步调用和异步调用之间也会合并
+   - 等待者被取消不会影响正在执行的调用；执行者被取消时，等待者中的一个接替它重新执行
+
+使用方式：
+    flight = SingleFlight()
+    response = flight.do(key, lambda: post(...))
+    response = await flight.do_async(key, lambda: post_async(...))
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _LeaderCancelled(Exception):
+    """执行者被取消，等待者需要重新执行"""
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._calls = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """返回 (Future, 是否由当前调用执行)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, func):
+        """
+        执行 func()，同一个键的并发调用共享结果。
+
+        返回值：
+        tuple: (结果, 是否与其他调用合并)
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except _LeaderCancelled:
+                continue
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    async def do_async(self, key, func):
+        """
+        await func()，同一个键的并发调用共享结果。
+
+        返回值：
+        tuple: (结果, 是否与其他调用合并)
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield：等待者被取消时不能取消共享的 Future
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except _LeaderCancelled:
+                continue
+
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            self._finish(key, future, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    def pending(self):
+        """正在执行的调用数"""
+        return len(self._calls)
+
+    def stats(self):
+        return {"pending": self.pending(), "leaders": self.leaders, "coalesced": self.coalesced}
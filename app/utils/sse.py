@@ -0,0 +1,94 @@
+"""
+这个模块提供 Server-Sent Events 相关的工具，主要功能包括：
+
+1. 解析上游（Coze 流式工作流）的 SSE 事件
+2. 生成发给浏览器的 SSE 文本
+3. 从不完整的 JSON 文本中增量提取某个字符串字段，
+   用于在 LLM 输出结束前把事件正文逐段推给前端
+"""
+
+import re
+import json
+
+
+def iter_sse_events(lines):
+    """把 SSE 文本行解析为 (event, data) 序列"""
+    event = 'message'
+    data = []
+    for line in lines:
+        if line is None:
+            continue
+        if line == '':
+            if data:
+                yield event, '\n'.join(data)
+            event = 'message'
+            data = []
+        elif line.startswith(':'):
+            continue
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].lstrip(' '))
+    if data:
+        yield event, '\n'.join(data)
+
+
+def format_sse(event, data):
+    """生成一条 SSE 消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class PartialJSONString:
+    """
+    从逐段到达的 JSON 文本中提取第一个指定字段的字符串值。
+
+    每次 feed() 返回新解码出的部分，字段结束后不再返回内容。
+    """
+
+    def __init__(self, field):
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ''
+        self._pos = None   # 下一个待解码字符的位置
+        self.done = False
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.done:
+            return ''
+        if self._pos is None:
+            match = self._pattern.search(self._buffer)
+            if match is None:
+                return ''
+            self._pos = match.end()
+
+        out = []
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                self.done = True
+                pos += 1
+                break
+            if char != '\\':
+                out.append(char)
+                pos += 1
+                continue
+            # 转义序列不完整时等待后续数据
+            if pos + 1 >= len(buffer):
+                break
+            code = buffer[pos + 1]
+            if code == 'u':
+                if pos + 6 > len(buffer):
+                    break
+                out.append(chr(int(buffer[pos + 2:pos + 6], 16)))
+                pos += 6
+            else:
+                out.append(_ESCAPES.get(code, code))
+                pos += 2
+        self._pos = pos
+        return ''.join(out)
@@ -0,0 +1,107 @@
+"""
+这个模块负责预先生成 AI 天赋，主要功能包括：
+
+1. 天赋缓冲队列：
+   - 保存若干组已经解析好的天赋
+   - /random_allocate 直接从队列取出，O(1) 且不等待 Coze
+
+2. 后台补充：
+   - 后台线程在队列低于低水位时补充到高水位
+   - 两次调用之间有最小间隔，避免打满 Coze 配额
+   - 调用失败时指数退避
+
+队列为空时由调用方回退到本地 talents.csv 天赋池。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('app')
+
+TALENT_BUFFER_LOW = int(os.getenv('TALENT_BUFFER_LOW', 5))
+TALENT_BUFFER_HIGH = int(os.getenv('TALENT_BUFFER_HIGH', 20))
+TALENT_BUFFER_MIN_INTERVAL = float(os.getenv('TALENT_BUFFER_MIN_INTERVAL', 1.0))
+TALENT_BUFFER_MAX_BACKOFF = 60.0
+
+
+class TalentBuffer:
+    """后台补充的天赋缓冲队列"""
+
+    def __init__(self, producer, low=TALENT_BUFFER_LOW, high=TALENT_BUFFER_HIGH,
+                 min_interval=TALENT_BUFFER_MIN_INTERVAL):
+        self.producer = producer  # 返回一组已解析天赋的函数
+        self.low = low
+        self.high = max(high, low + 1)
+        self.min_interval = min_interval
+        self._items = deque(maxlen=self.high)
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.served = 0
+        self.empty = 0
+        self.produced = 0
+        self.failures = 0
+
+    def start(self):
+        """启动后台补充线程（重复调用无副作用）"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='talent-buffer', daemon=True)
+                self._thread.start()
+                self._wakeup.set()
+
+    def pop(self):
+        """取出一组天赋，队列为空时返回 None"""
+        self.start()
+        try:
+            talents = self._items.popleft()
+            self.served += 1
+        except IndexError:
+            talents = None
+            self.empty += 1
+        if len(self._items) < self.low:
+            self._wakeup.set()
+        return talents
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "size": len(self._items),
+            "low": self.low,
+            "high": self.high,
+            "served": self.served,
+            "empty": self.empty,
+            "produced": self.produced,
+            "failures": self.failures
+        }
+
+    def _run(self):
+        backoff = self.min_interval
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._items) < self.high:
+                started = time.monotonic()
+                try:
+                    talents = self.producer()
+                except Exception as e:
+                    talents = None
+                    logger.warning(f"Talent buffer refill failed: {e}")
+                if talents:
+                    self._items.append(talents)
+                    self.produced += 1
+                    backoff = self.min_interval
+                else:
+                    self.failures += 1
+                    backoff = min(TALENT_BUFFER_MAX_BACKOFF, backoff * 2)
+                # 限速：两次调用间隔至少 min_interval，失败时按退避时间等待
+                delay = (self.min_interval if talents else backoff) - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
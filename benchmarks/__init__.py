@@ -0,0 +1,9 @@
+"""
+热点路径的进程内基准测试。
+
+用法：
+    python -m benchmarks.run                      # 运行全部用例并与基线比较
+    python -m benchmarks.run --filter game_state  # 只运行名称包含 game_state 的用例
+    python -m benchmarks.run --save-baseline      # 把本次结果保存为基线
+    python -m benchmarks.importtime               # 导入时间和 create_app() 耗时
+"""
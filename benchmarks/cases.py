@@ -0,0 +1,156 @@
+"""
+基准用例：角色生成、数据加载、GameState、天赋字符串解析和 Coze 响应解析。
+
+Coze 相关用例使用固定的响应样例，不发送网络请求。
+"""
+
+import json
+from benchmarks.harness import case
+from app.models.attributes import generate_random_attributes_and_city, calculate_wealth
+from app.models.game_state import GameState
+from app.models.coze_systems import CozeSystems
+from app.models.talents import parse_talent
+from app.utils import data_loader
+from app.utils.coze_api import CozeAPI
+
+TALENT_STRINGS = ["明眸皓齿（颜值+3）", "过目不忘（智力+2）", "体弱多病（体质-2）"]
+
+EVENT_OUTPUT = {
+    "events": [{
+        "briefDescription": "第一次参加竞赛",
+        "content": "你报名参加了市里的数学竞赛，虽然只拿了三等奖，但老师对你刮目相看。",
+        "effects": {"intelligence": 1, "appearance": 0},
+        "triggers": {},
+        "characterEffects": {"character": {"name": "王老师"}}
+    }]
+}
+
+MESSAGES_OUTPUT = {
+    "messages": [{
+        "fromCharacter": "妈妈",
+        "messageChain": [
+            {"text": "今天考得怎么样？"},
+            {"text": "晚上回来吃饭吗"}
+        ]
+    }]
+}
+
+
+def _canned_response(output):
+    """模拟 Coze 返回的多层嵌套 JSON：data 是字符串，output 也是字符串"""
+    return {"code": 0, "data": json.dumps({"output": json.dumps(output, ensure_ascii=False)}, ensure_ascii=False)}
+
+
+def _bare_api():
+    # 只使用响应解析方法，不需要 token 和 workflow ID
+    return CozeAPI.__new__(CozeAPI)
+
+
+def _full_state():
+    """历史记录已满的游戏状态"""
+    state = GameState()
+    for i in range(state.max_history):
+        state.age += 1
+        state.add_event(f"你在学校里度过了平凡的一年，认识了新朋友，成绩稳中有升。第{i}件事。")
+        state.add_message(f"妈妈: 今天降温了，记得多穿点衣服。第{i}条")
+        state.add_character(f"同学{i}")
+    return state
+
+
+@case('attributes.generate_random_attributes_and_city')
+def bench_generate_character():
+    cities = data_loader.load_city_data()
+    return lambda: generate_random_attributes_and_city(cities)
+
+
+@case('attributes.calculate_wealth')
+def bench_calculate_wealth():
+    city = data_loader.load_city_data()[0]
+    return lambda: calculate_wealth(city)
+
+
+@case('data_loader.load_city_data')
+def bench_load_city_data():
+    return data_loader.load_city_data
+
+
+@case('data_loader.load_city_data.cold')
+def bench_load_city_data_cold():
+    def load():
+        data_loader._city_table_key = None
+        return data_loader.load_city_data()
+    return load
+
+
+@case('data_loader.load_talent_data')
+def bench_load_talent_data():
+    return data_loader.load_talent_data
+
+
+@case('game_state.update_state')
+def bench_update_state():
+    state = _full_state()
+    context = {
+        "age": "20", "appearance": "12", "intelligence": "15", "physical": "9", "wealth": "11",
+        "characters": ["妈妈", "王老师"], "events": "你考上了大学。"
+    }
+    return lambda: state.update_state(**context)
+
+
+@case('game_state.add_event')
+def bench_add_event():
+    state = _full_state()
+    return lambda: state.add_event("你考上了大学，第一次离开家乡。")
+
+
+@case('game_state.add_message')
+def bench_add_message():
+    state = _full_state()
+    return lambda: state.add_message("妈妈: [到学校了吗？] [当天]")
+
+
+@case('game_state.get_parameters')
+def bench_get_parameters():
+    state = _full_state()
+    return state.get_parameters
+
+
+@case('coze_systems.parse_talent_string')
+def bench_parse_talent_string():
+    systems = CozeSystems.__new__(CozeSystems)
+
+    def parse():
+        for talent in TALENT_STRINGS:
+            systems._parse_talent_string(talent)
+    return parse
+
+
+@case('talents.parse_talent.uncached')
+def bench_parse_talent_uncached():
+    def parse():
+        for talent in TALENT_STRINGS:
+            parse_talent(talent)
+    return parse
+
+
+@case('coze_api.decode_talents')
+def bench_decode_talents():
+    api = _bare_api()
+    response = _canned_response(TALENT_STRINGS)
+    return lambda: api._handle_talents_response(response)
+
+
+@case('coze_api.decode_event')
+def bench_decode_event():
+    api = _bare_api()
+    state = _full_state()
+    response = _canned_response(EVENT_OUTPUT)
+    return lambda: api._handle_event_response(response, state)
+
+
+@case('coze_api.decode_messages')
+def bench_decode_messages():
+    api = _bare_api()
+    state = _full_state()
+    response = _canned_response(MESSAGES_OUTPUT)
+    return lambda: api._handle_messages_response(response, state)
@@ -0,0 +1,104 @@
+"""
+基准测试的计时与基线比较。
+
+每个用例是一个 setup 函数，返回需要计时的无参函数。计时使用 timeit：
+先自动确定每轮调用次数（每轮至少 MIN_ROUND_SECONDS），再重复多轮，
+记录单次调用耗时的最小值和中位数（微秒）。与基线比较时使用中位数。
+"""
+
+import sys
+import json
+import time
+import timeit
+import platform
+import statistics
+
+MIN_ROUND_SECONDS = 0.05
+
+CASES = {}
+
+
+def case(name):
+    """注册一个基准用例"""
+    def decorator(setup):
+        if name in CASES:
+            raise ValueError(f"Duplicate benchmark case: {name}")
+        CASES[name] = setup
+        return setup
+    return decorator
+
+
+def run_case(setup, repeat):
+    """运行单个用例，返回统计结果（单位：微秒/次）"""
+    func = setup()
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        if timer.timeit(number) >= MIN_ROUND_SECONDS:
+            break
+        number *= 2
+    rounds = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_us": min(rounds),
+        "median_us": statistics.median(rounds),
+        "max_us": max(rounds)
+    }
+
+
+def run(names, repeat):
+    """运行指定用例，返回可序列化的结果"""
+    results = {}
+    for name in names:
+        results[name] = run_case(CASES[name], repeat)
+    return {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+
+
+def compare(current, baseline, threshold, key='median_us'):
+    """
+    与基线比较（默认比较中位数）。
+
+    返回值：
+    list: 每个用例的 (名称, 基线中位数, 当前中位数, 变化比例, 是否退化)
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            rows.append((name, None, result[key], None, False))
+            continue
+        change = result[key] / base[key] - 1 if base[key] else 0.0
+        rows.append((name, base[key], result[key], change, change > threshold))
+    return rows
+
+
+def report(current, baseline, threshold, unit='us'):
+    """打印与基线的对比表（比较 median_<unit>），返回退化的用例数"""
+    regressions = 0
+    print(f"{'case':<45} {'baseline ' + unit:>12} {'median ' + unit:>12} {'change':>8}")
+    for name, base, median, change, regressed in compare(current, baseline, threshold, f"median_{unit}"):
+        base_text = f"{base:12.2f}" if base is not None else f"{'-':>12}"
+        change_text = f"{change:+8.1%}" if change is not None else f"{'new':>8}"
+        marker = '  REGRESSION' if regressed else ''
+        print(f"{name:<45} {base_text} {median:12.2f} {change_text}{marker}")
+        regressions += regressed
+    if regressions:
+        print(f"{regressions} case(s) slower than baseline by more than {threshold:.0%}", file=sys.stderr)
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
@@ -0,0 +1,125 @@
+"""
+测量导入时间和应用创建时间（worker 启动和测试收集的主要开销）。
+
+每个目标在新的解释器进程中运行 --repeat 次，记录语句本身的耗时（毫秒）；
+create_app 再用 python -X importtime 列出自身耗时最多的模块。
+结果格式与 benchmarks.run 相同，与基线比较的方式也相同：
+
+    python -m benchmarks.importtime                   # 与 benchmarks/importtime_baseline.json 比较
+    python -m benchmarks.importtime --top 20          # 列出最慢的 20 个模块
+    python -m benchmarks.importtime --save-baseline   # 更新基线
+"""
+
+import os
+import sys
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks import harness
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'importtime_baseline.json')
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'importtime.json')
+DEFAULT_THRESHOLD = float(os.getenv('BENCH_REGRESSION_THRESHOLD', 0.25))
+
+# 名称 -> 在新进程中计时的语句
+TARGETS = {
+    'import app': 'import app',
+    'import app.models.talents': 'import app.models.talents',
+    'import app.routes': 'import app.routes',
+    'create_app': 'from app import create_app; create_app(warm_up=False)',
+}
+
+_SCRIPT = (
+    "import time\n"
+    "started = time.perf_counter()\n"
+    "{statement}\n"
+    "print(time.perf_counter() - started)\n"
+)
+
+
+def run_target(statement, env, importtime=False):
+    """
+    在新的解释器进程中运行语句。
+
+    返回值：
+    tuple: (耗时秒数, -X importtime 的输出)
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', _SCRIPT.format(statement=statement)]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(output):
+    """解析 -X importtime 的输出，返回 [(模块, 自身微秒, 累计微秒)]"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Measure import and app start-up time')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreter runs per target')
+    parser.add_argument('--top', type=int, default=15, help='how many of the slowest modules to list')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the JSON results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown ratio of the median before failing (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 应用日志写到临时目录，不预热 Coze 连接
+        env = dict(os.environ, LOG_DIR=tmp, COZE_WARMUP='false')
+        results = {}
+        for name, statement in TARGETS.items():
+            rounds = [run_target(statement, env)[0] * 1000 for _ in range(args.repeat)]
+            results[name] = {
+                "number": 1,
+                "repeat": args.repeat,
+                "min_ms": min(rounds),
+                "median_ms": statistics.median(rounds),
+                "max_ms": max(rounds)
+            }
+        _, output = run_target(TARGETS['create_app'], env, importtime=True)
+
+    current = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+    harness.save(current, args.output)
+
+    baseline = harness.load(args.baseline) if os.path.exists(args.baseline) else {}
+    regressions = harness.report(current, baseline, args.threshold, unit='ms')
+
+    print("\nSlowest modules for create_app (python -X importtime)")
+    print(f"{'module':<45} {'self ms':>12} {'cumulative ms':>14}")
+    for module, self_us, cumulative_us in sorted(parse_importtime(output), key=lambda r: -r[1])[:args.top]:
+        print(f"{module:<45} {self_us / 1000:12.2f} {cumulative_us / 1000:14.2f}")
+
+    if args.save_baseline:
+        harness.save(current, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+运行基准测试并与基线比较。
+
+结果以 JSON 写入 --output；中位数比基线慢超过 --threshold（比例）时以状态码 1 退出，
+可以直接放在部署前的检查步骤里。
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+from benchmarks import harness
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results.json')
+DEFAULT_THRESHOLD = float(os.getenv('BENCH_REGRESSION_THRESHOLD', 0.25))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run hot-path micro-benchmarks')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds per case')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the JSON results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown ratio of the median before failing (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 基准测试只关心代码本身的耗时，不写日志
+    logging.disable(logging.CRITICAL)
+    from benchmarks import cases  # noqa: F401  注册用例
+
+    names = [name for name in sorted(harness.CASES) if args.filter in name]
+    if not names:
+        print(f"No benchmark matches '{args.filter}'", file=sys.stderr)
+        return 2
+
+    current = harness.run(names, args.repeat)
+    harness.save(current, args.output)
+
+    baseline = harness.load(args.baseline) if os.path.exists(args.baseline) else {}
+    regressions = harness.report(current, baseline, args.threshold)
+
+    if args.save_baseline:
+        harness.save(current, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
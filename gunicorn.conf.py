@@ -0,0 +1,81 @@
+"""
+生产环境推荐的 gunicorn 配置，`python serve.py` 和直接运行 `gunicorn` 都会读取。
+
+- 预加载（preload_app）：主进程加载应用、城市表、天赋池和模板后再 fork，worker 共享只读数据
+- gthread worker：每个 worker 若干线程，等待 Coze 响应时不占满进程
+- 平滑重启：SIGHUP 重新读取配置并逐个替换 worker；SIGTERM 停止接收新连接，
+  最多等待 graceful_timeout 秒让进行中的请求完成
+- max_requests：worker 处理一定数量请求后由主进程替换，限制内存增长。
+  替换 worker 会丢掉它内存里的数据，所以会话、Idempotency-Key 结果或令牌桶
+  有任何一项使用内存存储时（只有单个 worker 才会这样，见下方）不启用 max_requests；
+  需要定期替换 worker 时改用 SESSION_BACKEND=sqlite/journal、IDEMPOTENCY_BACKEND=disk、
+  RATE_LIMIT_BACKEND=sqlite
+
+所有设置都可以用环境变量覆盖，见 .env.example。
+"""
+
+import os
+import sys
+import multiprocessing
+from app.config import load_environment
+
+load_environment()
+
+wsgi_app = 'serve:create_production_app()'
+
+bind = os.getenv('SERVE_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('SERVE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('SERVE_THREADS', 8))
+preload_app = True
+
+# 内存会话、幂等结果和令牌桶只在单个进程内可见，多个 worker 时改用共享的 SQLite 存储
+if workers > 1 and os.getenv('SESSION_BACKEND', 'memory') == 'memory':
+    print("SESSION_BACKEND=memory is per process; using sqlite for multiple workers", file=sys.stderr)
+    os.environ['SESSION_BACKEND'] = 'sqlite'
+if workers > 1 and os.getenv('SESSION_BACKEND') == 'journal':
+    print("SESSION_BACKEND=journal has a single writer; using sqlite for multiple workers", file=sys.stderr)
+    os.environ['SESSION_BACKEND'] = 'sqlite'
+if workers > 1 and os.getenv('IDEMPOTENCY_BACKEND', 'memory') == 'memory':
+    print("IDEMPOTENCY_BACKEND=memory is per process; using disk for multiple workers", file=sys.stderr)
+    os.environ['IDEMPOTENCY_BACKEND'] = 'disk'
+if workers > 1 and os.getenv('RATE_LIMIT_BACKEND', 'memory') == 'memory':
+    print("RATE_LIMIT_BACKEND=memory is per process; using sqlite for multiple workers", file=sys.stderr)
+    os.environ['RATE_LIMIT_BACKEND'] = 'sqlite'
+
+# Coze 工作流可能需要几十秒，超时要比 COZE_READ_TIMEOUT 宽松
+timeout = int(os.getenv('SERVE_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('SERVE_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('SERVE_KEEPALIVE', 5))
+max_requests = int(os.getenv('SERVE_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('SERVE_MAX_REQUESTS_JITTER', 200))
+
+# 状态只在 worker 内存里时，替换 worker 等于清空会话、幂等结果和令牌桶
+_in_process_state = [
+    name for name in ('SESSION_BACKEND', 'IDEMPOTENCY_BACKEND', 'RATE_LIMIT_BACKEND')
+    if os.getenv(name, 'memory') == 'memory'
+]
+if max_requests > 0 and _in_process_state:
+    print(f"{', '.join(_in_process_state)}=memory would be lost when a worker is recycled; "
+          f"disabling max_requests", file=sys.stderr)
+    max_requests = 0
+
+# 应用日志由 app/utils/log_pipeline.py 写入 logs/，这里只输出 gunicorn 自身的日志
+accesslog = os.getenv('SERVE_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('SERVE_LOG_LEVEL', 'info')
+proc_name = 'lifesim'
+
+
+def post_fork(server, worker):
+    """worker 启动后在后台预热自己的 Coze 连接"""
+    if os.getenv('COZE_WARMUP', 'true').lower() == 'true':
+        import threading
+        from app.utils.http_client import get_http_client
+        threading.Thread(target=get_http_client().warm_up, name='coze-warmup', daemon=True).start()
+
+
+def worker_exit(server, worker):
+    """退出前把队列里的日志写完"""
+    from app.utils.log_pipeline import stop_logging
+    stop_logging()
@@ -1,11 +1,7 @@
-from dotenv import load_dotenv
 import os
-from app import create_app
+from app import create_app  # 导入 app 包时加载 .env（见 app/config.py）
 import logging
 
-# 首先加载环境变量，这样后续的代码都能使用
-load_dotenv()
-
 # 配置日志
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -15,9 +11,6 @@ USE_AI_TALENTS = os.getenv('USE_AI_TALENTS', 'false').lower() == 'true'
 
 app = create_app()
 
-# 将设置注入到应用配置中
-app.config['USE_AI_TALENTS'] = USE_AI_TALENTS
-
 if __name__ == '__main__':
     logger.info("Starting the application...")
     logger.info(f"Using AI talents: {USE_AI_TALENTS}")
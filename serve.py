@@ -0,0 +1,76 @@
+"""
+生产环境入口，使用 gunicorn 的预 fork 多进程模式运行应用。
+
+    python serve.py                          # 按 gunicorn.conf.py 和 .env 中的配置启动
+    python serve.py --workers 4 --threads 8  # 命令行参数优先于环境变量
+    gunicorn                                 # 在项目根目录直接运行 gunicorn 效果相同
+
+主进程先创建应用并加载只读数据，然后 fork 出 worker：
+- kill -HUP <主进程>   重新读取配置，平滑替换全部 worker
+- kill -TERM <主进程>  停止接收新连接，等进行中的请求完成后退出
+
+开发调试仍然使用 python run.py。
+"""
+
+import os
+import gc
+import sys
+import runpy
+import argparse
+from app.config import load_environment
+
+load_environment()
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def create_production_app():
+    """创建应用并预加载资源（gunicorn 在 fork 之前调用）"""
+    from app import create_app, preload_resources
+
+    # Coze 连接由每个 worker 在 fork 之后预热，主进程不建立连接
+    app = create_app(warm_up=False)
+    preload_resources(app)
+    # 预加载的对象移出 GC 跟踪，避免 worker 里的垃圾回收触碰这些页面导致写时复制
+    gc.freeze()
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the game with gunicorn (pre-fork workers)')
+    parser.add_argument('--bind', help='address to listen on, e.g. 0.0.0.0:8000 (SERVE_BIND)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (SERVE_WORKERS)')
+    parser.add_argument('--threads', type=int, help='threads per worker (SERVE_THREADS)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 命令行参数通过环境变量传给 gunicorn.conf.py
+    for name, value in (('SERVE_BIND', args.bind), ('SERVE_WORKERS', args.workers),
+                        ('SERVE_THREADS', args.threads)):
+        if value is not None:
+            os.environ[name] = str(value)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is not available (pip install gunicorn; it does not run on Windows). "
+              "Use 'python run.py' for local development.", file=sys.stderr)
+        return 1
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            for key, value in runpy.run_path(CONFIG_PATH).items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return create_production_app()
+
+    ProductionServer().run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
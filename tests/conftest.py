@@ -0,0 +1,13 @@
+"""
+测试公共配置。
+
+各模块在导入时读取 os.getenv，这里在导入应用代码之前把日志等运行时目录指向临时目录，
+运行测试不会改动仓库里的 logs/。
+"""
+
+import os
+import tempfile
+
+_RUNTIME_DIR = tempfile.mkdtemp(prefix='lifesim-tests-')
+os.environ.setdefault('LOG_DIR', os.path.join(_RUNTIME_DIR, 'logs'))
+os.environ.setdefault('COZE_WARMUP', 'false')
@@ -0,0 +1,89 @@
+"""Idempotency-Key：重复请求返回第一次的结果，键无效返回 400，同一个键配不同请求体返回 422"""
+
+import pytest
+import app.resources
+from app import create_app
+
+SESSION_HEADERS = {'X-Session-Id': 'idempotency-test-session'}
+
+
+class FakeCozeSystems:
+    """代替 AsyncCozeSystems，记录事件请求次数，不访问 Coze"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail_next = False
+
+    async def process_event(self, context=None, game_state=None, session_id=None):
+        self.calls += 1
+        if self.fail_next:
+            self.fail_next = False
+            raise RuntimeError('Coze failed')
+        content = f"第{self.calls}个事件"
+        game_state.add_event(content)
+        return {'briefDescription': '测试', 'content': content, 'effects': {'wealth': 1},
+                'age': context.get('age'), 'triggers': {}}
+
+
+@pytest.fixture
+def coze(monkeypatch):
+    fake = FakeCozeSystems()
+    monkeypatch.setattr(app.resources, '_async_coze_systems', lambda resources: fake)
+    return fake
+
+
+@pytest.fixture
+def client(coze):
+    return create_app(warm_up=False).test_client()
+
+
+def post_event(client, key, age='15'):
+    headers = dict(SESSION_HEADERS)
+    if key is not None:
+        headers['Idempotency-Key'] = key
+    return client.post('/generate_event', json={'context': {'age': age}}, headers=headers)
+
+
+def test_repeated_key_replays_first_result(client, coze):
+    first = post_event(client, 'event-1')
+    second = post_event(client, 'event-1')
+
+    assert first.status_code == second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert second.headers.get('Idempotent-Replayed') == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert coze.calls == 1
+
+
+def test_new_key_runs_again(client, coze):
+    first = post_event(client, 'event-1')
+    second = post_event(client, 'event-2')
+
+    assert second.get_json()['version'] == first.get_json()['version'] + 1
+    assert coze.calls == 2
+
+
+def test_same_key_with_different_body_is_rejected(client, coze):
+    post_event(client, 'event-1', age='15')
+    response = post_event(client, 'event-1', age='16')
+
+    assert response.status_code == 422
+    assert coze.calls == 1
+
+
+@pytest.mark.parametrize('key', ['has space', '', 'x' * 256])
+def test_invalid_key_is_rejected(client, coze, key):
+    response = post_event(client, key)
+
+    assert response.status_code == 400
+    assert coze.calls == 0
+
+
+def test_failed_request_can_be_retried_with_same_key(client, coze):
+    coze.fail_next = True
+    assert post_event(client, 'event-1').status_code == 500
+    retried = post_event(client, 'event-1')
+
+    assert retried.status_code == 200
+    assert 'Idempotent-Replayed' not in retried.headers
+    assert coze.calls == 2
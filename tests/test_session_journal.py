@@ -0,0 +1,120 @@
+"""会话日志：崩溃时写了一半的尾部记录被截掉，压缩成快照后重放结果与写入前一致"""
+
+import os
+import pytest
+from app.models.state_delta import commit
+from app.utils.session_store import SessionStore
+from app.utils.session_journal import (
+    JournalSessionBackend, SessionJournal, SEGMENT_PREFIX, SNAPSHOT_PREFIX, encode_record
+)
+
+
+def open_store(directory, **options):
+    journal = SessionJournal(str(directory), fsync=False, **options)
+    return SessionStore(JournalSessionBackend(journal)), journal
+
+
+def play(store, session_id, years):
+    for _ in range(years):
+        with store.session(session_id) as state:
+            state.age += 1
+            state.add_event(f"{session_id} 的第 {state.age} 岁")
+            state.update_state(messages=f"{state.age}岁 小红: [生日快乐] [当天]")
+            state.apply_effects({'wealth': 1})
+            commit(state)
+
+
+def snapshot_of(store, session_ids):
+    return {session_id: store.get(session_id).to_dict() for session_id in session_ids}
+
+
+def files(directory, prefix):
+    return sorted(name for name in os.listdir(directory) if name.startswith(prefix))
+
+
+@pytest.mark.parametrize('torn', [
+    # 写到一半时进程崩溃
+    b'0000abcd {"op":"put","s":"session-torn","t":1',
+    # 整行写入但内容损坏（校验和不符，否则会删掉 session-a）
+    encode_record({"op": "del", "s": "session-x", "t": 1}).replace(b'session-x', b'session-a'),
+])
+def test_torn_tail_is_dropped_and_journal_stays_usable(tmp_path, torn):
+    store, journal = open_store(tmp_path)
+    play(store, 'session-a', 3)
+    play(store, 'session-b', 2)
+    expected = snapshot_of(store, ['session-a', 'session-b'])
+    journal.close()
+
+    segment = os.path.join(tmp_path, files(tmp_path, SEGMENT_PREFIX)[-1])
+    with open(segment, 'ab') as f:
+        f.write(torn)
+
+    store, journal = open_store(tmp_path)
+    assert snapshot_of(store, ['session-a', 'session-b']) == expected
+    assert store.get('session-torn') is None
+    # 恢复之后继续写入，再次恢复时新旧记录都在
+    play(store, 'session-b', 2)
+    expected = snapshot_of(store, ['session-a', 'session-b'])
+    journal.close()
+
+    store, journal = open_store(tmp_path)
+    assert snapshot_of(store, ['session-a', 'session-b']) == expected
+    assert store.backend.recovered == 2
+    journal.close()
+
+
+def test_open_truncates_torn_tail_of_last_segment(tmp_path, monkeypatch):
+    store, journal = open_store(tmp_path)
+    play(store, 'session-a', 2)
+    journal.close()
+    segment = os.path.join(tmp_path, files(tmp_path, SEGMENT_PREFIX)[-1])
+    valid_size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'0000abcd {"op":"upd","s":"session-a"')
+
+    journal = SessionJournal(str(tmp_path), fsync=False)
+    # 不启动后台压缩，否则被截断的日志段会并入快照后删除
+    monkeypatch.setattr(journal, '_start_compaction', lambda upto: None)
+    sessions = journal.open()
+    journal.close()
+
+    assert os.path.getsize(segment) == valid_size
+    assert sessions['session-a'][0].to_dict() == store.get('session-a').to_dict()
+
+
+def test_replay_after_compaction_matches_written_state(tmp_path):
+    # 每次写入都封存日志段并触发压缩
+    store, journal = open_store(tmp_path, segment_bytes=1)
+    for session_id in ('session-a', 'session-b', 'session-c'):
+        play(store, session_id, 4)
+    store.reset('session-c')
+    expected = snapshot_of(store, ['session-a', 'session-b'])
+    journal.close()
+    assert files(tmp_path, SNAPSHOT_PREFIX)
+
+    # 快照之后的变化只在日志段里
+    store, journal = open_store(tmp_path)
+    assert snapshot_of(store, ['session-a', 'session-b']) == expected
+    journal.close()
+    store, journal = open_store(tmp_path)
+    play(store, 'session-a', 2)
+    with store.session('session-b') as state:
+        state.update_state(characters=['小刚'], talents=['幸运'])
+        commit(state)
+    expected = snapshot_of(store, ['session-a', 'session-b'])
+    journal.close()
+
+    store, journal = open_store(tmp_path)
+    assert snapshot_of(store, ['session-a', 'session-b']) == expected
+    assert store.get('session-c') is None
+    assert store.backend.recovered == 2
+    journal.close()
+
+
+def test_closed_journal_rejects_writes(tmp_path):
+    store, journal = open_store(tmp_path)
+    play(store, 'session-a', 1)
+    journal.close()
+
+    with pytest.raises(OSError):
+        play(store, 'session-a', 1)
@@ -0,0 +1,135 @@
+"""会话存储：sqlite 后端的版本比较并交换，以及请求出错时的回滚"""
+
+import pytest
+from app.models.game_state import GameState
+from app.models.state_delta import StateConflict, commit
+from app.utils.session_store import SessionStore, MemorySessionBackend, SQLiteSessionBackend
+from app.utils.session_journal import JournalSessionBackend, SessionJournal
+
+SESSION_ID = 'session-0001'
+
+
+def make_store(kind, tmp_path):
+    if kind == 'memory':
+        return SessionStore(MemorySessionBackend())
+    if kind == 'sqlite':
+        return SessionStore(SQLiteSessionBackend(str(tmp_path / 'sessions.db')))
+    return SessionStore(JournalSessionBackend(SessionJournal(str(tmp_path / 'journal'), fsync=False)))
+
+
+def start_session(store):
+    """写入一个有历史记录、版本为 1 的会话，返回它的 to_dict()"""
+    with store.session(SESSION_ID) as state:
+        state.update_state(name='小明', city='上海', appearance=12, characters=['小红'])
+        state.add_event('第一次上学')
+        state.update_state(messages='14岁 小红: [你好] [当天]')
+        commit(state)
+    return store.get(SESSION_ID).to_dict()
+
+
+def mutate(state):
+    state.age += 1
+    state.apply_effects({'wealth': 5, 'physical': -30})
+    state.add_event('中了彩票')
+    state.update_state(messages='15岁 小红: [恭喜] [当天]', characters=['小刚'], talents=['幸运'])
+    commit(state)
+
+
+def test_sqlite_save_raises_conflict_when_another_worker_wrote_first(tmp_path):
+    # 两个 SessionStore 共用一个数据库文件，相当于两个 worker 进程
+    path = str(tmp_path / 'sessions.db')
+    first = SessionStore(SQLiteSessionBackend(path))
+    second = SessionStore(SQLiteSessionBackend(path))
+    start_session(first)
+
+    with pytest.raises(StateConflict) as conflict:
+        with first.session(SESSION_ID) as state:
+            with second.session(SESSION_ID) as other:
+                other.add_event('另一个 worker 的事件')
+                commit(other)
+            state.add_event('被覆盖的事件')
+            commit(state)
+
+    assert conflict.value.version == 2
+    stored = first.get(SESSION_ID)
+    assert stored.version == 2
+    assert [text for _, text in stored.events] == ['第一次上学', '另一个 worker 的事件']
+
+
+def test_sqlite_new_session_raises_conflict_when_inserted_concurrently(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    first = SessionStore(SQLiteSessionBackend(path))
+    second = SessionStore(SQLiteSessionBackend(path))
+
+    with pytest.raises(StateConflict):
+        with first.session(SESSION_ID) as state:
+            with second.session(SESSION_ID) as other:
+                other.name = '先到的'
+                commit(other)
+            state.name = '后到的'
+            commit(state)
+
+    assert first.get(SESSION_ID).name == '先到的'
+
+
+def test_sqlite_save_succeeds_when_version_matches(tmp_path):
+    store = SessionStore(SQLiteSessionBackend(str(tmp_path / 'sessions.db')))
+    start_session(store)
+    with store.session(SESSION_ID) as state:
+        mutate(state)
+    assert store.get(SESSION_ID).version == 2
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite', 'journal'])
+def test_exception_rolls_back_changes(kind, tmp_path):
+    store = make_store(kind, tmp_path)
+    before = start_session(store)
+
+    with pytest.raises(RuntimeError):
+        with store.session(SESSION_ID) as state:
+            mutate(state)
+            raise RuntimeError('Coze failed')
+
+    after = store.get(SESSION_ID)
+    assert after.to_dict() == before
+    assert after.get_parameters() == GameState.from_dict(before).get_parameters()
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite', 'journal'])
+def test_generator_exit_rolls_back_changes(kind, tmp_path):
+    store = make_store(kind, tmp_path)
+    before = start_session(store)
+
+    def stream():
+        # 与流式接口相同：在会话锁内逐段产出，客户端断开时生成器被关闭
+        with store.session(SESSION_ID) as state:
+            mutate(state)
+            yield 'delta'
+            yield 'done'
+
+    events = stream()
+    assert next(events) == 'delta'
+    events.close()
+
+    assert store.get(SESSION_ID).to_dict() == before
+
+
+def test_rollback_keeps_journal_incremental(tmp_path):
+    # 回滚原地恢复历史缓冲区，之后的写回仍然只记录变化
+    store = make_store('journal', tmp_path)
+    start_session(store)
+    with pytest.raises(RuntimeError):
+        with store.session(SESSION_ID) as state:
+            mutate(state)
+            raise RuntimeError('Coze failed')
+
+    appended = []
+    journal = store.backend.journal
+    original_append = journal.append
+    journal.append = lambda record: (appended.append(record), original_append(record))
+    with store.session(SESSION_ID) as state:
+        state.add_event('正常的一年')
+        commit(state)
+
+    assert [record['op'] for record in appended] == ['upd']
+    assert [event[2] for event in appended[0]['events']] == ['正常的一年']
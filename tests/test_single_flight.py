@@ -0,0 +1,100 @@
+"""请求合并：并发的相同调用只执行一次，执行者被取消时由等待者接替"""
+
+import time
+import asyncio
+import threading
+import pytest
+from app.utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'response'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', work)))
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('response', False)] + [('response', True)] * 3
+    assert flight.pending() == 0
+
+
+def test_leader_error_is_shared_and_not_cached():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('upstream failed')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    # 调用结束后立即移除，下一次重新执行
+    assert flight.do('key', lambda: 'ok') == ('ok', False)
+
+
+def test_cancelled_leader_hands_over_to_waiter():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        leader_started = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            if len(calls) == 1:
+                leader_started.set()
+                await asyncio.sleep(10)
+            return 'response'
+
+        leader = asyncio.ensure_future(flight.do_async('key', work))
+        await leader_started.wait()
+        waiter = asyncio.ensure_future(flight.do_async('key', work))
+        await asyncio.sleep(0)
+        assert flight.coalesced == 1
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # 等待者没有拿到取消，而是自己重新执行
+        result = await asyncio.wait_for(waiter, 5)
+        return result, len(calls), flight.pending()
+
+    assert asyncio.run(scenario()) == (('response', False), 2, 0)
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'response'
+
+        leader = asyncio.ensure_future(flight.do_async('key', work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async('key', work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await asyncio.wait_for(leader, 5)
+
+    assert asyncio.run(scenario()) == ('response', False)